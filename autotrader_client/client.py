@@ -9,18 +9,86 @@ from src.client_settings import (
     DEFAULT_ORDER_DIR,
     BUCKET_NAMES_PATH,
     BUCKET_DICT_KEY,
+    LOOP_STALL_INTERVAL,
+    LOOP_STALL_WARN,
+    ACTIVE_POLL_INTERVAL,
+    CLOSED_POLL_INTERVAL,
+    ACTIVITY_WINDOW,
+    CHECKPOINT_PATH,
+    CHECKPOINT_MAX_RECENT,
+    SEEN_WINDOW,
+    EXECUTION_WORKERS,
+    PREFETCH_WORKERS,
+    ASYNC_EXECUTION,
+    TD_REFRESH_MARGIN,
+    TD_KEEPALIVE_INTERVAL,
+    POSITION_RECONCILE_INTERVAL,
+    ORDER_BOOK_REFRESH_INTERVAL,
+    CHAIN_WARM_TICKERS,
+    CHAIN_WARM_INTERVAL,
+    CHAIN_WARM_DAYS,
+    QUOTE_SUBSCRIBE_INTERVAL,
 )
 import asyncio
 import json
 import src.bucket_listener as bl
 import src.order_monitor as om
+import src.loop_monitor as lm
+import src.poll_scheduler as ps
+import src.checkpoint as cp
+import src.execution_context as ec
+import src.token_refresher as tr
+import src.position_book as pb
+import src.order_book as ob
+import src.option_chains as oc
+import src.quote_cache as qc
 
 
-async def start_workers(bucket_name):
-    await asyncio.gather(
-        bl.BucketListener(bucket_name, GCP_CREDS_PATH, DEFAULT_ORDER_DIR).run(),
-        om.OrderMonitor(DEFAULT_ORDER_DIR).run(),
+async def start_workers(bucket_name, context):
+    # signals are handed from listener to monitor in-process
+    signal_queue = asyncio.Queue()
+    scheduler = ps.PollScheduler(
+        ACTIVE_POLL_INTERVAL, CLOSED_POLL_INTERVAL, ACTIVITY_WINDOW
     )
+    checkpoint = cp.SignalCheckpoint(CHECKPOINT_PATH, CHECKPOINT_MAX_RECENT)
+    try:
+        listener = bl.BucketListener(
+            bucket_name,
+            GCP_CREDS_PATH,
+            DEFAULT_ORDER_DIR,
+            signal_queue=signal_queue,
+            scheduler=scheduler,
+            checkpoint=checkpoint,
+        )
+        monitor = om.OrderMonitor(
+            DEFAULT_ORDER_DIR,
+            signal_queue=signal_queue,
+            scheduler=scheduler,
+            checkpoint=checkpoint,
+            on_processed=listener.acknowledge,
+            seen_window=SEEN_WINDOW,
+            max_workers=EXECUTION_WORKERS,
+            context=context,
+            prefetch_workers=PREFETCH_WORKERS,
+        )
+        # a paper-trading broker streams the prices it fills orders at
+        stream_factory = context.broker.quote_stream if context.broker else None
+        await asyncio.gather(
+            listener.run(),
+            monitor.run(),
+            lm.LoopStallMonitor(LOOP_STALL_INTERVAL, LOOP_STALL_WARN).run(),
+            tr.TokenRefresher(context, TD_REFRESH_MARGIN, TD_KEEPALIVE_INTERVAL).run(),
+            pb.PositionReconciler(context, POSITION_RECONCILE_INTERVAL).run(),
+            ob.OrderBookRefresher(context, ORDER_BOOK_REFRESH_INTERVAL).run(),
+            oc.ChainWarmer(
+                context, CHAIN_WARM_TICKERS, CHAIN_WARM_INTERVAL, CHAIN_WARM_DAYS
+            ).run(),
+            qc.QuoteStreamer(
+                context, QUOTE_SUBSCRIBE_INTERVAL, stream_factory=stream_factory
+            ).run(),
+        )
+    finally:
+        checkpoint.close()
 
 
 async def main():
@@ -31,8 +99,11 @@ async def main():
     with open(BUCKET_NAMES_PATH) as fp:
         bucket_name = json.load(fp)[BUCKET_DICT_KEY]
 
+    # authenticate once and load order settings before any signal arrives
+    context = ec.ExecutionContext(use_async=ASYNC_EXECUTION)
+
     # start workers
-    await start_workers(bucket_name)
+    await start_workers(bucket_name, context)
 
 
 if __name__ == "__main__":
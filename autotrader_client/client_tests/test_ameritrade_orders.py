@@ -3,9 +3,14 @@ import pytest
 import logging
 import datetime
 import math
+import time
 import copy
+import threading
 import tda
 import src.ameritrade_orders as am
+import src.position_book as pb
+import src.order_book as ob
+import src.quote_cache as qc
 
 USR_SET = {
     "max_ord_val": 2000,
@@ -162,7 +167,9 @@ def test_initialize_order_bto(monkeypatch):
     def mock_client_from_token_file(token_path, api_key):
         return tda.client.Client
 
-    def mock_process_bto_order(client, acct_num, order_params, usr_set):
+    def mock_process_bto_order(
+        client, acct_num, order_params, usr_set, positions, orders, prefetched, quotes
+    ):
         assert order_params["instruction"] == "BTO"
 
     monkeypatch.setattr(tda.auth, "client_from_token_file", mock_client_from_token_file)
@@ -177,7 +184,9 @@ def test_initialize_order_stc(monkeypatch):
     def mock_client_from_token_file(token_path, api_key):
         return tda.client.Client
 
-    def mock_process_stc_order(client, acct_num, order_params, usr_set):
+    def mock_process_stc_order(
+        client, acct_num, order_params, usr_set, positions, orders, prefetched, quotes
+    ):
         assert order_params["instruction"] == "STC"
 
     monkeypatch.setattr(tda.auth, "client_from_token_file", mock_client_from_token_file)
@@ -235,6 +244,18 @@ def test_process_bto_order_low_quantity(monkeypatch, capsys):
     assert captured.err == msg1 + msg2
 
 
+def test_process_bto_order_unknown_contract(monkeypatch, caplog):
+    """A BTO whose prefetched quote is empty is rejected without an order"""
+
+    def mock_place_order(acct_num, order_spec):
+        raise AssertionError("order placed")
+
+    client = tda.client.Client
+    monkeypatch.setattr(client, "place_order", mock_place_order)
+    am.process_bto_order(client, "123", VALID_ORD_INPUT, USR_SET, quote={})
+    assert "order rejected" in caplog.text
+
+
 def test_process_bto_order_low_risk(monkeypatch, capsys, caplog):
     """BTO order should be correctly processed with no risk or SL flag set """
     caplog.set_level(logging.INFO)
@@ -345,6 +366,42 @@ def test_process_bto_order_flagged_sl_ignored(monkeypatch, capsys, caplog):
     assert logged.split()[-1] == "PASSING"
 
 
+def test_prepare_bto_order_priced_from_quote(monkeypatch):
+    """A live ask below the contract price sizes and prices the order. An ask
+    above it leaves the percentage rules on the contract price"""
+    monkeypatch.setitem(VALID_ORD_INPUT, "instruction", "BTO")
+    quote = qc.Quote(bid=1.5, ask=1.6, last=1.55, received=None)
+    _, order = am.prepare_bto_order(VALID_ORD_INPUT, USR_SET, quote)
+    built = order.build()
+    assert built["price"] == "1.65"
+    assert built["orderLegCollection"][0]["quantity"] == 12
+    stop = built["childOrderStrategies"][0]
+    assert stop["stopPrice"] == "1.20"
+
+    quote = qc.Quote(bid=2.1, ask=2.2, last=2.15, received=None)
+    _, order = am.prepare_bto_order(VALID_ORD_INPUT, USR_SET, quote)
+    assert order.build()["price"] == "2.06"
+
+
+def test_current_quote_prefers_stream():
+    quotes = qc.QuoteCache()
+    rest = {"bidPrice": 1.8, "askPrice": 1.9}
+    assert am.current_quote("SYM", quotes, rest).bid == 1.8
+    quotes.connect()
+    quotes.update("SYM", {"BID_PRICE": 1.7})
+    assert am.current_quote("SYM", quotes, rest).bid == 1.7
+    assert am.current_quote("SYM") is None
+
+
+def test_plan_stc_orders_stop_from_bid(monkeypatch):
+    monkeypatch.setitem(VALID_ORD_INPUT["flags"], "reduce", 0.5)
+    quote = qc.Quote(bid=3.0, ask=3.1, last=3.05, received=None)
+    planned = am.plan_stc_orders("SPY_030321P380", 10, VALID_ORD_INPUT, USR_SET, quote)
+    assert planned[1][0].build()["stopPrice"] == "2.25"
+    planned = am.plan_stc_orders("SPY_030321P380", 10, VALID_ORD_INPUT, USR_SET)
+    assert planned[1][0].build()["stopPrice"] == "1.50"
+
+
 def test_calc_buy_order_quantity():
     """Returns rounded-down integer"""
     ret_val = am.calc_buy_order_quantity(price=1, ord_val=100, limit_percent=0)
@@ -416,6 +473,8 @@ def test_process_stc_order_no_pos(monkeypatch, caplog):
 
     monkeypatch.setitem(VALID_ORD_INPUT, "ticker", "XYZ")
     monkeypatch.setattr(am, "get_position_quant", mock_get_position_quant)
+    # orders are looked up alongside the position
+    monkeypatch.setattr(am, "get_existing_stc_orders", lambda client, symbol: [])
     am.process_stc_order(client, acct_num, VALID_ORD_INPUT, USR_SET)
     logged = caplog.text
     assert len(logged) == 0
@@ -454,6 +513,20 @@ def test_process_stc_order_no_existing_orders_no_reduce(monkeypatch, caplog):
     assert logged.split()[-1] == "PASAR"
 
 
+def test_process_stc_order_prefetched_state(monkeypatch, caplog):
+    """A prefetched position and STC order state is used without lookups"""
+    caplog.set_level(logging.INFO)
+    client = tda.client.Client
+
+    def mock_get_stc_state(*args):
+        raise AssertionError("state looked up")
+
+    monkeypatch.setattr(am, "get_stc_state", mock_get_stc_state)
+    monkeypatch.setattr(client, "place_order", lambda acct_num, order_spec: "PASAR")
+    am.process_stc_order(client, "123", VALID_ORD_INPUT, USR_SET, stc_state=(1, []))
+    assert caplog.text.split()[-1] == "PASAR"
+
+
 def test_process_stc_order_existing_orders_no_reduce(monkeypatch, caplog):
     """An STC order with existing STC orders and no reduce flag cancels existing orders
     and results in an STC market order"""
@@ -465,6 +538,7 @@ def test_process_stc_order_existing_orders_no_reduce(monkeypatch, caplog):
     class MockResponse:
         def __init__(self, content):
             self.content = content
+            self.is_error = False
 
     def mock_get_position_quant(client, acct_id, symbol):
         return pos_qty
@@ -511,6 +585,7 @@ def test_process_stc_order_existing_orders_reduce(monkeypatch, caplog):
     class MockResponse:
         def __init__(self, content):
             self.content = content
+            self.is_error = False
 
     def mock_get_position_quant(client, acct_id, symbol):
         return pos_qty
@@ -538,8 +613,226 @@ def test_process_stc_order_existing_orders_reduce(monkeypatch, caplog):
     logged = caplog.text
     assert logged.split()[2] == "CANCELLED:345"
     assert logged.split()[5] == "CANCELLED:456"
-    assert logged.split()[35] == "8"
-    assert logged.split()[65] == "2"
+    # cancel batch timing is logged after the cancel responses
+    assert logged.split()[8] == "Cancelled"
+    assert logged.split()[52] == "8"
+    assert logged.split()[82] == "2"
+
+
+def test_get_stc_state_requests_concurrently(monkeypatch):
+    """Position and order lookups overlap instead of running one after another"""
+    both_started = threading.Barrier(2, timeout=5)
+
+    def mock_get_position_quant(client, acct_id, symbol):
+        both_started.wait()
+        return 2.0
+
+    def mock_get_existing_stc_orders(client, symbol):
+        both_started.wait()
+        return ["345"]
+
+    monkeypatch.setattr(am, "get_position_quant", mock_get_position_quant)
+    monkeypatch.setattr(am, "get_existing_stc_orders", mock_get_existing_stc_orders)
+    state = am.get_stc_state(None, "123", "SPY_030321P380")
+    assert state == (2.0, ["345"])
+
+
+def test_process_stc_order_cancels_concurrently(monkeypatch, caplog):
+    """Existing STC orders are cancelled in parallel and logged in order"""
+    caplog.set_level(logging.INFO)
+    client = tda.client.Client
+    all_started = threading.Barrier(3, timeout=5)
+
+    class MockResponse:
+        def __init__(self, content):
+            self.content = content
+            self.is_error = False
+
+    def mock_cancel_order(ord_id, acct_num):
+        all_started.wait()
+        return MockResponse(f"CANCELLED:{ord_id}")
+
+    monkeypatch.setattr(am, "get_position_quant", lambda client, acct, sym: 1)
+    monkeypatch.setattr(
+        am, "get_existing_stc_orders", lambda client, sym: ["1", "2", "3"]
+    )
+    monkeypatch.setattr(client, "cancel_order", mock_cancel_order)
+    monkeypatch.setattr(client, "place_order", lambda acct_num, order_spec: "PASAR")
+    am.process_stc_order(client, "123", VALID_ORD_INPUT, USR_SET)
+    cancels = [word for word in caplog.text.split() if word.startswith("CANCELLED")]
+    assert cancels == ["CANCELLED:1", "CANCELLED:2", "CANCELLED:3"]
+
+
+class MockCancelClient:
+    """Records how many cancels run at once. Cancels of order "slow" block until
+    release is set and cancels of order "bad" raise"""
+
+    class Response:
+        def __init__(self, content):
+            self.content = content
+            self.is_error = False
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel_order(self, ord_id, acct_num):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if ord_id == "slow":
+                self.release.wait(timeout=5)
+            elif ord_id == "bad":
+                raise RuntimeError("cancel failed")
+            else:
+                time.sleep(0.02)
+            return self.Response(f"CANCELLED:{ord_id}")
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_cancel_orders_bounded_parallelism():
+    client = MockCancelClient()
+    order_ids = [str(i) for i in range(am.CANCEL_WORKERS * 2)]
+    batch = am.cancel_orders(client, "123", order_ids, "SPY_030321P380")
+    assert list(batch.responses) == order_ids
+    assert client.max_running == am.CANCEL_WORKERS
+    assert batch.failed == []
+    assert batch.timed_out == []
+    assert batch.elapsed > 0
+
+
+def test_cancel_orders_deadline_and_failures():
+    """Slow and failed cancels are reported without holding up the batch, and the
+    book no longer trusts the symbol"""
+    client = MockCancelClient()
+    symbol = "SPY_030321P380"
+    book = ob.OrderBook()
+    book.update([], 0)
+    try:
+        batch = am.cancel_orders(
+            client, "123", ["slow", "bad", "1"], symbol, book, deadline=0.1
+        )
+    finally:
+        client.release.set()
+    assert list(batch.responses) == ["1"]
+    assert batch.failed == ["bad"]
+    assert batch.timed_out == ["slow"]
+    assert batch.elapsed < 1
+    assert not book.is_known(symbol)
+
+
+def test_process_stc_order_uses_position_book(monkeypatch):
+    """An STC order reads the position from a seeded book without fetching the
+    account and records its own fill"""
+    client = tda.client.Client
+    acct_num = "123456789"
+    symbol = "SPY_030321P380"
+    book = pb.PositionBook()
+    book.reconcile([{"instrument": {"symbol": symbol}, "longQuantity": 3}], 0)
+
+    def mock_get_position_quant(client, acct_id, symbol):
+        raise AssertionError("account should not be fetched")
+
+    monkeypatch.setattr(am, "get_position_quant", mock_get_position_quant)
+    monkeypatch.setattr(am, "get_existing_stc_orders", lambda client, sym: [])
+    monkeypatch.setattr(client, "place_order", lambda acct_num, order_spec: "PASAR")
+    am.process_stc_order(client, acct_num, VALID_ORD_INPUT, USR_SET, book)
+    assert book.quantity(symbol) is None
+    assert book.is_known(symbol)
+
+
+def test_process_stc_order_uses_order_book(monkeypatch):
+    """Existing STC orders are found in a refreshed book without a query and the
+    cancels are recorded"""
+    client = tda.client.Client
+    symbol = "SPY_030321P380"
+    book = ob.OrderBook()
+    stop = {
+        "orderId": 345,
+        "status": "WORKING",
+        "orderLegCollection": [
+            {"instruction": "SELL_TO_CLOSE", "instrument": {"symbol": symbol}}
+        ],
+    }
+    book.update([stop], 0)
+    cancelled = []
+
+    class MockResponse:
+        content = "CANCELLED"
+        is_error = False
+
+    def mock_get_existing_stc_orders(client, option_symbol):
+        raise AssertionError("orders should not be queried")
+
+    def mock_cancel_order(ord_id, acct_num):
+        cancelled.append(ord_id)
+        return MockResponse
+
+    monkeypatch.setattr(am, "get_position_quant", lambda client, acct, sym: 1)
+    monkeypatch.setattr(am, "get_existing_stc_orders", mock_get_existing_stc_orders)
+    monkeypatch.setattr(client, "cancel_order", mock_cancel_order)
+    monkeypatch.setattr(client, "place_order", lambda acct_num, order_spec: "PASAR")
+    am.process_stc_order(client, "123", VALID_ORD_INPUT, USR_SET, orders=book)
+    assert cancelled == ["345"]
+    assert book.stc_orders(symbol) == []
+
+
+def test_process_stc_order_rejected_cancel(monkeypatch, caplog):
+    """A cancel TDA answers with an error is failed, the book stops trusting the
+    symbol and nothing is sold into the position the stop still holds"""
+    client = tda.client.Client
+    symbol = "SPY_030321P380"
+    book = ob.OrderBook()
+    stop = {
+        "orderId": 345,
+        "status": "WORKING",
+        "orderLegCollection": [
+            {"instruction": "SELL_TO_CLOSE", "instrument": {"symbol": symbol}}
+        ],
+    }
+    book.update([stop], 0)
+    placed = []
+
+    class MockResponse:
+        content = "order cannot be canceled"
+        status_code = 400
+        is_error = True
+
+    monkeypatch.setattr(am, "get_position_quant", lambda client, acct, sym: 1)
+    monkeypatch.setattr(
+        client, "cancel_order", lambda ord_id, acct_num: MockResponse
+    )
+    monkeypatch.setattr(
+        client, "place_order", lambda acct_num, order_spec: placed.append(order_spec)
+    )
+    am.process_stc_order(client, "123", VALID_ORD_INPUT, USR_SET, orders=book)
+    assert placed == []
+    assert not book.is_known(symbol)
+    assert "TDA rejected cancel of order 345: 400" in caplog.text
+    assert "STC order not placed" in caplog.text
+
+
+def test_lookup_position_quant_fetches_unknown(monkeypatch):
+    """Unknown symbols are fetched once and recorded in the book"""
+    fetched = []
+
+    def mock_get_position_quant(client, acct_id, symbol):
+        fetched.append(symbol)
+        return 2.0
+
+    monkeypatch.setattr(am, "get_position_quant", mock_get_position_quant)
+    book = pb.PositionBook()
+    book.reconcile([], 0)
+    book.expect_fill("SPY_030321P380")
+    for _ in range(2):
+        qty = am.lookup_position_quant(None, "123", "SPY_030321P380", book)
+        assert qty == 2.0
+    assert fetched == ["SPY_030321P380"]
 
 
 def test_get_position_quant(monkeypatch):
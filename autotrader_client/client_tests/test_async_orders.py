@@ -0,0 +1,255 @@
+"""Tests for async_orders.py"""
+import asyncio
+import logging
+import threading
+import datetime
+import src.async_orders as ao
+import src.position_book as pb
+import src.order_book as ob
+import src.option_chains as oc
+import src.quote_cache as qc
+
+USR_SET = {
+    "max_ord_val": 2000,
+    "high_risk_ord_val": 1000,
+    "buy_limit_percent": 0.03,
+    "SL_percent": 0.25,
+}
+
+SYMBOL = "SPY_030321P380"
+
+
+def order_params(instruction="STC", reduce=None):
+    return {
+        "instruction": instruction,
+        "ticker": "SPY",
+        "strike_price": "380",
+        "contract_type": "P",
+        "expiration": datetime.datetime(2021, 3, 3, 0, 0),
+        "contract_price": 2.00,
+        "comments": None,
+        "flags": {"SL": None, "risk_level": None, "reduce": reduce},
+    }
+
+
+def stc_order(order_id, status="WORKING"):
+    return {
+        "orderId": order_id,
+        "status": status,
+        "orderStrategyType": "SINGLE",
+        "orderLegCollection": [
+            {"instruction": "SELL_TO_CLOSE", "instrument": {"symbol": SYMBOL}}
+        ],
+    }
+
+
+class MockResponse:
+    def __init__(self, content=None, data=None, order_id=None):
+        self.content = content
+        self._data = data
+        self.is_error = False
+        self.status_code = 201
+        self.headers = {}
+        if order_id is not None:
+            self.headers["Location"] = (
+                f"https://api.tdameritrade.com/v1/accounts/123/orders/{order_id}"
+            )
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        pass
+
+    def __str__(self):
+        return str(self.content)
+
+
+class MockAsyncClient:
+    """Asyncio TDA client that takes delay seconds to answer each request and
+    records how many requests were in flight at once. Cancels of order "slow"
+    never finish and cancels of order "bad" raise"""
+
+    def __init__(self, pos_qty=10, orders=(), delay=0.02):
+        self.pos_qty = pos_qty
+        self.orders = list(orders)
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.requests = []
+        self.placed = []
+
+    async def _request(self, name, response):
+        self.requests.append(name)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            return response
+        finally:
+            self.running -= 1
+
+    async def get_account(self, acct_id, fields=None):
+        positions = [
+            {"instrument": {"symbol": SYMBOL}, "longQuantity": self.pos_qty}
+        ]
+        data = {"securitiesAccount": {"positions": positions}}
+        return await self._request("account", MockResponse(data=data))
+
+    async def get_orders_by_query(self, from_entered_datetime=None, statuses=None):
+        return await self._request("orders", MockResponse(data=self.orders))
+
+    async def cancel_order(self, ord_id, acct_num):
+        if ord_id == "slow":
+            await asyncio.sleep(5)
+        elif ord_id == "bad":
+            raise RuntimeError("cancel failed")
+        response = MockResponse(f"CANCELLED:{ord_id}")
+        if ord_id == "rejected":
+            response.is_error = True
+            response.status_code = 400
+        return await self._request("cancel", response)
+
+    async def place_order(self, acct_num, order_spec):
+        built = order_spec.build()
+        self.placed.append(built)
+        order_id = 900 + len(self.placed)
+        return await self._request("place", MockResponse(built, order_id=order_id))
+
+
+class MockChainClient:
+    """Synchronous TDA client answering option chain requests. Records the
+    thread each request is made on"""
+
+    def __init__(self):
+        self.threads = []
+
+    def get_option_chain(self, ticker, from_date=None, to_date=None):
+        self.threads.append(threading.current_thread())
+        chain = {"putExpDateMap": {"2021-03-03:5": {"380.0": []}}}
+        return MockResponse(data=chain)
+
+
+class MockContext:
+    def __init__(self, client):
+        self.client = None  # the chain cache answers without a request
+        self.async_client = client
+        self.acct_num = "123"
+        self.usr_set = USR_SET
+        self.positions = pb.PositionBook()
+        self.orders = ob.OrderBook()
+        self.chains = oc.OptionChainCache()
+        self.quotes = qc.QuoteCache()
+        listed = {"C": frozenset(), "P": frozenset([380.0])}
+        self.chains.put("SPY", datetime.date(2021, 3, 3), listed)
+
+
+def test_initialize_order_bto():
+    """BTO order is placed and the books wait for its fill and stop order"""
+    client = MockAsyncClient()
+    context = MockContext(client)
+    context.positions.reconcile([], 0)
+    context.orders.update([], 0)
+    asyncio.run(ao.initialize_order(order_params("BTO"), context))
+    assert client.requests == ["place"]
+    assert client.placed[0]["orderStrategyType"] == "TRIGGER"
+    assert not context.positions.is_known(SYMBOL)
+    assert not context.orders.is_known(SYMBOL)
+
+
+def test_process_stc_order_reduce():
+    """Lookups overlap, existing orders are cancelled and the remainder is
+    protected by a new stop that is indexed in the book"""
+    client = MockAsyncClient(pos_qty=10, orders=[stc_order(1), stc_order(2)])
+    context = MockContext(client)
+    asyncio.run(ao.initialize_order(order_params(reduce=0.75), context))
+    assert client.requests[:2] == ["account", "orders"]
+    assert client.requests[2:] == ["cancel", "cancel", "place", "place"]
+    assert client.max_running == 2
+    quantities = [order["orderLegCollection"][0]["quantity"] for order in client.placed]
+    assert quantities == [8, 2]
+    assert context.positions.quantity(SYMBOL) == 2
+    assert context.orders.stc_orders(SYMBOL) == ["902"]
+
+
+def test_process_stc_order_rejected_cancel():
+    """Nothing is sold while an existing order may still hold the position"""
+    client = MockAsyncClient(orders=[stc_order("rejected"), stc_order(2)])
+    context = MockContext(client)
+    asyncio.run(ao.initialize_order(order_params(), context))
+    assert client.requests[2:] == ["cancel", "cancel"]
+    assert client.placed == []
+
+
+def test_process_stc_order_uses_books():
+    client = MockAsyncClient()
+    context = MockContext(client)
+    context.positions.reconcile([], 0)
+    context.orders.update([], 0)
+    asyncio.run(ao.initialize_order(order_params(), context))
+    # no position is held so nothing is requested
+    assert client.requests == []
+
+
+def test_process_stc_order_no_pos():
+    client = MockAsyncClient(pos_qty=0)
+    asyncio.run(ao.process_stc_order(client, "123", order_params(), USR_SET))
+    assert client.placed == []
+
+
+def test_orders_overlap():
+    """Orders for different symbols placed at once share the event loop"""
+    client = MockAsyncClient()
+
+    async def main():
+        params = [order_params("BTO"), order_params("BTO")]
+        params[1]["strike_price"] = "381"
+        await asyncio.gather(
+            *(ao.process_bto_order(client, "123", p, USR_SET) for p in params)
+        )
+
+    asyncio.run(main())
+    assert client.max_running == 2
+
+
+def test_cancel_orders_bounded_parallelism(caplog):
+    caplog.set_level(logging.INFO)
+    client = MockAsyncClient()
+    order_ids = [str(i) for i in range(ao.CANCEL_WORKERS * 2)]
+    batch = asyncio.run(ao.cancel_orders(client, "123", order_ids, SYMBOL))
+    assert list(batch.responses) == order_ids
+    assert client.max_running == ao.CANCEL_WORKERS
+    assert batch.failed == []
+    assert batch.timed_out == []
+    assert f"Cancelled 8 of 8 orders for {SYMBOL}" in caplog.text
+
+
+def test_cancel_orders_deadline_and_failures():
+    client = MockAsyncClient()
+    book = ob.OrderBook()
+    book.update([], 0)
+    batch = asyncio.run(
+        ao.cancel_orders(client, "123", ["slow", "bad", "1"], SYMBOL, book, 0.1)
+    )
+    assert list(batch.responses) == ["1"]
+    assert batch.failed == ["bad"]
+    assert batch.timed_out == ["slow"]
+    assert batch.elapsed < 1
+    assert not book.is_known(SYMBOL)
+
+
+def test_initialize_order_fetches_chain_off_loop():
+    """A contract missing from the chain cache is checked on an executor thread
+    before the order is placed"""
+    client = MockAsyncClient()
+    context = MockContext(client)
+    context.client = MockChainClient()
+    context.chains = oc.OptionChainCache()
+    context.positions.reconcile([], 0)
+    context.orders.update([], 0)
+    assert context.chains.needs_fetch(order_params("BTO"))
+    asyncio.run(ao.initialize_order(order_params("BTO"), context))
+    assert len(context.client.threads) == 1
+    assert context.client.threads[0] is not threading.main_thread()
+    assert client.requests == ["place"]
+    assert not context.chains.needs_fetch(order_params("BTO"))
@@ -0,0 +1,329 @@
+import time
+import json
+import asyncio
+import datetime
+import tempfile
+import threading
+import google.auth.transport.requests
+from google.oauth2 import service_account
+import src.bucket_listener as bl
+import src.loop_monitor as lm
+import src.checkpoint as cp
+import src.storage_backend as sb
+
+
+class MockBlob:
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def __init__(self, name, time_created, fail=False):
+        self.name = name
+        self.time_created = time_created
+        self.fail = fail
+
+    def download_as_bytes(self):
+        with MockBlob.lock:
+            MockBlob.active += 1
+            MockBlob.max_active = max(MockBlob.max_active, MockBlob.active)
+        time.sleep(0.05)  # simulated network round trip
+        with MockBlob.lock:
+            MockBlob.active -= 1
+        if self.fail:
+            raise ConnectionError("download failed")
+        return json.dumps({"name": self.name}).encode()
+
+
+class MockBackend(sb.StorageBackend):
+    def __init__(self, blobs=None, list_latency=0.0):
+        self.blobs = blobs if blobs is not None else []
+        self.list_latency = list_latency
+
+    def list_blobs(self, bucket_name, prefix=None):
+        time.sleep(self.list_latency)
+        return iter(self.blobs)
+
+    def download_bytes(self, bucket_name, blob_name):
+        blob = next(blob for blob in self.blobs if blob.name == blob_name)
+        return blob.download_as_bytes()
+
+    def upload_bytes(self, bucket_name, blob_name, data, content_type=None):
+        pass
+
+    def delete_blob(self, bucket_name, blob_name):
+        self.blobs = [blob for blob in self.blobs if blob.name != blob_name]
+
+
+def make_listener(monkeypatch, directory, backend, checkpoint=None):
+    return bl.BucketListener(
+        "bucket",
+        "creds.json",
+        directory,
+        sleep_time=0.01,
+        checkpoint=checkpoint,
+        backend=backend,
+        signal_prefix="",
+    )
+
+
+def test_get_newest_downloads_recent_blobs(monkeypatch):
+    """Only blobs created since the last update are downloaded"""
+    with tempfile.TemporaryDirectory() as tmp:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        blobs = [
+            MockBlob("old.json", now - datetime.timedelta(hours=1)),
+            MockBlob("new.json", now),
+        ]
+        listener = make_listener(monkeypatch, tmp, MockBackend(blobs))
+        signals = listener._get_newest()
+        assert [name for name, data in signals] == ["new.json"]
+
+
+def test_get_newest_parallel_burst(monkeypatch):
+    """A burst of blobs is downloaded concurrently and returned in signal order"""
+    with tempfile.TemporaryDirectory() as tmp:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        names = [f"SPY{i}.json" for i in range(5)]
+        blobs = [
+            MockBlob(name, now + datetime.timedelta(milliseconds=i))
+            for i, name in enumerate(names)
+        ]
+        listener = make_listener(monkeypatch, tmp, MockBackend(blobs[::-1]))
+        MockBlob.max_active = 0
+        signals = listener._get_newest()
+        assert [name for name, data in signals] == names
+        assert 1 < MockBlob.max_active <= 4
+
+
+def test_get_newest_download_failure(monkeypatch):
+    """A failed download does not stop the rest of the burst and is retried"""
+    with tempfile.TemporaryDirectory() as tmp:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        blobs = [
+            MockBlob(f"SPY{i}.json", now - datetime.timedelta(seconds=3 - i))
+            for i in range(3)
+        ]
+        blobs[1].fail = True
+        listener = make_listener(monkeypatch, tmp, MockBackend(blobs))
+        signals = listener._get_newest()
+        assert [name for name, data in signals] == ["SPY0.json", "SPY2.json"]
+        assert listener._updated == blobs[1].time_created
+
+        blobs[1].fail = False
+        signals = listener._get_newest()
+        assert [name for name, data in signals] == ["SPY1.json"]
+        assert listener._failures == {}
+
+
+def test_get_newest_gives_up_on_failing_blob(monkeypatch, caplog):
+    """A blob that never downloads stops holding back the listening position"""
+    with tempfile.TemporaryDirectory() as tmp:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        blob = MockBlob("SPY0.json", now - datetime.timedelta(seconds=1), fail=True)
+        listener = bl.BucketListener(
+            "bucket",
+            "creds.json",
+            tmp,
+            backend=MockBackend([blob]),
+            signal_prefix="",
+            download_attempts=3,
+        )
+        for _ in range(2):
+            assert listener._get_newest() == []
+            assert listener._updated == blob.time_created
+        assert listener._get_newest() == []
+        assert listener._updated > blob.time_created
+        assert "Giving up on SPY0.json after 3 failed downloads" in caplog.text
+        # not downloaded again while it can still be listed
+        blob.fail = False
+        assert listener._get_newest() == []
+
+
+def test_write_signals(monkeypatch):
+    """Signals are written to the local directory with no partial files left"""
+    with tempfile.TemporaryDirectory() as tmp:
+        listener = make_listener(monkeypatch, tmp, MockBackend())
+        signals = [("a.json", b"{}"), ("b.json", b"[]")]
+        file_names = listener._write_signals(signals)
+        partition = bl.utils.signal_partition(tmp)
+        assert file_names == [bl.os.path.join(partition, name) for name, _ in signals]
+        assert sorted(bl.os.listdir(partition)) == ["a.json", "b.json"]
+
+
+def test_run_enqueues_signals(monkeypatch):
+    """Parsed signals are put on the queue in order and written for audit"""
+    with tempfile.TemporaryDirectory() as tmp:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        names = [f"SPY{i}.json" for i in range(3)]
+        blobs = [
+            MockBlob(name, now + datetime.timedelta(milliseconds=i))
+            for i, name in enumerate(names)
+        ]
+        listener = make_listener(monkeypatch, tmp, MockBackend(blobs))
+
+        async def main():
+            queue = asyncio.Queue()
+            listener._signal_queue = queue
+            task = asyncio.ensure_future(listener.run())
+            received = [
+                await asyncio.wait_for(queue.get(), timeout=5) for _ in names
+            ]
+            task.cancel()
+            return received
+
+        received = asyncio.run(main())
+        listener._executor.shutdown()
+        assert [(name, params) for name, created, params in received] == [
+            (name, {"name": name}) for name in names
+        ]
+        assert sorted(bl.os.listdir(bl.utils.signal_partition(tmp))) == names
+
+
+def test_authenticate_client_shared_session(monkeypatch):
+    """Storage client is built on one authorized session whose connection pool
+    holds a connection for every concurrent download"""
+
+    class MockCredentials:
+        project_id = "project"
+
+    created = {}
+
+    def mock_client(**kwargs):
+        created.update(kwargs)
+        return object()
+
+    mock_client.SCOPE = bl.storage.Client.SCOPE
+    credentials = MockCredentials()
+    monkeypatch.setattr(
+        service_account.Credentials,
+        "from_service_account_file",
+        lambda path, scopes: credentials,
+    )
+    monkeypatch.setattr(bl.storage, "Client", mock_client)
+    with tempfile.TemporaryDirectory() as tmp:
+        bl.BucketListener("bucket", "creds.json", tmp, max_downloads=6)
+    session = created["_http"]
+    assert isinstance(session, google.auth.transport.requests.AuthorizedSession)
+    assert session.credentials is credentials
+    assert created["credentials"] is credentials
+    assert created["project"] == "project"
+    pool_manager = session.get_adapter("https://storage.googleapis.com").poolmanager
+    assert pool_manager.connection_pool_kw["maxsize"] == 6
+
+
+def test_run_does_not_stall_loop(monkeypatch):
+    """Blocking GCS calls run off the event loop"""
+    list_latency = 0.5
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = MockBackend(list_latency=list_latency)
+        listener = make_listener(monkeypatch, tmp, backend)
+
+        async def measure(worker):
+            monitor = lm.LoopStallMonitor(interval=0.01)
+            tasks = [
+                asyncio.ensure_future(worker()),
+                asyncio.ensure_future(monitor.run()),
+            ]
+            await asyncio.sleep(2 * list_latency)
+            for task in tasks:
+                task.cancel()
+            return monitor
+
+        async def blocking_worker():
+            # the same listing called directly on the loop, for comparison
+            while True:
+                listener._get_newest()
+                await asyncio.sleep(0.01)
+
+        blocking = asyncio.run(measure(blocking_worker))
+        listener._updated = datetime.datetime.now(datetime.timezone.utc)
+        offloaded = asyncio.run(measure(listener.run))
+        listener._executor.shutdown()
+        assert offloaded.samples > blocking.samples
+        assert offloaded.max_stall < blocking.max_stall / 2
+
+
+def test_resume_from_checkpoint(monkeypatch):
+    """Listener resumes from its checkpoint and redelivers unprocessed signals"""
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = cp.SignalCheckpoint(bl.os.path.join(tmp, "cp.db"))
+        stopped = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            hours=1
+        )
+        created = [stopped - datetime.timedelta(minutes=i) for i in range(3)]
+        blobs = [
+            MockBlob("done.json", created[0]),
+            MockBlob("pending.json", created[1]),
+            MockBlob("missed.json", stopped + datetime.timedelta(minutes=30)),
+            MockBlob("old.json", created[2] - datetime.timedelta(minutes=1)),
+        ]
+        checkpoint.commit(
+            cp.LISTENER, stopped, {"done.json": created[0], "pending.json": created[1]}
+        )
+        checkpoint.commit(cp.MONITOR, stopped, {"done.json": stopped})
+        listener = make_listener(
+            monkeypatch, tmp, MockBackend(blobs), checkpoint=checkpoint
+        )
+        assert listener._updated == created[1]
+        signals = listener._get_newest()
+        assert [name for name, data in signals] == ["pending.json", "missed.json"]
+        checkpoint.close()
+
+
+def test_enqueue_signals_skips_invalid(monkeypatch):
+    """Unparseable signals are not queued or reported as handed off"""
+    with tempfile.TemporaryDirectory() as tmp:
+        listener = make_listener(monkeypatch, tmp, MockBackend())
+        now = datetime.datetime.now(datetime.timezone.utc)
+        listener._delivered = {"bad.json": now, "good.json": now}
+        listener._signal_queue = asyncio.Queue()
+        handed_off = listener._enqueue_signals(
+            [("bad.json", b"{not json"), ("good.json", b"{}")]
+        )
+        assert handed_off == ["good.json"]
+        assert listener._signal_queue.get_nowait() == ("good.json", now, {})
+        assert listener._signal_queue.empty()
+
+
+def test_log_audit_failure(caplog):
+    """Failed audit writes are logged rather than lost"""
+    future = bl.concurrent.futures.Future()
+    future.set_exception(OSError("disk full"))
+    bl.BucketListener._log_audit_failure(future)
+    assert "disk full" in caplog.text
+
+
+def test_memory_backend_throughput(monkeypatch):
+    """Thousands of blobs can be driven through the listener without credentials"""
+    backend = sb.MemoryBackend()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    names = [f"SPY{i:05d}.json" for i in range(2000)]
+    for i, name in enumerate(names):
+        created = now - datetime.timedelta(seconds=4) + datetime.timedelta(
+            microseconds=i
+        )
+        backend.put("bucket", name, json.dumps({"id": i}), time_created=created)
+    with tempfile.TemporaryDirectory() as tmp:
+        listener = make_listener(monkeypatch, tmp, backend)
+        signals = listener._get_newest()
+        assert [name for name, data in signals] == names
+        assert backend.requests["download_bytes"] == len(names)
+        assert listener._get_newest() == []
+
+
+def test_signal_prefix_and_acknowledge():
+    """Signals are listed under the signal prefix and acknowledged under the
+    acknowledgment prefix"""
+    backend = sb.MemoryBackend()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    backend.put("bucket", "signals/SPY.json", b"{}", time_created=now)
+    backend.put("bucket", "acks/old.json", b"", time_created=now)
+    with tempfile.TemporaryDirectory() as tmp:
+        listener = bl.BucketListener(
+            "bucket", "creds.json", tmp, backend=backend, ack_prefix="acks/"
+        )
+        signals = listener._get_newest()
+        assert signals == [("SPY.json", b"{}")]
+        listener.acknowledge("SPY.json")
+        listener._download_pool.shutdown()
+        assert backend.download_bytes("bucket", "acks/SPY.json") == b""
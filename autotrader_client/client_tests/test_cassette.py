@@ -0,0 +1,160 @@
+"""Tests for cassette.py"""
+import os
+import json
+import time
+import asyncio
+import datetime
+import tempfile
+import httpx
+import pytest
+import tda
+import src.cassette as cas
+import src.ameritrade_orders as am
+
+SYMBOL = "SPY_030321P380"
+ORDERS = [
+    {
+        "orderId": 900 + i,
+        "status": "WORKING",
+        "orderStrategyType": "SINGLE",
+        "orderLegCollection": [
+            {"instruction": "SELL_TO_CLOSE", "instrument": {"symbol": SYMBOL}}
+        ],
+    }
+    for i in range(50)
+]
+
+
+def handler(request):
+    """Answers like TDA"""
+    path = request.url.path
+    if path == "/v1/oauth2/token":
+        return httpx.Response(200, json={"access_token": "secret", "expires_in": 1800})
+    if request.method == "POST":
+        location = "https://api.tdameritrade.com/v1/accounts/123/orders/1001"
+        return httpx.Response(201, headers={"Location": location})
+    if path == "/v1/orders":
+        return httpx.Response(200, json=ORDERS)
+    positions = [{"instrument": {"symbol": SYMBOL}, "longQuantity": 5.0}]
+    return httpx.Response(200, json={"securitiesAccount": {"positions": positions}})
+
+
+def session_calls(client, hours=32):
+    """Makes the requests of an STC order. Returns what the order code read"""
+    start = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    response = client.place_order("123", am.build_stc_market_order(SYMBOL, 5))
+    return (
+        am.get_position_quant(client, "123", SYMBOL),
+        len(am.query_orders(client, start)),
+        am.placed_order_id(client, "123", response),
+    )
+
+
+def record_session(path):
+    session = httpx.Client(transport=httpx.MockTransport(handler))
+    client = tda.client.Client("key", session)
+    recorder = cas.CassetteRecorder(path)
+    cas.record(client, recorder)
+    result = session_calls(client)
+    session.post(
+        "https://api.tdameritrade.com/v1/oauth2/token",
+        data={"grant_type": "refresh_token", "refresh_token": "secret"},
+    )
+    recorder.close()
+    assert recorder.recorded == 4
+    return result
+
+
+def test_record_and_replay():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tda.jsonl.gz")
+        recorded = record_session(path)
+        assert recorded == (5.0, 50, 1001)
+        with cas.open_cassette(path) as fp:
+            text = fp.read()
+        assert "secret" not in text
+        assert "apikey" not in text
+        client = cas.replay_client(path)
+        # the orders query starts at another time than it did when recorded
+        assert session_calls(client, hours=72) == recorded
+        # every recorded exchange is used once
+        with pytest.raises(cas.CassetteMiss):
+            am.get_positions(client, "123")
+
+
+def write_cassette(path, exchanges):
+    with cas.open_cassette(path, "w") as fp:
+        for exchange in exchanges:
+            fp.write(json.dumps(exchange) + "\n")
+
+
+def exchange(offset, symbol):
+    return {
+        "offset": offset,
+        "elapsed": 0.05,
+        "method": "GET",
+        "url": f"https://api.tdameritrade.com/v1/marketdata/{symbol}/quotes",
+        "body": "",
+        "status": 200,
+        "headers": {"content-type": "application/json"},
+        "content": json.dumps({symbol: {"askPrice": offset}}),
+    }
+
+
+def test_replay_timing():
+    """Responses keep their recorded timing at speed 1 and are immediate without
+    a speed"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tda.jsonl")
+        write_cassette(path, [exchange(10.0, "A"), exchange(10.2, "B")])
+        client = cas.replay_client(path, speed=1)
+        start = time.monotonic()
+        assert am.get_quote(client, "A") == {"askPrice": 10.0}
+        assert am.get_quote(client, "B") == {"askPrice": 10.2}
+        assert time.monotonic() - start >= 0.24
+        client = cas.replay_client(path)
+        start = time.monotonic()
+        am.get_quote(client, "A")
+        am.get_quote(client, "B")
+        assert time.monotonic() - start < 0.1
+
+
+def test_async_replay_matches_out_of_order_requests():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tda.jsonl")
+        write_cassette(path, [exchange(0.0, "A"), exchange(0.1, "B")])
+        client = cas.replay_client(path, speed=4, use_async=True)
+
+        async def main():
+            responses = await asyncio.gather(
+                client.get_quote("B"), client.get_quote("A")
+            )
+            return [response.json() for response in responses]
+
+        assert asyncio.run(main()) == [
+            {"B": {"askPrice": 0.1}},
+            {"A": {"askPrice": 0.0}},
+        ]
+
+
+def test_chain_dates_are_matched():
+    """Chains for different expirations are told apart by their dates"""
+    day = datetime.date(2021, 3, 3)
+    later = datetime.date(2021, 3, 5)
+
+    def chain_handler(request):
+        return httpx.Response(200, json={"toDate": request.url.params["toDate"]})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tda.jsonl")
+        session = httpx.Client(transport=httpx.MockTransport(chain_handler))
+        client = tda.client.Client("key", session)
+        recorder = cas.CassetteRecorder(path)
+        cas.record(client, recorder)
+        recorded = [am.get_option_chain(client, "SPY", d, d) for d in (day, later)]
+        recorder.close()
+        client = cas.replay_client(path)
+        # replayed in another order than recorded
+        assert am.get_option_chain(client, "SPY", later, later) == recorded[1]
+        assert am.get_option_chain(client, "SPY", day, day) == recorded[0]
+        assert recorded[0] != recorded[1]
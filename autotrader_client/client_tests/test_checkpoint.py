@@ -0,0 +1,38 @@
+import os
+import datetime
+import tempfile
+import src.checkpoint as cp
+
+NOW = datetime.datetime(2021, 3, 3, 15, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_position_round_trip():
+    """Positions persist across checkpoint instances"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state", "checkpoint.db")
+        checkpoint = cp.SignalCheckpoint(path)
+        assert checkpoint.position(cp.LISTENER) is None
+        checkpoint.commit(cp.LISTENER, NOW, {"a.json": NOW})
+        checkpoint.close()
+
+        checkpoint = cp.SignalCheckpoint(path)
+        assert checkpoint.position(cp.LISTENER) == NOW
+        assert checkpoint.recent(cp.LISTENER) == {"a.json": NOW}
+        assert checkpoint.position(cp.MONITOR) is None
+        assert checkpoint.recent(cp.MONITOR) == {}
+        checkpoint.close()
+
+
+def test_recent_is_bounded():
+    """Only the newest max_recent signal ids are kept"""
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = cp.SignalCheckpoint(os.path.join(tmp, "cp.db"), max_recent=3)
+        for i in range(10):
+            position = NOW + datetime.timedelta(seconds=i)
+            checkpoint.commit(cp.MONITOR, position, {f"{i}.json": position})
+        assert sorted(checkpoint.recent(cp.MONITOR)) == ["7.json", "8.json", "9.json"]
+        assert checkpoint.is_recent(cp.MONITOR, "9.json")
+        assert not checkpoint.is_recent(cp.MONITOR, "0.json")
+        assert not checkpoint.is_recent(cp.LISTENER, "9.json")
+        assert checkpoint.position(cp.MONITOR) == NOW + datetime.timedelta(seconds=9)
+        checkpoint.close()
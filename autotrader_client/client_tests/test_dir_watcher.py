@@ -0,0 +1,30 @@
+import os
+import tempfile
+import pytest
+import src.dir_watcher as dw
+
+pytestmark = pytest.mark.skipif(
+    not dw.inotify_available(), reason="inotify is only available on Linux"
+)
+
+
+def test_read_events_close_write_and_move():
+    """Closed and moved-in files are reported in order; open files are not"""
+    with tempfile.TemporaryDirectory() as tmp:
+        watcher = dw.InotifyWatcher(tmp)
+        try:
+            assert watcher.read_events() == []
+            with open(os.path.join(tmp, "a.json"), "w") as fp:
+                fp.write("{}")
+            with open(os.path.join(tmp, "b.json.part"), "w") as fp:
+                fp.write("{}")
+            os.replace(os.path.join(tmp, "b.json.part"), os.path.join(tmp, "b.json"))
+            assert watcher.read_events() == ["a.json", "b.json.part", "b.json"]
+        finally:
+            watcher.close()
+
+
+def test_missing_directory():
+    """Watching a missing directory raises OSError"""
+    with pytest.raises(OSError):
+        dw.InotifyWatcher(os.path.join(tempfile.gettempdir(), "does", "not", "exist"))
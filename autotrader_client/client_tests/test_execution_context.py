@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+import tempfile
+import src.execution_context as ec
+import src.ameritrade_orders as am
+from src.client_settings import (
+    TD_DICT_KEY_API,
+    TD_DICT_KEY_URI,
+    TD_DICT_KEY_ACCT,
+    MAX_ORD_VAL_KEY,
+    RISKY_ORD_VAL_KEY,
+    BUY_LIM_KEY,
+    SL_KEY,
+)
+
+AUTH_PARAMS = {TD_DICT_KEY_API: "key", TD_DICT_KEY_URI: "uri", TD_DICT_KEY_ACCT: "123"}
+SETTINGS = {
+    MAX_ORD_VAL_KEY: 2000,
+    RISKY_ORD_VAL_KEY: 1000,
+    BUY_LIM_KEY: 0.03,
+    SL_KEY: 0.25,
+}
+
+
+def write_json(path, data, mtime=None):
+    with open(path, "w") as fp:
+        json.dump(data, fp)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def make_context(monkeypatch, tmp, logins, use_async=False):
+    """Returns context using config files in tmp. logins collects the arguments of
+    each authentication"""
+
+    def mock_authenticate(token_path, api_key, redirect_uri):
+        logins.append((token_path, api_key, redirect_uri))
+        return "client"
+
+    monkeypatch.setattr(am, "authenticate_tda_account", mock_authenticate)
+    auth_path = os.path.join(tmp, "auth.json")
+    settings_path = os.path.join(tmp, "settings.json")
+    write_json(auth_path, AUTH_PARAMS)
+    write_json(settings_path, SETTINGS, mtime=1000)
+    return ec.ExecutionContext("token.json", auth_path, settings_path, use_async)
+
+
+def test_context_authenticates_once(monkeypatch):
+    logins = []
+    with tempfile.TemporaryDirectory() as tmp:
+        context = make_context(monkeypatch, tmp, logins)
+        for _ in range(3):
+            assert context.usr_set["max_ord_val"] == 2000
+    assert logins == [("token.json", "key", "uri")]
+    assert context.client._client == "client"
+    assert context.async_client is None
+    assert context.acct_num == "123"
+
+
+def test_context_async_client(monkeypatch):
+    """The asyncio client is created from the token file the client wrote"""
+    created = []
+
+    def mock_client_from_token_file(token_path, api_key, asyncio=False):
+        created.append((token_path, api_key, asyncio))
+        return "async client"
+
+    monkeypatch.setattr(
+        ec.tda.auth, "client_from_token_file", mock_client_from_token_file
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        context = make_context(monkeypatch, tmp, [], use_async=True)
+    assert context.async_client._client == "async client"
+    assert created == [("token.json", "key", True)]
+
+
+def test_settings_reload_on_change(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        context = make_context(monkeypatch, tmp, [])
+        settings_path = os.path.join(tmp, "settings.json")
+        write_json(settings_path, dict(SETTINGS, **{MAX_ORD_VAL_KEY: 3000}), mtime=2000)
+        assert context.usr_set["max_ord_val"] == 3000
+
+
+def test_invalid_settings_keep_last(monkeypatch, caplog):
+    caplog.set_level(logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        context = make_context(monkeypatch, tmp, [])
+        settings_path = os.path.join(tmp, "settings.json")
+        write_json(settings_path, dict(SETTINGS, **{SL_KEY: 2}), mtime=2000)
+        assert context.usr_set["SL_percent"] == 0.25
+        assert "Invalid order settings" in caplog.text
+
+
+def test_initialize_order_with_context(monkeypatch):
+    """Orders use the context instead of reading config files"""
+    placed = []
+
+    def mock_process_bto_order(
+        client, acct_num, order_params, usr_set, positions, orders, prefetched, quotes
+    ):
+        placed.append((client._client, acct_num, usr_set["max_ord_val"]))
+
+    monkeypatch.setattr(am, "process_bto_order", mock_process_bto_order)
+    with tempfile.TemporaryDirectory() as tmp:
+        context = make_context(monkeypatch, tmp, [])
+        monkeypatch.setattr(context.chains, "check_contract", lambda c, p: p)
+        monkeypatch.setattr(am, "build_option_symbol", lambda p: "SYM")
+        am.initialize_order({"instruction": "BTO"}, context)
+    assert placed == [("client", "123", 2000)]
+    # quotes are streamed for signaled symbols
+    assert context.quotes.watched() == {"SYM"}
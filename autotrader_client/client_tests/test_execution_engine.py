@@ -0,0 +1,146 @@
+import time
+import asyncio
+import threading
+import src.execution_engine as ee
+
+
+class Tracker:
+    """Records the order work ran in and how many items ran at once"""
+
+    def __init__(self):
+        self.order = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def work(self, name, duration=0.02):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(duration)
+        with self._lock:
+            self.running -= 1
+            self.order.append(name)
+
+
+async def run_engine(engine, items, priorities=None):
+    """Submit (key, func, args) items together and wait for them to finish"""
+    priorities = priorities or [ee.ENTRY] * len(items)
+    task = asyncio.ensure_future(engine.run())
+    try:
+        for (key, func, args), priority in zip(items, priorities):
+            engine.submit(key, func, *args, priority=priority)
+        await asyncio.wait_for(engine.join(), timeout=5)
+    finally:
+        task.cancel()
+
+
+def test_parallelism_is_bounded():
+    tracker = Tracker()
+    engine = ee.ExecutionEngine(max_workers=2)
+    items = [(f"SYM{i}", tracker.work, (i,)) for i in range(6)]
+    asyncio.run(run_engine(engine, items))
+    assert sorted(tracker.order) == list(range(6))
+    assert tracker.max_running == 2
+    assert engine.max_in_flight == 2
+    assert engine.in_flight == 0
+    assert engine.completed == 6
+
+
+def test_same_key_runs_in_order():
+    """Work for one key runs one at a time in submission order even if later
+    work would finish first"""
+    tracker = Tracker()
+    engine = ee.ExecutionEngine(max_workers=4)
+    items = [("SYM", tracker.work, (i, 0.04 - i * 0.01)) for i in range(4)]
+    asyncio.run(run_engine(engine, items))
+    assert tracker.order == [0, 1, 2, 3]
+    assert tracker.max_running == 1
+    assert engine._pending == {}
+
+
+def test_failure_is_isolated(caplog):
+    """A failing item is logged and does not stop later work"""
+    done = []
+
+    def fail():
+        raise RuntimeError("TDA error")
+
+    async def main():
+        engine = ee.ExecutionEngine(max_workers=1)
+        task = asyncio.ensure_future(engine.run())
+        try:
+            engine.submit("SYM", fail, on_done=lambda: done.append("fail"))
+            engine.submit("SYM", lambda: None, on_done=lambda: done.append("ok"))
+            await asyncio.wait_for(engine.join(), timeout=5)
+        finally:
+            task.cancel()
+        return engine
+
+    engine = asyncio.run(main())
+    assert done == ["fail", "ok"]
+    assert engine.failed == 1
+    assert engine.completed == 2
+    assert "Order for SYM failed" in caplog.text
+
+
+def test_queue_wait_is_recorded():
+    """Work queued behind a busy worker records its wait"""
+    tracker = Tracker()
+    engine = ee.ExecutionEngine(max_workers=1)
+    items = [(f"SYM{i}", tracker.work, (i, 0.05)) for i in range(2)]
+    asyncio.run(run_engine(engine, items))
+    assert engine.max_wait >= 0.04
+    assert 0 < engine.mean_wait <= engine.max_wait
+
+
+def test_exits_run_before_entries():
+    """Exits submitted together with entries run first, each class in order"""
+    tracker = Tracker()
+    engine = ee.ExecutionEngine(max_workers=1)
+    names = ["bto0", "stc0", "bto1", "stc1"]
+    items = [(name, tracker.work, (name, 0.01)) for name in names]
+    priorities = [ee.ENTRY, ee.EXIT, ee.ENTRY, ee.EXIT]
+    asyncio.run(run_engine(engine, items, priorities))
+    assert tracker.order == ["stc0", "stc1", "bto0", "bto1"]
+    assert engine.waits[ee.EXIT].count == 2
+    assert engine.waits[ee.ENTRY].count == 2
+    assert engine.waits[ee.ENTRY].mean > engine.waits[ee.EXIT].mean
+
+
+def test_exit_does_not_overtake_entry_for_same_key():
+    """Symbol order wins over priority"""
+    tracker = Tracker()
+    engine = ee.ExecutionEngine(max_workers=1)
+    items = [
+        ("OTHER", tracker.work, ("other_bto", 0.01)),
+        ("SYM", tracker.work, ("bto", 0.01)),
+        ("SYM", tracker.work, ("stc", 0.01)),
+    ]
+    priorities = [ee.ENTRY, ee.ENTRY, ee.EXIT]
+    asyncio.run(run_engine(engine, items, priorities))
+    assert tracker.order.index("bto") < tracker.order.index("stc")
+
+
+def test_coroutine_functions_run_on_loop():
+    """Coroutine functions are awaited on the event loop instead of a thread and
+    still keep per-key order"""
+    order = []
+    threads = set()
+
+    async def work(name):
+        threads.add(threading.get_ident())
+        await asyncio.sleep(0.02)
+        order.append(name)
+
+    async def main():
+        threads.add(threading.get_ident())
+        engine = ee.ExecutionEngine(max_workers=4)
+        items = [("A", work, ("A0",)), ("A", work, ("A1",)), ("B", work, ("B0",))]
+        await run_engine(engine, items)
+        return engine
+
+    engine = asyncio.run(main())
+    assert order == ["A0", "B0", "A1"]
+    assert len(threads) == 1
+    assert engine.max_in_flight == 2
@@ -0,0 +1,43 @@
+import time
+import asyncio
+import src.loop_monitor as lm
+
+
+def test_record_stats():
+    """Statistics are updated from recorded stalls"""
+    monitor = lm.LoopStallMonitor()
+    assert monitor.mean_stall == 0.0
+    for stall in [0.0, 0.1, 0.2]:
+        monitor._record(stall)
+    assert monitor.samples == 3
+    assert monitor.max_stall == 0.2
+    assert abs(monitor.mean_stall - 0.1) < 1e-9
+
+
+def test_record_warning(caplog):
+    """Stalls above the warning threshold are logged"""
+    monitor = lm.LoopStallMonitor(warn_threshold=0.1)
+    monitor._record(0.05)
+    assert caplog.text == ""
+    monitor._record(0.15)
+    assert "Event loop stalled" in caplog.text
+
+
+def test_run_detects_blocking_call():
+    """A blocking call on the loop is measured as a stall"""
+
+    async def block_loop():
+        await asyncio.sleep(0.05)
+        time.sleep(0.5)
+        await asyncio.sleep(0.05)
+
+    async def main():
+        monitor = lm.LoopStallMonitor(interval=0.01)
+        task = asyncio.ensure_future(monitor.run())
+        await block_loop()
+        task.cancel()
+        return monitor
+
+    monitor = asyncio.run(main())
+    # the blocking call sets a lower bound, so a loaded machine cannot fail this
+    assert monitor.max_stall >= 0.25
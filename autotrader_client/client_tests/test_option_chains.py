@@ -0,0 +1,143 @@
+import time
+import datetime
+import src.option_chains as oc
+
+# Good Friday 2021 was a market holiday, so its options expired on the Thursday
+GOOD_FRIDAY = datetime.date(2021, 4, 2)
+THURSDAY = datetime.date(2021, 4, 1)
+
+
+def chain(strikes_by_date, contract_type="P"):
+    """Returns TDA option chain listing strikes for each date"""
+    map_key = oc.CONTRACT_TYPES[contract_type]
+    exp_map = {
+        f"{date.isoformat()}:5": {f"{strike:.1f}": [{}] for strike in strikes}
+        for date, strikes in strikes_by_date.items()
+    }
+    return {"status": "SUCCESS", map_key: exp_map}
+
+
+class MockClient:
+    """Serves chains from listed, a dict of date: strikes"""
+
+    def __init__(self, listed):
+        self.listed = listed
+        self.requests = []
+
+    def get_option_chain(self, ticker, from_date=None, to_date=None):
+        self.requests.append((ticker, from_date, to_date))
+        listed = {d: s for d, s in self.listed.items() if from_date <= d <= to_date}
+        return MockResponse(chain(listed))
+
+
+class MockResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+def order_params(expiration, strike="380"):
+    return {
+        "ticker": "SPY",
+        "strike_price": strike,
+        "contract_type": "P",
+        "expiration": datetime.datetime.combine(expiration, datetime.time()),
+    }
+
+
+def test_parse_chain():
+    date = datetime.date(2021, 3, 3)
+    parsed = oc.parse_chain(chain({date: [380, 380.5]}))
+    assert parsed == {date: {"C": frozenset(), "P": frozenset([380.0, 380.5])}}
+
+
+def test_listed_contract_cached():
+    date = datetime.date(2021, 3, 3)
+    client = MockClient({date: [380]})
+    cache = oc.OptionChainCache()
+    params = order_params(date)
+    assert cache.check_contract(client, params) is params
+    assert cache.check_contract(client, params) is params
+    assert client.requests == [("SPY", date, date)]
+    assert cache.hits == 1
+
+
+def test_bad_strike_rejected_after_fresh_fetch(caplog):
+    """A strike missing from a cached chain is fetched again before rejection"""
+    date = datetime.date(2021, 3, 3)
+    client = MockClient({date: [380]})
+    cache = oc.OptionChainCache()
+    assert cache.check_contract(client, order_params(date)) is not None
+    assert cache.check_contract(client, order_params(date, "380.5")) is None
+    assert len(client.requests) == 2
+    assert "not a listed contract" in caplog.text
+    # the strike is listed later in the day
+    client.listed[date] = [380, 380.5]
+    assert cache.check_contract(client, order_params(date, "380.5")) is not None
+
+
+def test_holiday_friday_moved_to_thursday():
+    client = MockClient({THURSDAY: [380]})
+    cache = oc.OptionChainCache()
+    params = order_params(GOOD_FRIDAY)
+    corrected = cache.check_contract(client, params)
+    assert corrected["expiration"] == datetime.datetime(2021, 4, 1)
+    assert params["expiration"] == datetime.datetime(2021, 4, 2)
+
+
+def test_chain_failure_does_not_block_order(caplog):
+    class FailingClient:
+        def get_option_chain(self, ticker, from_date=None, to_date=None):
+            raise ConnectionError("down")
+
+    params = order_params(datetime.date(2021, 3, 3))
+    assert oc.OptionChainCache().check_contract(FailingClient(), params) is params
+    assert "Unable to check option chain" in caplog.text
+
+
+def test_ttl_and_lru_eviction(monkeypatch):
+    cache = oc.OptionChainCache(ttl=60, max_size=2)
+    now = time.monotonic()
+    monkeypatch.setattr(oc.time, "monotonic", lambda: now)
+    for day in (1, 2, 3):
+        cache.put("SPY", datetime.date(2021, 3, day), {"C": frozenset()})
+    assert len(cache) == 2
+    assert cache.get("SPY", datetime.date(2021, 3, 1)) is None
+    assert cache.get("SPY", datetime.date(2021, 3, 2)) is not None
+    monkeypatch.setattr(oc.time, "monotonic", lambda: now + 61)
+    assert cache.get("SPY", datetime.date(2021, 3, 2)) is None
+
+
+def test_warm_caches_expirations():
+    dates = [datetime.date(2021, 3, 3), datetime.date(2021, 3, 5)]
+    client = MockClient({date: [380] for date in dates})
+    cache = oc.OptionChainCache()
+    assert cache.warm(client, "SPY", dates[0], dates[1]) == 2
+    assert not cache.needs_fetch(order_params(dates[1]))
+    assert cache.check_contract(client, order_params(dates[0])) is not None
+    assert len(client.requests) == 1
+
+
+def test_chain_warmer(monkeypatch, caplog):
+    """Warming continues past a ticker that fails"""
+
+    class MockContext:
+        chains = oc.OptionChainCache()
+
+        class client:
+            @staticmethod
+            def get_option_chain(ticker, from_date=None, to_date=None):
+                if ticker == "BAD":
+                    raise ConnectionError("down")
+                return MockResponse(chain({from_date: [380]}))
+
+    warmer = oc.ChainWarmer(MockContext(), ["BAD", "SPY"], days=5)
+    warmer._warm()
+    assert MockContext.chains.get("SPY", datetime.date.today()) is not None
+    assert "Unable to warm option chain for BAD" in caplog.text
+    assert warmer.last_warm is not None
@@ -0,0 +1,93 @@
+import time
+import datetime
+import src.order_book as ob
+
+SYMBOL = "TSLA_030521P520"
+NOW = datetime.datetime(2021, 3, 3, 15, 0, tzinfo=datetime.timezone.utc)
+
+
+def order(order_id, status, instruction, symbol=SYMBOL, children=(), entered=NOW):
+    result = {
+        "orderId": order_id,
+        "status": status,
+        "orderLegCollection": [
+            {"instruction": instruction, "instrument": {"symbol": symbol}}
+        ],
+        "childOrderStrategies": list(children),
+    }
+    if entered is not None:
+        result["enteredTime"] = entered.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return result
+
+
+def test_update_indexes_live_stc_orders():
+    """Live STC orders and live STC children of filled orders are indexed"""
+    book = ob.OrderBook()
+    assert not book.is_known(SYMBOL)
+    stop = order(3, "QUEUED", "SELL_TO_CLOSE", entered=None)
+    orders = [
+        order(1, "WORKING", "SELL_TO_CLOSE"),
+        order(2, "FILLED", "BUY_TO_OPEN", children=[stop]),
+        order(4, "CANCELED", "SELL_TO_CLOSE"),
+        order(5, "WORKING", "SELL_TO_CLOSE", symbol="SPY_030321P380"),
+    ]
+    book.update(orders, time.time())
+    assert book.is_known(SYMBOL)
+    assert sorted(book.stc_orders(SYMBOL)) == ["1", "3"]
+    assert book.stc_orders("SPY_030321P380") == ["5"]
+    assert book.oldest_entered() == NOW
+
+
+def test_status_changes_move_orders():
+    book = ob.OrderBook()
+    book.update([order(1, "WORKING", "SELL_TO_CLOSE")], time.time())
+    book.update([order(1, "FILLED", "SELL_TO_CLOSE")], time.time())
+    assert book.stc_orders(SYMBOL) == []
+    assert book._index == {}
+    assert book.oldest_entered() is None
+
+
+def test_local_cancel_and_placement():
+    """Own cancels and placements are indexed and survive an older refresh"""
+    book = ob.OrderBook()
+    book.update([order(1, "WORKING", "SELL_TO_CLOSE")], time.time())
+    fetched_at = time.time() - 1
+    book.record_cancel("1")
+    book.record_placement(7, SYMBOL, "SELL_TO_CLOSE")
+    assert book.stc_orders(SYMBOL) == ["7"]
+    book.update([order(1, "WORKING", "SELL_TO_CLOSE")], fetched_at)
+    assert book.stc_orders(SYMBOL) == ["7"]
+
+
+def test_unseen_orders_make_symbol_unknown():
+    book = ob.OrderBook()
+    book.update([], time.time())
+    book.expect_orders(SYMBOL)
+    assert not book.is_known(SYMBOL)
+    book.record_placement(None, "SPY_030321P380", "SELL_TO_CLOSE")
+    assert not book.is_known("SPY_030321P380")
+    book.update([], time.time() + 1)
+    assert book.is_known(SYMBOL)
+    assert book.is_known("SPY_030321P380")
+
+
+def test_refresh_queries_from_oldest_live_order(monkeypatch):
+    queried = []
+    entered = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    entered -= datetime.timedelta(hours=1)
+
+    def mock_query_orders(client, from_entered_datetime):
+        queried.append(from_entered_datetime)
+        return [order(1, "WORKING", "SELL_TO_CLOSE", entered=entered)]
+
+    class MockContext:
+        client = "client"
+        orders = ob.OrderBook()
+
+    monkeypatch.setattr(ob.am_ord, "query_orders", mock_query_orders)
+    refresher = ob.OrderBookRefresher(MockContext(), overlap=60)
+    refresher._refresh()
+    refresher._refresh()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    assert now - queried[0] >= ob.MAX_LOOKBACK
+    assert queried[1] == entered - datetime.timedelta(seconds=60)
@@ -1,30 +1,52 @@
 import os
+import asyncio
+import threading
 import tempfile
+import concurrent.futures
 import time
 import datetime
 import pytest
 import pathlib
 import src.order_monitor as om
+import src.client_utils as utils
+import src.checkpoint as cp
+
+
+def patch_orders(monkeypatch, place_order):
+    """Skip validation, key orders by their "symbol" and place them with
+    place_order"""
+    monkeypatch.setattr(om.OrderMonitor, "_prepare_order", staticmethod(lambda p: p))
+    monkeypatch.setattr(om.am_ord, "build_option_symbol", lambda p: p.get("symbol"))
+    monkeypatch.setattr(
+        om.OrderMonitor,
+        "_place_order",
+        staticmethod(lambda params, context, prefetch: place_order(params)),
+    )
 
 
 def test_check_new_file_valid_file():
     """Returns new files"""
     with tempfile.TemporaryDirectory() as tmp:
         obj = om.OrderMonitor(tmp)
+        partition = utils.signal_partition(tmp)
+        os.makedirs(partition)
         num_files = 5
         files = ["".join(["test", str(x), ".json"]) for x in range(num_files)]
         for f in files:
-            pathlib.Path(os.path.join(tmp, f)).touch()
-        assert obj._check_new_files() == files
+            pathlib.Path(os.path.join(partition, f)).touch()
+        expected = [os.path.join(os.path.basename(partition), f) for f in files]
+        assert sorted(obj._check_new_files()) == expected
 
 
 def test_check_new_file_old_files():
     """Function does not return old files"""
     with tempfile.TemporaryDirectory() as tmp:
+        partition = utils.signal_partition(tmp)
+        os.makedirs(partition)
         num_files = 5
         files = ["".join(["test", str(x), ".json"]) for x in range(num_files)]
         for f in files:
-            pathlib.Path(os.path.join(tmp, f)).touch()
+            pathlib.Path(os.path.join(partition, f)).touch()
         time.sleep(0.001)
         obj = om.OrderMonitor(tmp)
         print("killing time")
@@ -95,3 +117,344 @@ def test_get_creation_time(monkeypatch):
         with pytest.raises(OSError):
             obj = om.OrderMonitor(tempdir)
             dt = obj._get_creation_time(tempdir, tmp.name)
+
+
+def test_consume_queue(monkeypatch):
+    """Signals put on the queue are processed in order"""
+    processed = []
+    patch_orders(monkeypatch, processed.append)
+
+    async def main():
+        queue = asyncio.Queue()
+        obj = om.OrderMonitor(tempfile.gettempdir(), signal_queue=queue)
+        for i in range(3):
+            queue.put_nowait((f"test{i}.json", None, {"id": i}))
+        task = asyncio.ensure_future(obj.run())
+        await asyncio.wait_for(queue.join(), timeout=5)
+        task.cancel()
+        return obj
+
+    obj = asyncio.run(main())
+    assert processed == [{"id": 0}, {"id": 1}, {"id": 2}]
+    assert "test2.json" in obj._directory_content
+
+
+def test_resume_from_checkpoint(monkeypatch):
+    """Processed files are committed and skipped after a restart"""
+    patch_orders(monkeypatch, lambda params: None)
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = cp.SignalCheckpoint(os.path.join(tmp, "cp.db"))
+        created = datetime.datetime(2021, 3, 3, 15, 0, tzinfo=datetime.timezone.utc)
+
+        async def consume(obj, queue):
+            task = asyncio.ensure_future(obj.run())
+            try:
+                await asyncio.wait_for(queue.join(), timeout=5)
+            finally:
+                task.cancel()
+
+        async def main():
+            queue = asyncio.Queue()
+            obj = om.OrderMonitor(tmp, signal_queue=queue, checkpoint=checkpoint)
+            queue.put_nowait(("test0.json", created, {}))
+            await consume(obj, queue)
+
+            queue = asyncio.Queue()
+            obj = om.OrderMonitor(tmp, signal_queue=queue, checkpoint=checkpoint)
+            assert "test0.json" in obj._directory_content
+            assert obj._last_check == created
+
+        asyncio.run(main())
+        assert list(checkpoint.recent(cp.MONITOR)) == ["test0.json"]
+        checkpoint.close()
+
+
+def test_consume_queue_off_loop(monkeypatch):
+    """Orders are processed off the event loop and duplicates are skipped"""
+    threads = []
+
+    def mock_process_params(params):
+        threads.append(threading.current_thread())
+
+    patch_orders(monkeypatch, mock_process_params)
+
+    acknowledged = []
+
+    async def main():
+        queue = asyncio.Queue()
+        obj = om.OrderMonitor(
+            tempfile.gettempdir(), signal_queue=queue, on_processed=acknowledged.append
+        )
+        for _ in range(2):
+            queue.put_nowait(("test0.json", None, {}))
+        task = asyncio.ensure_future(obj.run())
+        try:
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+    assert len(threads) == 1
+    assert threads[0] is not threading.main_thread()
+    assert acknowledged == ["test0.json"]
+
+
+@pytest.mark.skipif(not om.dw.inotify_available(), reason="requires inotify")
+def test_watch_directory(monkeypatch):
+    """Files moved into the directory are processed without polling"""
+    processed = asyncio.Queue()
+    patch_orders(monkeypatch, lambda params: None)
+    monkeypatch.setattr(
+        om.OrderMonitor, "_read_order", staticmethod(lambda directory, filename: {})
+    )
+
+    async def main(tmp):
+        obj = om.OrderMonitor(
+            tmp, sleep_time=60, on_processed=processed.put_nowait, watch=True
+        )
+        task = asyncio.ensure_future(obj.run())
+        try:
+            await asyncio.sleep(0.05)
+            partition = utils.signal_partition(tmp)
+            part = os.path.join(partition, "test0.json.part")
+            pathlib.Path(part).touch()
+            os.replace(part, os.path.join(partition, "test0.json"))
+            return await asyncio.wait_for(processed.get(), timeout=5)
+        finally:
+            task.cancel()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        assert asyncio.run(main(tmp)) == "test0.json"
+
+
+def test_check_new_files_skips_old_partitions():
+    """Only the partitions of the last check and today are scanned"""
+    with tempfile.TemporaryDirectory() as tmp:
+        obj = om.OrderMonitor(tmp)
+        obj._last_check = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+        old = os.path.join(tmp, "2000-01-01")
+        os.makedirs(old)
+        pathlib.Path(os.path.join(old, "old.json")).touch()
+        today = utils.signal_partition(tmp)
+        os.makedirs(today)
+        for name in ["new.json", "new.txt"]:
+            pathlib.Path(os.path.join(today, name)).touch()
+        expected = [os.path.join(os.path.basename(today), "new.json")]
+        assert obj._check_new_files() == expected
+        assert obj._check_new_files() == []
+
+
+def test_check_new_files_forgets_old_files():
+    """Seen files outside the window are forgotten without being found again"""
+    with tempfile.TemporaryDirectory() as tmp:
+        obj = om.OrderMonitor(tmp, seen_window=60)
+        today = utils.signal_partition(tmp)
+        os.makedirs(today)
+        path = os.path.join(today, "a.json")
+        pathlib.Path(path).touch()
+        mtime = os.path.getmtime(path) - 600
+        os.utime(path, (mtime, mtime))
+        obj._last_check = datetime.datetime.fromtimestamp(
+            mtime - 1, tz=datetime.timezone.utc
+        )
+        expected = [os.path.join(os.path.basename(today), "a.json")]
+        assert obj._check_new_files() == expected
+        assert "a.json" in obj._directory_content
+        assert obj._check_new_files() == []
+        assert "a.json" not in obj._directory_content
+        assert obj._check_new_files() == []
+
+
+def test_orders_run_concurrently(monkeypatch):
+    """A slow order does not hold up an order for another symbol"""
+    second_placed = threading.Event()
+    placed = []
+
+    def place_order(params):
+        if params["symbol"] == "SLOW":
+            assert second_placed.wait(timeout=5)
+        else:
+            second_placed.set()
+        placed.append(params["symbol"])
+
+    patch_orders(monkeypatch, place_order)
+
+    async def main():
+        queue = asyncio.Queue()
+        obj = om.OrderMonitor(tempfile.gettempdir(), signal_queue=queue, max_workers=2)
+        queue.put_nowait(("slow.json", None, {"symbol": "SLOW"}))
+        queue.put_nowait(("fast.json", None, {"symbol": "FAST"}))
+        task = asyncio.ensure_future(obj.run())
+        try:
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+    assert placed == ["FAST", "SLOW"]
+
+
+def test_exits_placed_before_entries(monkeypatch):
+    """STC signals arriving with BTO signals are placed first"""
+    placed = []
+    patch_orders(monkeypatch, lambda params: placed.append(params["symbol"]))
+
+    async def main():
+        queue = asyncio.Queue()
+        obj = om.OrderMonitor(tempfile.gettempdir(), signal_queue=queue, max_workers=1)
+        signals = [("A", "BTO"), ("B", "STC"), ("C", "BTO"), ("D", "STC")]
+        for symbol, instruction in signals:
+            params = {"symbol": symbol, "instruction": instruction}
+            queue.put_nowait((f"{symbol}.json", None, params))
+        task = asyncio.ensure_future(obj.run())
+        try:
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+    assert placed == ["B", "D", "A", "C"]
+
+
+def test_async_context_places_on_loop(monkeypatch):
+    """A context with an asyncio client has its orders placed on the event loop"""
+    placed = []
+
+    async def place_order_async(params, context, prefetch):
+        placed.append((params["symbol"], context.async_client))
+
+    monkeypatch.setattr(om.OrderMonitor, "_prepare_order", staticmethod(lambda p: p))
+    monkeypatch.setattr(om.am_ord, "build_option_symbol", lambda p: p.get("symbol"))
+    monkeypatch.setattr(
+        om.OrderMonitor, "_place_order_async", staticmethod(place_order_async)
+    )
+
+    class MockContext:
+        async_client = "async client"
+
+    async def main():
+        queue = asyncio.Queue()
+        obj = om.OrderMonitor(
+            tempfile.gettempdir(), signal_queue=queue, context=MockContext()
+        )
+        queue.put_nowait(("a.json", None, {"symbol": "A", "instruction": "BTO"}))
+        task = asyncio.ensure_future(obj.run())
+        try:
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+    assert placed == [("A", "async client")]
+
+
+def test_prefetch_passed_to_order(monkeypatch):
+    """Lookups start before validation. They are discarded for invalid signals
+    and for contracts with an earlier order still pending"""
+    placed = []
+    started = []
+    release = threading.Event()
+
+    def place_order(params, context, prefetch):
+        placed.append((params["symbol"], om.pf.result(prefetch)))
+        if params["symbol"] == "A":
+            assert release.wait(timeout=5)
+
+    def mock_start(self, order_params):
+        started.append(order_params["symbol"])
+        future = concurrent.futures.Future()
+        future.set_result(f"prefetched {order_params['symbol']}")
+        return future
+
+    monkeypatch.setattr(om.pf.Prefetcher, "start", mock_start)
+    monkeypatch.setattr(
+        om.OrderMonitor,
+        "_prepare_order",
+        staticmethod(lambda p: p if p.get("valid", True) else None),
+    )
+    monkeypatch.setattr(om.am_ord, "build_option_symbol", lambda p: p.get("symbol"))
+    monkeypatch.setattr(om.OrderMonitor, "_place_order", staticmethod(place_order))
+
+    class MockContext:
+        async_client = None
+
+    async def main():
+        queue = asyncio.Queue()
+        obj = om.OrderMonitor(
+            tempfile.gettempdir(), signal_queue=queue, context=MockContext()
+        )
+        signals = [{"symbol": "A"}, {"symbol": "B", "valid": False}, {"symbol": "A"}]
+        for i, signal in enumerate(signals):
+            queue.put_nowait((f"{i}.json", None, signal))
+        task = asyncio.ensure_future(obj.run())
+        try:
+            while len(started) < 3:
+                await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            task.cancel()
+        return obj
+
+    obj = asyncio.run(main())
+    assert started == ["A", "B", "A"]
+    assert placed == [("A", "prefetched A"), ("A", None)]
+    assert obj._prefetcher.discarded == 2
+
+
+def test_is_new_order_file_modified_before_window():
+    """A file whose name has aged out of the seen window is not new again"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "test0.json")
+        with open(path, "w") as fp:
+            fp.write("{}")
+        obj = om.OrderMonitor(tmp, seen_window=60)
+        assert obj._is_new_order_file("test0.json") is True
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        assert obj._is_new_order_file("test0.json") is False
+
+
+def test_is_new_order_file_in_checkpoint():
+    """A file the checkpoint recorded is not new after its name leaves the window"""
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "test0.json"), "w") as fp:
+            fp.write("{}")
+        checkpoint = cp.SignalCheckpoint(os.path.join(tmp, "cp.db"))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        checkpoint.commit(cp.MONITOR, now, {"test0.json": now})
+        obj = om.OrderMonitor(tmp, checkpoint=checkpoint)
+        obj._directory_content.prune(time.time() + 7200)
+        assert "test0.json" not in obj._directory_content
+        assert obj._is_new_order_file("test0.json") is False
+        checkpoint.close()
+
+
+def test_consume_queue_redelivery_after_window(monkeypatch):
+    """A signal redelivered after its name aged out of the seen window is skipped
+    if the checkpoint recorded it"""
+    placed = []
+    patch_orders(monkeypatch, placed.append)
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = cp.SignalCheckpoint(os.path.join(tmp, "cp.db"))
+        created = datetime.datetime(2021, 3, 3, 15, 0, tzinfo=datetime.timezone.utc)
+
+        async def main():
+            queue = asyncio.Queue()
+            obj = om.OrderMonitor(
+                tmp, signal_queue=queue, checkpoint=checkpoint, seen_window=0.01
+            )
+            task = asyncio.ensure_future(obj.run())
+            try:
+                queue.put_nowait(("test0.json", created, {}))
+                await asyncio.wait_for(queue.join(), timeout=5)
+                await asyncio.sleep(0.05)
+                queue.put_nowait(("test0.json", created, {}))
+                await asyncio.wait_for(queue.join(), timeout=5)
+                assert "test0.json" not in obj._directory_content
+            finally:
+                task.cancel()
+
+        asyncio.run(main())
+        checkpoint.close()
+    assert len(placed) == 1
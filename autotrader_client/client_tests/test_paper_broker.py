@@ -0,0 +1,225 @@
+"""Tests for paper_broker.py"""
+import os
+import json
+import time
+import asyncio
+import datetime
+import tempfile
+import tda
+import src.paper_broker as paper
+import src.ameritrade_orders as am
+import src.execution_context as ec
+import src.order_monitor as om
+import src.option_chains as oc
+import src.rate_limiter as rl
+from src.client_settings import MAX_ORD_VAL_KEY, RISKY_ORD_VAL_KEY, BUY_LIM_KEY, SL_KEY
+
+USR_SET = {
+    "max_ord_val": 2000,
+    "high_risk_ord_val": 1000,
+    "buy_limit_percent": 0.03,
+    "SL_percent": 0.25,
+}
+
+SETTINGS = {
+    MAX_ORD_VAL_KEY: 2000,
+    RISKY_ORD_VAL_KEY: 1000,
+    BUY_LIM_KEY: 0.03,
+    SL_KEY: 0.25,
+}
+
+SYMBOL = "SPY_030321P380"
+ACCT = "123456789"
+
+
+def order_params(instruction="BTO", reduce=None):
+    return {
+        "instruction": instruction,
+        "ticker": "SPY",
+        "strike_price": "380",
+        "contract_type": "P",
+        "expiration": datetime.datetime(2021, 3, 3, 0, 0),
+        "contract_price": 2.00,
+        "comments": None,
+        "flags": {"SL": None, "risk_level": None, "reduce": reduce},
+    }
+
+
+def statuses(broker):
+    """Returns {order id: status} of every order, child orders included"""
+    found = {}
+    for order in broker.get_orders_by_query().json():
+        found[order["orderId"]] = order["status"]
+        for child in order.get("childOrderStrategies", []):
+            found[child["orderId"]] = child["status"]
+    return found
+
+
+def test_ota_order_fills_and_stop_executes():
+    """The BTO fills at the ask, which starts its stop, and the stop sells the
+    position once the bid falls to the stop price"""
+    broker = paper.SimulatedBroker()
+    broker.set_price(SYMBOL, bid=1.95, ask=2.00)
+    am.process_bto_order(broker, ACCT, order_params(), USR_SET)
+    assert broker.position(SYMBOL) == 9
+    assert statuses(broker) == {1001: "FILLED", 1002: "WORKING"}
+    assert broker.cash == 100000 - 9 * 200
+    broker.set_price(SYMBOL, bid=1.60, ask=1.65)
+    assert broker.position(SYMBOL) == 9
+    broker.set_price(SYMBOL, bid=1.40, ask=1.45)
+    assert broker.position(SYMBOL) == 0
+    assert statuses(broker) == {1001: "FILLED", 1002: "FILLED"}
+    assert broker.fills == 2
+
+
+def test_fill_or_kill_cancelled_with_its_stop():
+    broker = paper.SimulatedBroker()
+    broker.set_price(SYMBOL, bid=2.40, ask=2.50)
+    am.process_bto_order(broker, ACCT, order_params(), USR_SET)
+    assert statuses(broker) == {1001: "CANCELED", 1002: "CANCELED"}
+    assert broker.position(SYMBOL) == 0
+    assert broker.cash == 100000
+
+
+def test_process_stc_order_reduce():
+    """The working stop is cancelled so half the position can be sold and the
+    rest is protected by a new stop"""
+    broker = paper.SimulatedBroker()
+    broker.set_price(SYMBOL, bid=1.95, ask=2.00)
+    am.process_bto_order(broker, ACCT, order_params(), USR_SET)
+    broker.set_price(SYMBOL, bid=2.50, ask=2.55)
+    am.process_stc_order(broker, ACCT, order_params("STC", reduce=0.5), USR_SET)
+    assert statuses(broker) == {
+        1001: "FILLED",
+        1002: "CANCELED",
+        1003: "FILLED",
+        1004: "WORKING",
+    }
+    sold = 9 - broker.position(SYMBOL)
+    assert 0 < sold < 9
+    assert broker.cash == 100000 - 9 * 200 + sold * 250
+
+
+def test_sell_beyond_position_rejected():
+    """A sell competing with a working stop for the position is rejected like
+    TDA rejects it"""
+    broker = paper.SimulatedBroker()
+    broker.set_price(SYMBOL, bid=1.95, ask=2.00)
+    am.process_bto_order(broker, ACCT, order_params(), USR_SET)
+    response = broker.place_order(ACCT, am.build_stc_market_order(SYMBOL, 9))
+    assert response.is_error
+    assert broker.rejections == 1
+    assert am.placed_order_id(broker, ACCT, response) is None
+    # filled orders cannot be cancelled, working ones can
+    assert broker.cancel_order(1001, ACCT).is_error
+    assert not broker.cancel_order(1002, ACCT).is_error
+    response = broker.place_order(ACCT, am.build_stc_market_order(SYMBOL, 9))
+    assert am.placed_order_id(broker, ACCT, response) == 1003
+    assert broker.position(SYMBOL) == 0
+
+
+def test_orders_wait_for_a_price():
+    """Day orders for symbols without a quote work until one arrives"""
+    broker = paper.SimulatedBroker(slippage=0.01)
+    spec = tda.orders.common.first_triggers_second(
+        tda.orders.options.option_buy_to_open_limit(SYMBOL, 2, 2.06),
+        am.build_stc_stop_market_order(SYMBOL, 2, 1.50),
+    )
+    broker.place_order(ACCT, spec)
+    assert statuses(broker) == {1001: "WORKING", 1002: "AWAITING_PARENT_ORDER"}
+    broker.set_price(SYMBOL, bid=2.05, ask=2.10)
+    assert broker.position(SYMBOL) == 0
+    broker.set_price(SYMBOL, bid=1.95, ask=2.00)
+    assert broker.position(SYMBOL) == 2
+    broker.set_price(SYMBOL, bid=1.00, ask=1.10)
+    # stops fill at the bid less slippage
+    order = broker.get_order(1002, ACCT).json()
+    assert order["orderActivityCollection"][0]["executionLegs"][0]["price"] == 0.99
+
+
+def test_account_and_queries():
+    broker = paper.SimulatedBroker()
+    broker.set_price(SYMBOL, bid=1.95, ask=2.00)
+    broker.set_price("SPY_030521C390", bid=1.00, ask=1.05)
+    assert am.get_positions(broker, ACCT) == []
+    am.process_bto_order(broker, ACCT, order_params(), USR_SET)
+    assert am.get_position_quant(broker, ACCT, SYMBOL) == 9
+    assert "positions" not in broker.get_account(ACCT).json()["securitiesAccount"]
+    assert am.get_existing_stc_orders(broker, SYMBOL) == ["1002"]
+    later = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+    assert am.query_orders(broker, later) == []
+    assert am.get_quote(broker, "SPY_030321P381") == {}
+    assert am.get_quote(broker, SYMBOL)["askPrice"] == 2.00
+    day = datetime.date(2021, 3, 3)
+    chain = oc.parse_chain(am.get_option_chain(broker, "SPY", day, day))
+    assert chain == {day: {"C": frozenset(), "P": frozenset([380.0])}}
+    assert broker.get_account("999").is_error
+
+
+def test_latency():
+    broker = paper.SimulatedBroker(latency=(0.02, 0.03), seed=1)
+    start = time.monotonic()
+    for _ in range(3):
+        broker.get_quote(SYMBOL)
+    assert time.monotonic() - start >= 0.06
+    assert broker.requests == 3
+
+
+def test_load_through_order_monitor(monkeypatch):
+    """Signals for many contracts run through the monitor and an execution
+    context trading on paper"""
+    monkeypatch.setattr(am, "rate_limiter", rl.TokenBucket(1000, 1000))
+    broker = paper.SimulatedBroker(latency=(0, 0.005), seed=7)
+    expiration = datetime.date.today() + datetime.timedelta(days=30)
+    strikes = range(300, 320)
+    for strike in strikes:
+        symbol = f"SPY_{expiration:%m%d%y}P{strike}"
+        broker.set_price(symbol, bid=1.95, ask=2.00)
+    with tempfile.TemporaryDirectory() as tmp:
+        settings_path = os.path.join(tmp, "settings.json")
+        with open(settings_path, "w") as fp:
+            json.dump(SETTINGS, fp)
+        context = ec.ExecutionContext(settings_path=settings_path, broker=broker)
+
+        async def main():
+            queue = asyncio.Queue()
+            monitor = om.OrderMonitor(
+                tmp, signal_queue=queue, max_workers=4, context=context
+            )
+            for strike in strikes:
+                params = order_params()
+                params.update(
+                    strike_price=str(strike),
+                    contract_price="2.00",
+                    expiration=f"{expiration:%m/%d/%Y}",
+                )
+                queue.put_nowait((f"{strike}.json", None, params))
+            task = asyncio.ensure_future(monitor.run())
+            try:
+                await asyncio.wait_for(queue.join(), timeout=10)
+            finally:
+                task.cancel()
+
+        asyncio.run(main())
+    assert context.acct_num == ACCT
+    assert broker.fills == len(strikes)
+    for strike in strikes:
+        assert broker.position(f"SPY_{expiration:%m%d%y}P{strike}") == 9
+
+
+def test_quote_stream_reconnect_replaces_stream():
+    """Quotes go to the stream of the last reconnect only"""
+
+    async def main():
+        broker = paper.SimulatedBroker()
+        first = broker.quote_stream()
+        second = broker.quote_stream()
+        await second.level_one_option_subs([SYMBOL])
+        broker.set_price(SYMBOL, bid=1.95, ask=2.00)
+        assert first._messages.empty()
+        received = []
+        second.add_level_one_option_handler(received.append)
+        await second.handle_message()
+        assert received[0]["content"][0]["BID_PRICE"] == 1.95
+
+    asyncio.run(main())
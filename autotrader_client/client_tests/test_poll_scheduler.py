@@ -0,0 +1,69 @@
+import datetime
+import src.poll_scheduler as ps
+
+ET = ps.EXCHANGE_TZ
+
+
+def test_nyse_holidays():
+    """Holidays are observed on the correct weekdays"""
+    holidays_2021 = {
+        datetime.date(2021, 1, 1),
+        datetime.date(2021, 1, 18),
+        datetime.date(2021, 2, 15),
+        datetime.date(2021, 4, 2),
+        datetime.date(2021, 5, 31),
+        datetime.date(2021, 7, 5),
+        datetime.date(2021, 9, 6),
+        datetime.date(2021, 11, 25),
+        datetime.date(2021, 12, 24),
+    }
+    assert ps.nyse_holidays(2021) == holidays_2021
+
+    # New Year's Day on a Saturday is not observed; Juneteenth from 2022
+    holidays_2022 = ps.nyse_holidays(2022)
+    assert datetime.date(2021, 12, 31) not in holidays_2022
+    assert datetime.date(2022, 6, 20) in holidays_2022
+
+
+def test_market_session():
+    """Sessions are determined in exchange local time"""
+    sessions = [
+        (datetime.datetime(2021, 3, 3, 3, 59, tzinfo=ET), "closed"),
+        (datetime.datetime(2021, 3, 3, 4, 0, tzinfo=ET), "extended"),
+        (datetime.datetime(2021, 3, 3, 9, 30, tzinfo=ET), "regular"),
+        (datetime.datetime(2021, 3, 3, 16, 0, tzinfo=ET), "extended"),
+        (datetime.datetime(2021, 3, 3, 20, 0, tzinfo=ET), "closed"),
+        (datetime.datetime(2021, 3, 6, 12, 0, tzinfo=ET), "closed"),  # Saturday
+        (datetime.datetime(2021, 4, 2, 12, 0, tzinfo=ET), "closed"),  # Good Friday
+    ]
+    for dt, session in sessions:
+        assert ps.market_session(dt) == session
+    utc = datetime.datetime(2021, 3, 3, 15, 0, tzinfo=datetime.timezone.utc)
+    assert ps.market_session(utc) == "regular"
+
+
+def test_next_session_open():
+    """Next open skips weekends and holidays"""
+    friday_night = datetime.datetime(2021, 4, 1, 21, 0, tzinfo=ET)
+    assert ps.next_session_open(friday_night) == datetime.datetime(
+        2021, 4, 5, 4, 0, tzinfo=ET
+    )
+    early = datetime.datetime(2021, 3, 3, 1, 0, tzinfo=ET)
+    assert ps.next_session_open(early) == datetime.datetime(
+        2021, 3, 3, 4, 0, tzinfo=ET
+    )
+
+
+def test_interval():
+    """Poll quickly while open or after activity, slowly while closed"""
+    scheduler = ps.PollScheduler(
+        active_interval=0.1, closed_interval=120, activity_window=60
+    )
+    open_dt = datetime.datetime(2021, 3, 3, 10, 0, tzinfo=ET)
+    closed_dt = datetime.datetime(2021, 3, 6, 12, 0, tzinfo=ET)
+    before_open = datetime.datetime(2021, 3, 3, 3, 59, 30, tzinfo=ET)
+    assert scheduler.interval(open_dt) == 0.1
+    assert scheduler.interval(closed_dt) == 120
+    assert scheduler.interval(before_open) == 30
+    scheduler.notify_activity()
+    assert scheduler.interval(closed_dt) == 0.1
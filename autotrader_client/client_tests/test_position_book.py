@@ -0,0 +1,70 @@
+import time
+import src.position_book as pb
+
+SYMBOL = "SPY_030321P380"
+
+
+def position(symbol, quantity):
+    return {"instrument": {"symbol": symbol}, "longQuantity": quantity}
+
+
+def test_unknown_until_seeded():
+    book = pb.PositionBook()
+    assert not book.is_known(SYMBOL)
+    book.reconcile([position(SYMBOL, 2)], time.time())
+    assert book.is_known(SYMBOL)
+    assert book.quantity(SYMBOL) == 2.0
+    assert book.is_known("QQQ_030321C300")
+    assert book.quantity("QQQ_030321C300") is None
+
+
+def test_fills_update_book():
+    book = pb.PositionBook()
+    book.reconcile([position(SYMBOL, 3)], time.time())
+    book.apply_fill(SYMBOL, -1)
+    assert book.quantity(SYMBOL) == 2.0
+    book.apply_fill(SYMBOL, -2)
+    assert book.quantity(SYMBOL) is None
+
+
+def test_expected_fill_is_unknown_until_fetched():
+    book = pb.PositionBook()
+    book.reconcile([], time.time())
+    book.expect_fill(SYMBOL)
+    assert not book.is_known(SYMBOL)
+    book.set_quantity(SYMBOL, 4.0)
+    assert book.is_known(SYMBOL)
+    assert book.quantity(SYMBOL) == 4.0
+
+
+def test_reconcile_keeps_newer_local_updates():
+    """A fetch that started before a local fill does not undo it"""
+    book = pb.PositionBook()
+    book.reconcile([position(SYMBOL, 3)], time.time())
+    fetched_at = time.time() - 1
+    book.apply_fill(SYMBOL, -3)
+    book.expect_fill("QQQ_030321C300")
+    book.reconcile([position(SYMBOL, 3)], fetched_at)
+    assert book.quantity(SYMBOL) is None
+    assert not book.is_known("QQQ_030321C300")
+
+    book.reconcile([position("QQQ_030321C300", 1)], time.time() + 1)
+    assert book.quantity("QQQ_030321C300") == 1.0
+    assert book.is_known("QQQ_030321C300")
+
+
+def test_reconciler_seeds_book(monkeypatch):
+    class MockContext:
+        client = "client"
+        acct_num = "123"
+        positions = pb.PositionBook()
+
+    def mock_get_positions(client, acct_id):
+        assert (client, acct_id) == ("client", "123")
+        return [position(SYMBOL, 1)]
+
+    monkeypatch.setattr(pb.am_ord, "get_positions", mock_get_positions)
+    context = MockContext()
+    pb.PositionReconciler(context)._reconcile()
+    assert context.positions.is_known(SYMBOL)
+    assert context.positions.quantity(SYMBOL) == 1.0
@@ -0,0 +1,82 @@
+import asyncio
+import httpx
+import src.prefetch as pf
+
+SIGNAL = {
+    "instruction": "STC",
+    "ticker": "SPY",
+    "strike_price": "380.0",
+    "contract_type": "P",
+    "expiration": "3/3/2021",
+    "contract_price": "2.00",
+    "comments": None,
+    "flags": {"SL": None, "risk_level": None, "reduce": None},
+}
+
+
+class MockContext:
+    client = "client"
+    acct_num = "123"
+    positions = "positions"
+    orders = "orders"
+
+
+def test_stc_prefetches_position_and_orders(monkeypatch):
+    calls = []
+
+    def mock_get_stc_state(client, acct_id, symbol, positions, orders):
+        calls.append((client, acct_id, symbol, positions, orders))
+        return 10, ["1"]
+
+    monkeypatch.setattr(pf.am_ord, "get_stc_state", mock_get_stc_state)
+    prefetcher = pf.Prefetcher(MockContext())
+    prefetch = prefetcher.start(SIGNAL)
+    assert pf.result(prefetch) == (10, ["1"])
+    assert calls == [("client", "123", "SPY_030321P380", "positions", "orders")]
+    assert prefetcher.started == 1
+
+
+def test_bto_prefetches_quote(monkeypatch):
+    quotes = []
+
+    def mock_get_quote(client, symbol):
+        quotes.append(symbol)
+        return {"bidPrice": 1.95}
+
+    monkeypatch.setattr(pf.am_ord, "get_quote", mock_get_quote)
+    prefetcher = pf.Prefetcher(MockContext())
+    prefetch = prefetcher.start(dict(SIGNAL, instruction="BTO"))
+    assert asyncio.run(pf.result_async(prefetch)) == {"bidPrice": 1.95}
+    assert quotes == ["SPY_030321P380"]
+
+
+class ErrorClient:
+    """TDA client whose quote requests are throttled"""
+
+    def get_quote(self, symbol):
+        request = httpx.Request("GET", f"https://api.tdameritrade.com/{symbol}")
+        return httpx.Response(429, json={"error": "throttled"}, request=request)
+
+
+def test_failed_quote_has_no_result():
+    """A failed quote request is not mistaken for an unknown contract, which
+    would reject the order"""
+    context = MockContext()
+    context.client = ErrorClient()
+    prefetcher = pf.Prefetcher(context)
+    prefetch = prefetcher.start(dict(SIGNAL, instruction="BTO"))
+    assert pf.result(prefetch) is None
+
+
+def test_unusable_signals(monkeypatch):
+    """Signals without an instruction are not prefetched and signals that cannot
+    be reformatted have no result"""
+    prefetcher = pf.Prefetcher(MockContext())
+    assert prefetcher.start({"ticker": "SPY"}) is None
+    assert prefetcher.start(None) is None
+    assert prefetcher.start(dict(SIGNAL, instruction="XYZ")) is None
+    prefetch = prefetcher.start(dict(SIGNAL, strike_price="abc"))
+    assert pf.result(prefetch) is None
+    assert pf.result(None) is None
+    prefetcher.discard(prefetch)
+    assert prefetcher.discarded == 1
@@ -0,0 +1,109 @@
+import time
+import asyncio
+import src.quote_cache as qc
+import src.position_book as pb
+
+SYMBOL = "SPY_030321P380"
+
+
+def test_update_merges_fields():
+    cache = qc.QuoteCache()
+    cache.connect()
+    cache.update(SYMBOL, {"key": SYMBOL, "BID_PRICE": 1.9, "ASK_PRICE": 2.0})
+    cache.update(SYMBOL, {"key": SYMBOL, "ASK_PRICE": 2.05})
+    quote = cache.fresh(SYMBOL)
+    assert (quote.bid, quote.ask, quote.last) == (1.9, 2.05, None)
+
+
+def test_quotes_stale_when_disconnected_or_old(monkeypatch):
+    cache = qc.QuoteCache(max_age=30)
+    cache.update(SYMBOL, {"BID_PRICE": 1.9})
+    # not fresh until the stream is connected
+    assert cache.fresh(SYMBOL) is None
+    cache.connect()
+    assert cache.fresh(SYMBOL) is not None
+    now = time.monotonic()
+    monkeypatch.setattr(qc.time, "monotonic", lambda: now + 31)
+    assert cache.fresh(SYMBOL) is None
+    cache.disconnect()
+    assert cache._quotes == {}
+
+
+def test_watched_symbols_expire():
+    cache = qc.QuoteCache(watch_window=60)
+    cache._watched.add("OLD", time.time() - 61)
+    cache.watch("A")
+    assert cache.watched(held=["B"]) == {"A", "B"}
+
+
+def test_quote_from_rest():
+    quote = qc.quote_from_rest({"bidPrice": 1.9, "askPrice": 2.0, "lastPrice": 1.95})
+    assert (quote.bid, quote.ask, quote.last) == (1.9, 2.0, 1.95)
+    assert qc.quote_from_rest({}) is None
+    assert qc.quote_from_rest(None) is None
+
+
+class MockContext:
+    def __init__(self):
+        self.quotes = qc.QuoteCache()
+        self.positions = pb.PositionBook()
+
+
+def test_streamer_feeds_cache():
+    """Held and signaled symbols are subscribed and their quotes cached"""
+    context = MockContext()
+    context.positions.set_quantity("HELD", 1)
+    stream = qc.FakeQuoteStream()
+    streamer = qc.QuoteStreamer(context, interval=0.01, stream_factory=lambda: stream)
+
+    async def main():
+        task = asyncio.ensure_future(streamer.run())
+        try:
+            while not stream.subscriptions:
+                await asyncio.sleep(0.01)
+            context.quotes.watch(SYMBOL)
+            while len(stream.subscriptions) < 2:
+                await asyncio.sleep(0.01)
+            stream.push("OTHER", BID_PRICE=5.0)
+            stream.push(SYMBOL, BID_PRICE=1.9, ASK_PRICE=2.0)
+            while streamer.messages < 1:
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+    assert stream.logged_in
+    assert stream.subscriptions == [["HELD"], ["HELD", SYMBOL]]
+    assert streamer.subscribed == {"HELD", SYMBOL}
+    # the stream task was cancelled, which disconnects the cache
+    assert context.quotes.fresh(SYMBOL) is None
+    assert not context.quotes.connected
+
+
+def test_streamer_reconnects(caplog):
+    context = MockContext()
+    context.quotes.watch(SYMBOL)
+    streams = []
+
+    class FailingStream(qc.FakeQuoteStream):
+        async def handle_message(self):
+            raise ConnectionError("closed")
+
+    def stream_factory():
+        streams.append(FailingStream())
+        return streams[-1]
+
+    streamer = qc.QuoteStreamer(
+        context, interval=0.01, reconnect_delay=0.01, stream_factory=stream_factory
+    )
+
+    async def main():
+        task = asyncio.ensure_future(streamer.run())
+        try:
+            while len(streams) < 2:
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+
+    asyncio.run(main())
+    assert "Quote stream failed, reconnecting" in caplog.text
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import threading
+import src.rate_limiter as rl
+
+
+class MockClient:
+    """Records requests. get_account blocks until release is set"""
+
+    def __init__(self):
+        self.requests = []
+        self.release = threading.Event()
+        self.session = "session"
+
+    def get_account(self, acct_num, fields=None):
+        self.requests.append(("get_account", acct_num, fields))
+        assert self.release.wait(timeout=5)
+        return f"account {acct_num}"
+
+    def place_order(self, acct_num, order_spec):
+        self.requests.append(("place_order", acct_num, order_spec))
+        return "placed"
+
+
+class MockAsyncClient:
+    def __init__(self):
+        self.requests = []
+
+    async def get_account(self, acct_num, fields=None):
+        self.requests.append(("get_account", acct_num, fields))
+        await asyncio.sleep(0.02)
+        return f"account {acct_num}"
+
+    async def place_order(self, acct_num, order_spec):
+        self.requests.append(("place_order", acct_num, order_spec))
+        return "placed"
+
+
+def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_bucket_throttles_after_burst():
+    bucket = rl.TokenBucket(rate=50, capacity=2)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    # the burst is free and the next two wait 1/50 seconds each
+    assert time.monotonic() - start >= 0.035
+    assert bucket.acquired == 4
+    assert bucket.throttled == 2
+
+
+def test_orders_go_before_queries():
+    """An order waiting for a token is served before a query that was already
+    waiting"""
+    bucket = rl.TokenBucket(rate=20, capacity=1)
+    bucket.acquire()
+    served = []
+
+    def acquire(priority):
+        bucket.acquire(priority)
+        served.append(priority)
+
+    query = threading.Thread(target=acquire, args=(rl.QUERY,))
+    query.start()
+    wait_for(lambda: len(bucket._waiting) == 1)
+    order = threading.Thread(target=acquire, args=(rl.ORDER,))
+    order.start()
+    query.join(timeout=5)
+    order.join(timeout=5)
+    assert served == [rl.ORDER, rl.QUERY]
+
+
+def test_identical_queries_coalesced():
+    client = MockClient()
+    limited = rl.RateLimitedClient(client, rl.TokenBucket(rate=100, capacity=10))
+    results = []
+
+    def get_account(acct_num):
+        results.append(limited.get_account(acct_num, fields="positions"))
+
+    threads = [threading.Thread(target=get_account, args=("123",)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: limited.coalesced == 2)
+    client.release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == ["account 123"] * 3
+    assert client.requests == [("get_account", "123", "positions")]
+    assert limited._in_flight == {}
+    # once answered the next query is sent again
+    assert limited.get_account("123", fields="positions") == "account 123"
+    assert len(client.requests) == 2
+
+
+def test_orders_not_coalesced_and_attributes_pass_through():
+    client = MockClient()
+    bucket = rl.TokenBucket(rate=100, capacity=10)
+    limited = rl.RateLimitedClient(client, bucket)
+    assert limited.place_order("123", "order") == "placed"
+    assert limited.place_order("123", "order") == "placed"
+    assert len(client.requests) == 2
+    assert bucket.acquired == 2
+    assert limited.session == "session"
+    assert time.time() - limited.last_request < 5
+
+
+def test_async_client():
+    client = MockAsyncClient()
+    bucket = rl.TokenBucket(rate=100, capacity=10)
+    limited = rl.RateLimitedClient(client, bucket, use_async=True)
+
+    async def main():
+        return await asyncio.gather(
+            limited.get_account("123"),
+            limited.get_account("123"),
+            limited.get_account("456"),
+            limited.place_order("123", "order"),
+        )
+
+    results = asyncio.run(main())
+    assert results == ["account 123", "account 123", "account 456", "placed"]
+    assert len(client.requests) == 3
+    assert limited.coalesced == 1
+    assert bucket.acquired == 3
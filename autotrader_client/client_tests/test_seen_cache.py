@@ -0,0 +1,53 @@
+import datetime
+import src.seen_cache as sc
+
+NOW = 1614783600.0
+
+
+def test_membership():
+    seen = sc.TimeWindowSet(window=60)
+    seen.add("a.json", NOW)
+    assert "a.json" in seen
+    assert "b.json" not in seen
+    assert len(seen) == 1
+
+
+def test_prune_evicts_outside_window():
+    """Names older than the window before the high-water mark are evicted"""
+    seen = sc.TimeWindowSet(window=60)
+    for i in range(5):
+        seen.add(f"{i}.json", NOW + i * 30)
+    assert seen.prune(NOW + 120) == 2
+    assert list(seen) == ["2.json", "3.json", "4.json"]
+    assert seen.prune(NOW + 120) == 0
+
+
+def test_max_size_evicts_oldest():
+    seen = sc.TimeWindowSet(window=60, max_size=3)
+    for i in range(5):
+        seen.add(f"{i}.json", NOW + i)
+    assert list(seen) == ["2.json", "3.json", "4.json"]
+
+
+def test_readd_refreshes_name():
+    """A name seen again moves to the newest end and survives pruning"""
+    seen = sc.TimeWindowSet(window=60)
+    seen.add("a.json", NOW)
+    seen.add("b.json", NOW + 10)
+    seen.add("a.json", NOW + 100)
+    seen.prune(NOW + 100)
+    assert list(seen) == ["a.json"]
+
+
+def test_update_from_checkpoint():
+    """Checkpoint dictionaries are added oldest first with their positions"""
+    base = datetime.datetime.fromtimestamp(NOW, tz=datetime.timezone.utc)
+    recent = {
+        "new.json": base + datetime.timedelta(seconds=100),
+        "old.json": base,
+    }
+    seen = sc.TimeWindowSet(window=60)
+    seen.update(recent)
+    assert list(seen) == ["old.json", "new.json"]
+    seen.prune(NOW + 100)
+    assert list(seen) == ["new.json"]
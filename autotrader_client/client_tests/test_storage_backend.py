@@ -0,0 +1,76 @@
+import time
+import datetime
+import pytest
+import src.storage_backend as sb
+
+
+def test_memory_backend_round_trip():
+    """Uploaded blobs can be listed, downloaded and deleted"""
+    backend = sb.MemoryBackend()
+    backend.upload_bytes("bucket", "signals/a.json", b"{}")
+    backend.upload_bytes("bucket", "archive/b.ndjson", b"")
+    names = [blob.name for blob in backend.list_blobs("bucket")]
+    assert names == ["archive/b.ndjson", "signals/a.json"]
+    listed = list(backend.list_blobs("bucket", prefix="signals/"))
+    assert [blob.name for blob in listed] == ["signals/a.json"]
+    assert isinstance(listed[0].time_created, datetime.datetime)
+    assert backend.download_bytes("bucket", "signals/a.json") == b"{}"
+    backend.delete_blob("bucket", "signals/a.json")
+    with pytest.raises(FileNotFoundError):
+        backend.download_bytes("bucket", "signals/a.json")
+    with pytest.raises(FileNotFoundError):
+        backend.delete_blob("bucket", "signals/a.json")
+    assert backend.requests["upload_bytes"] == 2
+
+
+def test_memory_backend_latency():
+    """Requests and listings cost the configured latency"""
+    backend = sb.MemoryBackend(latency=0.02, list_cost=0.001)
+    for i in range(50):
+        backend.put("bucket", f"{i}.json", "{}")
+    start = time.perf_counter()
+    backend.list_blobs("bucket")
+    assert time.perf_counter() - start >= 0.02 + 50 * 0.001
+
+
+def test_gcs_backend():
+    """GCS backend adapts storage client calls"""
+
+    class MockBlob:
+        def __init__(self, name):
+            self.name = name
+            self.time_created = datetime.datetime(2021, 3, 3)
+
+        def download_as_bytes(self):
+            return self.name.encode()
+
+    class MockBucket:
+        def blob(self, name):
+            return MockBlob(name)
+
+    class MockClient:
+        def list_blobs(self, bucket_name, prefix=None):
+            return [MockBlob("a.json")]
+
+        def bucket(self, bucket_name):
+            return MockBucket()
+
+    backend = sb.GCSBackend(MockClient())
+    assert list(backend.list_blobs("bucket")) == [
+        sb.BlobInfo("a.json", datetime.datetime(2021, 3, 3))
+    ]
+    assert backend.download_bytes("bucket", "b.json") == b"b.json"
+
+
+def test_partial_backend_cannot_be_created():
+    """A backend missing a storage method fails when created, not when called"""
+
+    class ReadOnlyBackend(sb.StorageBackend):
+        def list_blobs(self, bucket_name, prefix=None):
+            return []
+
+        def download_bytes(self, bucket_name, blob_name):
+            raise FileNotFoundError(blob_name)
+
+    with pytest.raises(TypeError):
+        ReadOnlyBackend()
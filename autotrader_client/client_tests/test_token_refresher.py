@@ -0,0 +1,156 @@
+import time
+import asyncio
+import datetime
+import src.token_refresher as tr
+
+# a Wednesday during regular market hours and a Saturday
+MARKET_OPEN = datetime.datetime(2021, 3, 3, 15, 0, tzinfo=datetime.timezone.utc)
+WEEKEND = datetime.datetime(2021, 3, 6, 15, 0, tzinfo=datetime.timezone.utc)
+
+
+class MockSession:
+    def __init__(self, expires_in):
+        self.token = self._token(expires_in)
+        self.refreshed = []
+
+    @staticmethod
+    def _token(expires_in):
+        now = time.time()
+        return {
+            "access_token": "access",
+            "refresh_token": "refresh",
+            "expires_in": 1800,
+            "expires_at": now + expires_in,
+        }
+
+    def refresh_token(self, url, refresh_token=None):
+        self.refreshed.append((url, refresh_token))
+        self.token = self._token(1800)
+
+
+class MockClient:
+    def __init__(self, expires_in):
+        self.session = MockSession(expires_in)
+        self.accounts = []
+        self.refresh_token_checks = 0
+        self.last_request = 0.0
+
+    def ensure_updated_refresh_token(self):
+        self.refresh_token_checks += 1
+        return False
+
+    def get_account(self, acct_num):
+        self.accounts.append(acct_num)
+
+
+class MockContext:
+    def __init__(self, expires_in=1800):
+        self.client = MockClient(expires_in)
+        self.async_client = None
+        self.acct_num = "123"
+
+
+def test_refresh_due():
+    refresher = tr.TokenRefresher(MockContext(expires_in=1000), refresh_margin=300)
+    now = time.time()
+    assert not refresher._refresh_due(now)
+    assert refresher._refresh_due(now + 701)
+
+
+def test_refresh_updates_metric():
+    context = MockContext(expires_in=60)
+    refresher = tr.TokenRefresher(context)
+    # token was issued 1800 - 60 seconds ago
+    assert refresher.seconds_since_refresh >= 1739
+    refresher._refresh()
+    assert context.client.session.refreshed == [(tr.tda.auth.TOKEN_ENDPOINT, "refresh")]
+    assert context.client.refresh_token_checks == 1
+    assert refresher.refreshes == 1
+    assert refresher.seconds_since_refresh < 5
+
+
+def test_keepalive_only_during_market_hours():
+    refresher = tr.TokenRefresher(MockContext(), keepalive_interval=4)
+    open_now = MARKET_OPEN.timestamp()
+    assert refresher._keepalive_due(open_now)
+    assert not refresher._keepalive_due(WEEKEND.timestamp())
+    refresher.last_keepalive = open_now
+    assert not refresher._keepalive_due(open_now + 1)
+    assert refresher._keepalive_due(open_now + 4)
+
+
+def test_no_keepalive_while_busy():
+    """Requests made by orders and lookups keep the session warm"""
+    context = MockContext()
+    refresher = tr.TokenRefresher(context, keepalive_interval=4)
+    open_now = MARKET_OPEN.timestamp()
+    context.client.last_request = open_now - 1
+    assert not refresher._keepalive_due(open_now)
+    assert refresher._keepalive_due(open_now + 3)
+
+
+def test_run_refreshes_expiring_token():
+    """Token close to expiry is refreshed without waiting for an order"""
+    context = MockContext(expires_in=10)
+
+    async def main():
+        refresher = tr.TokenRefresher(context, keepalive_interval=0.01)
+        task = asyncio.ensure_future(refresher.run())
+        try:
+            for _ in range(500):
+                if refresher.refreshes:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+        return refresher
+
+    refresher = asyncio.run(main())
+    assert refresher.refreshes == 1
+    assert len(context.client.session.refreshed) == 1
+
+
+class MockAsyncClient:
+    def __init__(self):
+        self.session = MockSession(1800)
+        self.accounts = []
+        self.last_request = 0.0
+
+    async def get_account(self, acct_num):
+        self.accounts.append(acct_num)
+
+
+def test_refresh_shares_token_with_async_client():
+    context = MockContext(expires_in=60)
+    context.async_client = MockAsyncClient()
+    refresher = tr.TokenRefresher(context)
+    refresher._refresh()
+    assert context.async_client.session.token is context.client.session.token
+    assert context.async_client.session.refreshed == []
+
+
+def test_keep_alive_warms_only_async_client(monkeypatch):
+    """Orders are placed with the asyncio client, so only its session is kept
+    warm and only when it is idle"""
+    monkeypatch.setattr(tr.ps, "market_session", lambda dt: "regular")
+    context = MockContext()
+    context.async_client = MockAsyncClient()
+    # the synchronous client being idle does not matter
+    context.async_client.last_request = time.time() + 3600
+
+    async def main(refresher):
+        task = asyncio.ensure_future(refresher.run())
+        try:
+            await asyncio.sleep(0.05)
+            context.async_client.last_request = 0.0
+            for _ in range(500):
+                if refresher.keepalives:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+
+    refresher = tr.TokenRefresher(context, keepalive_interval=0.01)
+    asyncio.run(main(refresher))
+    assert context.client.accounts == []
+    assert context.async_client.accounts[0] == "123"
@@ -7,7 +7,12 @@ import json
 import logging
 import datetime
 import math
+import time
+import collections
+import concurrent.futures
 import src.validate_params as vp
+import src.rate_limiter as rl
+import src.quote_cache as qc
 from src.client_settings import (
     TD_TOKEN_PATH,
     TD_AUTH_PARAMS_PATH,
@@ -19,22 +24,97 @@ from src.client_settings import (
     RISKY_ORD_VAL_KEY,
     BUY_LIM_KEY,
     SL_KEY,
+    TDA_REQUEST_WORKERS,
+    CANCEL_WORKERS,
+    CANCEL_DEADLINE,
+    TDA_RATE_LIMIT,
+    TDA_RATE_BURST,
 )
 
+# independent TDA requests within one order are sent concurrently
+_request_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=TDA_REQUEST_WORKERS, thread_name_prefix="tda_request"
+)
+# cancels have their own pool so a stuck cancel cannot hold up lookups
+_cancel_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=CANCEL_WORKERS, thread_name_prefix="tda_cancel"
+)
 
-def initialize_order(ord_params):
+# every TDA client in the process shares one request budget
+rate_limiter = rl.TokenBucket(TDA_RATE_LIMIT / 60, TDA_RATE_BURST)
+
+# outcome of a batch of cancels. responses maps order id to response in request
+# order, failed and timed_out hold order ids and elapsed is in seconds
+CancelBatch = collections.namedtuple(
+    "CancelBatch", ["responses", "failed", "timed_out", "elapsed"]
+)
+
+
+def initialize_order(ord_params, context=None, prefetched=None):
     """Initialize TDA and order related values,
-    authenticate with TDA site and place order"""
+    authenticate with TDA site and place order. If an ExecutionContext is provided
+    its client, account and settings are used instead, the contract is checked
+    against its option chain cache and orders are priced from its streamed
+    quotes. prefetched, if provided, is the quote for a BTO or the position and
+    STC order state for a STC"""
+
+    if context is None:
+        # initialize values
+        td_acct = load_tda_account(TD_AUTH_PARAMS_PATH)
+        usr_set = load_user_settings(ORD_SETTINGS_PATH)
+        acct_num = td_acct["acct_num"]
+        positions = None
+        orders = None
+        quotes = None
+
+        # authenticate
+        client = limit_client(
+            authenticate_tda_account(TD_TOKEN_PATH, td_acct["api_key"], td_acct["uri"])
+        )
+    else:
+        client = context.client
+        acct_num = context.acct_num
+        usr_set = context.usr_set
+        positions = context.positions
+        orders = context.orders
+        quotes = context.quotes
+        checked = context.chains.check_contract(client, ord_params)
+        if checked is None:
+            return
+        if checked is not ord_params:
+            # prefetched for the uncorrected contract
+            ord_params, prefetched = checked, None
+        quotes.watch(build_option_symbol(ord_params))
+
+    # generate and place order
+    if ord_params["instruction"] == "BTO":
+        process_bto_order(
+            client, acct_num, ord_params, usr_set, positions, orders, prefetched, quotes
+        )
+    elif ord_params["instruction"] == "STC":
+        process_stc_order(
+            client, acct_num, ord_params, usr_set, positions, orders, prefetched, quotes
+        )
+    else:
+        instr = ord_params["instruction"]
+        logging.warning(f"Invalid order instruction: {instr}")
 
-    # initialize values
-    td_acct = {}
-    with open(TD_AUTH_PARAMS_PATH) as fp:
+
+def load_tda_account(path):
+    """Returns dictionary of TDA redirect uri, app key and account number read from
+    auth params file"""
+    with open(path) as fp:
         td_auth_params = json.load(fp)
-    td_acct["uri"] = td_auth_params[TD_DICT_KEY_URI]
-    td_acct["api_key"] = td_auth_params[TD_DICT_KEY_API]
-    td_acct["acct_num"] = td_auth_params[TD_DICT_KEY_ACCT]
+    return {
+        "uri": td_auth_params[TD_DICT_KEY_URI],
+        "api_key": td_auth_params[TD_DICT_KEY_API],
+        "acct_num": td_auth_params[TD_DICT_KEY_ACCT],
+    }
+
 
-    with open(ORD_SETTINGS_PATH) as fp:
+def load_user_settings(path):
+    """Returns validated user order settings read from order guidelines file"""
+    with open(path) as fp:
         order_settings = json.load(fp)
     # max_ord_val is max $ value of order e.g. 500.00
     # high_risk_ord_value is the order value for higher risk orders
@@ -47,18 +127,7 @@ def initialize_order(ord_params):
 
     # check user inputs
     vp.validate_user_settings(usr_set)
-
-    # authenticate
-    client = authenticate_tda_account(TD_TOKEN_PATH, td_acct["api_key"], td_acct["uri"])
-
-    # generate and place order
-    if ord_params["instruction"] == "BTO":
-        process_bto_order(client, td_acct["acct_num"], ord_params, usr_set)
-    elif ord_params["instruction"] == "STC":
-        process_stc_order(client, td_acct["acct_num"], ord_params, usr_set)
-    else:
-        instr = ord_params["instruction"]
-        logging.warning(f"Invalid order instruction: {instr}")
+    return usr_set
 
 
 # creating more than one client will likely cause issues with authentication
@@ -84,6 +153,12 @@ def authenticate_tda_account(token_path: str, api_key: str, redirect_uri: str):
     return client
 
 
+def limit_client(client, use_async=False):
+    """Returns client wrapped so its requests share the process's rate limit.
+    use_async must be True for a tda asyncio client"""
+    return rl.RateLimitedClient(client, rate_limiter, use_async)
+
+
 def build_option_symbol(ord_params: dict):
     """ Returns option symbol as string from order parameters dictionary.
     Note that expiration_date must be datetime.datetime object"""
@@ -107,8 +182,72 @@ def output_response(ord_params: dict, response):
 
 
 # BTO-related functions
-def process_bto_order(client, acct_num: str, ord_params: dict, usr_set: dict):
-    """Prepare and place BTO order"""
+def process_bto_order(
+    client,
+    acct_num: str,
+    ord_params: dict,
+    usr_set: dict,
+    positions=None,
+    orders=None,
+    quote=None,
+    quotes=None,
+):
+    """Prepare and place BTO order. If a PositionBook or OrderBook is provided the
+    symbol is marked unknown in it until the fill and the stop order can be seen.
+    If a prefetched quote is provided and empty the order is rejected. The order
+    is priced from a fresh quote in the QuoteCache quotes, else from the
+    prefetched quote, else from the signal's contract price"""
+    if not is_known_contract(ord_params, quote):
+        return
+    live = current_quote(build_option_symbol(ord_params), quotes, quote)
+    prepared = prepare_bto_order(ord_params, usr_set, live)
+    if prepared is not None:
+        option_symbol, ota_order = prepared
+        response = client.place_order(acct_num, order_spec=ota_order)
+        record_bto_placement(option_symbol, positions, orders)
+        output_response(ord_params, response)
+
+
+def is_known_contract(ord_params: dict, quote):
+    """Returns False, logging a warning, if quote shows TDA does not know the
+    contract. A quote of None is unknown and returns True"""
+    if quote is not None and not quote:
+        logging.warning(f"{ord_params} is not a contract TDA quotes, order rejected")
+        return False
+    return True
+
+
+def current_quote(option_symbol: str, quotes=None, rest_quote=None):
+    """Returns fresh streamed Quote for option_symbol if quotes has one, else a
+    Quote from rest_quote, a TDA quote dict, if provided, else None"""
+    if quotes is not None:
+        quote = quotes.fresh(option_symbol)
+        if quote is not None:
+            return quote
+    return qc.quote_from_rest(rest_quote)
+
+
+def buy_reference_price(contract_price: float, quote=None):
+    """Returns price a BTO is sized and priced from, the quote's ask when it is
+    below the contract price, else the contract price"""
+    if quote is not None and quote.ask:
+        return min(quote.ask, contract_price)
+    return contract_price
+
+
+def sell_reference_price(contract_price: float, quote=None):
+    """Returns price a new STC stop is set from, the quote's bid if known, else
+    the contract price"""
+    if quote is not None and quote.bid:
+        return quote.bid
+    return contract_price
+
+
+def prepare_bto_order(ord_params: dict, usr_set: dict, quote=None):
+    """Returns option symbol and BTO order with its stop loss, or None if the
+    purchase quantity is 0. Prices follow the quote, if provided, with the
+    percentage rules applied to buy_reference_price"""
+    price = buy_reference_price(ord_params["contract_price"], quote)
     # determine risk level and corresponding order size
     if ord_params["flags"]["risk_level"] == "high risk":
         order_value = usr_set["high_risk_ord_val"]
@@ -116,7 +255,7 @@ def process_bto_order(client, acct_num: str, ord_params: dict, usr_set: dict):
         order_value = usr_set["max_ord_val"]
     # determine purchase quantity
     buy_qty = calc_buy_order_quantity(
-        ord_params["contract_price"], order_value, usr_set["buy_limit_percent"],
+        price, order_value, usr_set["buy_limit_percent"],
     )
     if buy_qty >= 1:
         option_symbol = build_option_symbol(ord_params)
@@ -128,22 +267,30 @@ def process_bto_order(client, acct_num: str, ord_params: dict, usr_set: dict):
             rec_sl_percent = calc_sl_percentage(ord_params["contract_price"], rec_sl)
             if rec_sl_percent < usr_set["SL_percent"]:
                 sl_percent = rec_sl_percent
-        sl_price = calc_sl_price(ord_params["contract_price"], sl_percent)
-        buy_lim_price = calc_buy_limit_price(
-            ord_params["contract_price"], usr_set["buy_limit_percent"]
-        )
+        sl_price = calc_sl_price(price, sl_percent)
+        buy_lim_price = calc_buy_limit_price(price, usr_set["buy_limit_percent"])
 
         # prepare buy limit order and accompanying stop loss order
         ota_order = build_bto_order_w_stop_loss(
             option_symbol, buy_qty, buy_lim_price, sl_price
         )
-        response = client.place_order(acct_num, order_spec=ota_order)
-        output_response(ord_params, response)
+        return option_symbol, ota_order
 
     else:
         msg1 = f"{ord_params} purchase quantity is 0\n"
         msg2 = "This may be due to a low max order value or high buy limit percent\n\n"
         sys.stderr.write(msg1 + msg2)
+        return None
+
+
+def record_bto_placement(option_symbol: str, positions=None, orders=None):
+    """Mark symbol unknown in the books until the BTO fill and its stop order can
+    be seen"""
+    if positions is not None:
+        # fill-or-kill limit orders may not fill
+        positions.expect_fill(option_symbol)
+    if orders is not None:
+        orders.expect_orders(option_symbol)
 
 
 def calc_buy_order_quantity(price: float, ord_val: float, limit_percent: float):
@@ -190,60 +337,264 @@ def build_bto_order_w_stop_loss(
 
 
 # STC-related function
-def process_stc_order(client, acct_num: str, ord_params: dict, usr_set: dict):
-    """ Prepare and place STC order"""
+def process_stc_order(
+    client,
+    acct_num: str,
+    ord_params: dict,
+    usr_set: dict,
+    positions=None,
+    orders=None,
+    stc_state=None,
+    quotes=None,
+):
+    """ Prepare and place STC order. If a PositionBook is provided the position is
+    looked up there and updated with the market order fill. If an OrderBook is
+    provided existing STC orders are looked up there and it is updated with the
+    cancels and the new stop order. stc_state, if provided, is a prefetched
+    result of get_stc_state. A new stop is priced from a fresh quote in the
+    QuoteCache quotes if it has one"""
     option_symbol = build_option_symbol(ord_params)
-    pos_qty = get_position_quant(client, acct_num, option_symbol)
+    if stc_state is None:
+        stc_state = get_stc_state(client, acct_num, option_symbol, positions, orders)
+    pos_qty, existing_stc_ids = stc_state
     if pos_qty is not None and pos_qty >= 1:
         # cancel existing STC orders (like stop-markets)
-        existing_stc_ids = get_existing_stc_orders(client, option_symbol)
         if len(existing_stc_ids) > 0:
-            for ord_id in existing_stc_ids:
-                response = client.cancel_order(ord_id, acct_num)
-                logging.info(response.content)
-
-        # if the STC order is meant to reduce the position, sell the suggested %
-        # then issue a new STC stop-market for the remainder
-        if ord_params["flags"]["reduce"] is not None:
-            sell_qty, keep_qty = calc_position_reduction(
-                pos_qty, ord_params["flags"]["reduce"]
+            batch = cancel_orders(
+                client, acct_num, existing_stc_ids, option_symbol, orders
             )
+            if not cancels_settled(batch, ord_params):
+                return
+
+        quote = current_quote(option_symbol, quotes)
+        for order_spec, sell_qty in plan_stc_orders(
+            option_symbol, pos_qty, ord_params, usr_set, quote
+        ):
+            response = client.place_order(acct_num, order_spec=order_spec)
+            record_stc_placement(
+                client, acct_num, response, option_symbol, sell_qty, positions, orders
+            )
+            output_response(ord_params, response)
+
+
+def cancels_settled(batch, ord_params: dict):
+    """Returns True if every cancel in CancelBatch batch succeeded, else logs an
+    error and returns False. An order whose cancel failed may still hold the
+    position, so selling into it could oversell or be rejected"""
+    unsettled = batch.failed + batch.timed_out
+    if unsettled:
+        logging.error(
+            f"Orders {unsettled} may still be working, STC order not placed: "
+            f"{ord_params}"
+        )
+        return False
+    return True
 
-            stc = build_stc_market_order(option_symbol, sell_qty)
-            response_stc = client.place_order(acct_num, order_spec=stc)
 
-            new_sl_price = calc_sl_price(
-                ord_params["contract_price"], usr_set["SL_percent"]
+def plan_stc_orders(
+    option_symbol: str, pos_qty, ord_params: dict, usr_set: dict, quote=None
+):
+    """Returns list of (order, sell quantity) to place in order for a STC signal.
+    Sell quantity is None for stop orders, which are priced from
+    sell_reference_price"""
+    # if the STC order is meant to reduce the position, sell the suggested %
+    # then issue a new STC stop-market for the remainder
+    if ord_params["flags"]["reduce"] is not None:
+        sell_qty, keep_qty = calc_position_reduction(
+            pos_qty, ord_params["flags"]["reduce"]
+        )
+        planned = [(build_stc_market_order(option_symbol, sell_qty), sell_qty)]
+        if keep_qty > 0:
+            reference = sell_reference_price(ord_params["contract_price"], quote)
+            new_sl_price = calc_sl_price(reference, usr_set["SL_percent"])
+            stc_stop = build_stc_stop_market_order(
+                option_symbol, keep_qty, new_sl_price
             )
-            output_response(ord_params, response_stc)
-
-            if keep_qty > 0:
-                stc_stop = build_stc_stop_market_order(
-                    option_symbol, keep_qty, new_sl_price
-                )
-                response_stop = client.place_order(acct_num, order_spec=stc_stop)
-                output_response(ord_params, response_stop)
-
-        # else sell the entire position
-        else:
-            stc = build_stc_market_order(option_symbol, pos_qty)
-            response = client.place_order(acct_num, order_spec=stc)
-            output_response(ord_params, response)
+            planned.append((stc_stop, None))
+        return planned
 
+    # else sell the entire position
+    return [(build_stc_market_order(option_symbol, pos_qty), pos_qty)]
 
-def get_position_quant(client, acct_id: str, symbol: str):
-    """Takes client, account_id, and symbol to search for.
-    Returns position long quantity for symbol"""
+
+def record_stc_placement(
+    client, acct_num: str, response, option_symbol: str, sell_qty, positions, orders
+):
+    """Update the books with a placed STC order. Market orders are taken as filled
+    and stop orders are indexed"""
+    if sell_qty is not None:
+        if positions is not None:
+            positions.apply_fill(option_symbol, -sell_qty)
+    elif orders is not None:
+        orders.record_placement(
+            placed_order_id(client, acct_num, response), option_symbol, "SELL_TO_CLOSE"
+        )
+
+
+def get_quote(client, symbol: str):
+    """Returns quote for symbol, empty if TDA does not know the symbol. Raises
+    if the request fails"""
+    response = client.get_quote(symbol)
+    # an error body has no quote and would read as an unknown symbol
+    response.raise_for_status()
+    return response.json().get(symbol, {})
+
+
+def get_option_chain(client, ticker: str, from_date, to_date):
+    """Returns option chain of ticker for expirations between the dates"""
+    response = client.get_option_chain(ticker, from_date=from_date, to_date=to_date)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_positions(client, acct_id: str):
+    """Returns list of positions held in account"""
     response = client.get_account(
         acct_id, fields=tda.client.Client.Account.Fields.POSITIONS
     )
     summary = response.json()
-    positions = summary["securitiesAccount"]["positions"]
+    # accounts without positions have no positions key
+    return summary["securitiesAccount"].get("positions", [])
+
+
+def cancel_orders(
+    client, acct_num: str, order_ids, symbol: str, orders=None, deadline=None
+):
+    """Cancels orders concurrently, at most CANCEL_WORKERS at a time. A cancel
+    still unanswered deadline seconds after it was sent is given up on. Returns
+    CancelBatch once every cancel has been answered or given up on. If an
+    OrderBook is provided it is updated with the outcome. Responses are logged in
+    request order followed by the batch timing"""
+    if deadline is None:
+        deadline = CANCEL_DEADLINE
+    start = time.monotonic()
+    started = {}  # order id: time its cancel was sent
+
+    def cancel(ord_id):
+        started[ord_id] = time.monotonic()
+        return client.cancel_order(ord_id, acct_num)
+
+    futures = {_cancel_pool.submit(cancel, ord_id): ord_id for ord_id in order_ids}
+    pending = set(futures)
+    results = {}
+    failed = []
+    timed_out = []
+    while pending:
+        now = time.monotonic()
+        # cancels still waiting for a worker have not started their deadline
+        expiry = min(started.get(futures[f], now) + deadline for f in pending)
+        done, pending = concurrent.futures.wait(
+            pending,
+            timeout=max(expiry - now, 0),
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for future in done:
+            ord_id = futures[future]
+            try:
+                results[ord_id] = future.result()
+            except Exception:
+                logging.exception(f"Failed to cancel order {ord_id}")
+                failed.append(ord_id)
+        now = time.monotonic()
+        for future in list(pending):
+            ord_id = futures[future]
+            if ord_id in started and now - started[ord_id] >= deadline:
+                pending.remove(future)
+                timed_out.append(ord_id)
+
+    return record_cancel_batch(
+        order_ids, results, failed, timed_out, start, symbol, orders
+    )
+
+
+def record_cancel_batch(order_ids, results, failed, timed_out, start, symbol, orders):
+    """Returns CancelBatch for cancels of order_ids started at start (monotonic
+    seconds), logging responses and timing and updating the OrderBook if provided.
+    results maps order id to response. Cancels TDA answered with an error are
+    moved to failed"""
+    for ord_id in [ord_id for ord_id, resp in results.items() if resp.is_error]:
+        response = results.pop(ord_id)
+        logging.error(
+            f"TDA rejected cancel of order {ord_id}: {response.status_code} "
+            f"{response.content}"
+        )
+        failed.append(ord_id)
+    if orders is not None:
+        for ord_id in results:
+            orders.record_cancel(ord_id)
+        if failed or timed_out:
+            # the orders may or may not still be working
+            orders.expect_orders(symbol)
+    responses = {ord_id: results[ord_id] for ord_id in order_ids if ord_id in results}
+    for response in responses.values():
+        logging.info(response.content)
+    batch = CancelBatch(responses, failed, timed_out, time.monotonic() - start)
+    logging.info(
+        f"Cancelled {len(responses)} of {len(order_ids)} orders for {symbol} in "
+        f"{batch.elapsed:.3f} seconds, {len(failed)} failed, "
+        f"{len(timed_out)} timed out"
+    )
+    return batch
+
+
+def get_stc_state(client, acct_id: str, symbol: str, positions=None, orders=None):
+    """Returns position long quantity and ids of in-effect STC orders for symbol.
+    Whatever the books cannot answer is requested from TDA concurrently"""
+    pos_qty = _request_pool.submit(
+        lookup_position_quant, client, acct_id, symbol, positions
+    )
+    stc_ids = _request_pool.submit(lookup_stc_orders, client, symbol, orders)
+    return pos_qty.result(), stc_ids.result()
+
+
+def lookup_position_quant(client, acct_id: str, symbol: str, positions=None):
+    """Returns position long quantity for symbol from the PositionBook if it knows
+    the symbol, else fetches it from the account and records it in the book"""
+    if positions is not None and positions.is_known(symbol):
+        return positions.quantity(symbol)
+    pos_qty = get_position_quant(client, acct_id, symbol)
+    if positions is not None:
+        positions.set_quantity(symbol, pos_qty)
+    return pos_qty
+
+
+def get_position_quant(client, acct_id: str, symbol: str):
+    """Takes client, account_id, and symbol to search for.
+    Returns position long quantity for symbol"""
+    return find_position_quant(get_positions(client, acct_id), symbol)
+
+
+def find_position_quant(positions, symbol: str):
+    """Returns long quantity of symbol in list of positions or None"""
     for position in positions:
         if position["instrument"]["symbol"] == symbol:
             return float(position["longQuantity"])
 
 
+def placed_order_id(client, acct_num: str, response):
+    """Returns id of order placed by response or None if it cannot be read"""
+    try:
+        return tda.utils.Utils(client, acct_num).extract_order_id(response)
+    except (tda.utils.UnsuccessfulOrderException, tda.utils.AccountIdMismatchException):
+        return None
+
+
+def lookup_stc_orders(client, symbol: str, orders=None):
+    """Returns ids of in-effect STC orders for symbol from the OrderBook if it
+    knows the symbol, else queries recent orders"""
+    if orders is not None and orders.is_known(symbol):
+        return orders.stc_orders(symbol)
+    return get_existing_stc_orders(client, symbol)
+
+
+def query_orders(client, from_entered_datetime):
+    """Returns list of orders entered since from_entered_datetime"""
+    response = client.get_orders_by_query(
+        from_entered_datetime=from_entered_datetime, statuses=None
+    )
+    return response.json()
+
+
 def get_existing_stc_orders(client, symbol: str, hours=32):
     """Returns a list of existing single-leg STC orders for the given symbol.
     This library is not currently designed to work with multi-leg (complex) orders"""
@@ -256,10 +607,12 @@ def get_existing_stc_orders(client, symbol: str, hours=32):
         tda.client.Client.Order.Status.WORKING,
     )  # waiting for tda patch to implement multi-status check and speed up query time
 
-    response = client.get_orders_by_query(
-        from_entered_datetime=query_start, statuses=None
-    )
-    summary = response.json()
+    return find_stc_orders(query_orders(client, query_start), symbol)
+
+
+def find_stc_orders(summary, symbol: str):
+    """Returns ids of in-effect single-leg STC orders for symbol in list of orders,
+    including child orders"""
     order_ids = []
     for order in summary:
         # is the order an in-effect STC order?
@@ -0,0 +1,200 @@
+"""Asyncio versions of the functions that execute TD Ameritrade orders. They use
+the tda asyncio client so orders, and the requests within an order, overlap on
+the event loop and share one HTTP connection pool"""
+
+import time
+import asyncio
+import logging
+import datetime
+import tda
+import src.ameritrade_orders as am_ord
+from src.client_settings import CANCEL_WORKERS, CANCEL_DEADLINE
+
+
+async def initialize_order(ord_params, context, prefetched=None):
+    """Place order with the asyncio client, account, settings and books of an
+    ExecutionContext. prefetched is as for am_ord.initialize_order"""
+    chains = context.chains
+    if chains.needs_fetch(ord_params):
+        # the chain cache fetches with the synchronous client
+        loop = asyncio.get_running_loop()
+        checked = await loop.run_in_executor(
+            None, chains.check_contract, context.client, ord_params
+        )
+    else:
+        checked = chains.check_contract(context.client, ord_params)
+    if checked is None:
+        return
+    if checked is not ord_params:
+        ord_params, prefetched = checked, None
+    quotes = context.quotes
+    quotes.watch(am_ord.build_option_symbol(ord_params))
+    client = context.async_client
+    acct_num = context.acct_num
+    usr_set = context.usr_set
+    positions = context.positions
+    orders = context.orders
+
+    if ord_params["instruction"] == "BTO":
+        await process_bto_order(
+            client, acct_num, ord_params, usr_set, positions, orders, prefetched, quotes
+        )
+    elif ord_params["instruction"] == "STC":
+        await process_stc_order(
+            client, acct_num, ord_params, usr_set, positions, orders, prefetched, quotes
+        )
+    else:
+        instr = ord_params["instruction"]
+        logging.warning(f"Invalid order instruction: {instr}")
+
+
+async def process_bto_order(
+    client,
+    acct_num: str,
+    ord_params: dict,
+    usr_set: dict,
+    positions=None,
+    orders=None,
+    quote=None,
+    quotes=None,
+):
+    """Prepare and place BTO order unless a prefetched quote is empty. Priced as
+    in am_ord.process_bto_order"""
+    if not am_ord.is_known_contract(ord_params, quote):
+        return
+    option_symbol = am_ord.build_option_symbol(ord_params)
+    live = am_ord.current_quote(option_symbol, quotes, quote)
+    prepared = am_ord.prepare_bto_order(ord_params, usr_set, live)
+    if prepared is not None:
+        option_symbol, ota_order = prepared
+        response = await client.place_order(acct_num, order_spec=ota_order)
+        am_ord.record_bto_placement(option_symbol, positions, orders)
+        am_ord.output_response(ord_params, response)
+
+
+async def process_stc_order(
+    client,
+    acct_num: str,
+    ord_params: dict,
+    usr_set: dict,
+    positions=None,
+    orders=None,
+    stc_state=None,
+    quotes=None,
+):
+    """Prepare and place STC order, looking up the position and existing STC
+    orders concurrently unless stc_state was prefetched"""
+    option_symbol = am_ord.build_option_symbol(ord_params)
+    if stc_state is None:
+        stc_state = await get_stc_state(
+            client, acct_num, option_symbol, positions, orders
+        )
+    pos_qty, existing_stc_ids = stc_state
+    if pos_qty is not None and pos_qty >= 1:
+        # cancel existing STC orders (like stop-markets)
+        if len(existing_stc_ids) > 0:
+            batch = await cancel_orders(
+                client, acct_num, existing_stc_ids, option_symbol, orders
+            )
+            if not am_ord.cancels_settled(batch, ord_params):
+                return
+
+        quote = am_ord.current_quote(option_symbol, quotes)
+        for order_spec, sell_qty in am_ord.plan_stc_orders(
+            option_symbol, pos_qty, ord_params, usr_set, quote
+        ):
+            response = await client.place_order(acct_num, order_spec=order_spec)
+            am_ord.record_stc_placement(
+                client, acct_num, response, option_symbol, sell_qty, positions, orders
+            )
+            am_ord.output_response(ord_params, response)
+
+
+async def cancel_orders(
+    client, acct_num: str, order_ids, symbol: str, orders=None, deadline=None
+):
+    """Cancels orders concurrently, at most CANCEL_WORKERS at a time. A cancel
+    still unanswered deadline seconds after it was sent is given up on. Returns
+    am_ord.CancelBatch"""
+    if deadline is None:
+        deadline = CANCEL_DEADLINE
+    start = time.monotonic()
+    semaphore = asyncio.Semaphore(CANCEL_WORKERS)
+    results = {}
+    failed = []
+    timed_out = []
+
+    async def cancel(ord_id):
+        async with semaphore:
+            try:
+                results[ord_id] = await asyncio.wait_for(
+                    client.cancel_order(ord_id, acct_num), deadline
+                )
+            except asyncio.TimeoutError:
+                timed_out.append(ord_id)
+            except Exception:
+                logging.exception(f"Failed to cancel order {ord_id}")
+                failed.append(ord_id)
+
+    await asyncio.gather(*(cancel(ord_id) for ord_id in order_ids))
+    return am_ord.record_cancel_batch(
+        order_ids, results, failed, timed_out, start, symbol, orders
+    )
+
+
+async def get_stc_state(client, acct_id: str, symbol: str, positions=None, orders=None):
+    """Returns position long quantity and ids of in-effect STC orders for symbol.
+    Whatever the books cannot answer is requested from TDA concurrently"""
+    pos_qty, stc_ids = await asyncio.gather(
+        lookup_position_quant(client, acct_id, symbol, positions),
+        lookup_stc_orders(client, symbol, orders),
+    )
+    return pos_qty, stc_ids
+
+
+async def lookup_position_quant(client, acct_id: str, symbol: str, positions=None):
+    """Returns position long quantity for symbol from the PositionBook if it knows
+    the symbol, else fetches it from the account and records it in the book"""
+    if positions is not None and positions.is_known(symbol):
+        return positions.quantity(symbol)
+    pos_qty = await get_position_quant(client, acct_id, symbol)
+    if positions is not None:
+        positions.set_quantity(symbol, pos_qty)
+    return pos_qty
+
+
+async def get_position_quant(client, acct_id: str, symbol: str):
+    """Returns position long quantity for symbol"""
+    return am_ord.find_position_quant(await get_positions(client, acct_id), symbol)
+
+
+async def get_positions(client, acct_id: str):
+    """Returns list of positions held in account"""
+    response = await client.get_account(
+        acct_id, fields=tda.client.Client.Account.Fields.POSITIONS
+    )
+    summary = response.json()
+    # accounts without positions have no positions key
+    return summary["securitiesAccount"].get("positions", [])
+
+
+async def lookup_stc_orders(client, symbol: str, orders=None):
+    """Returns ids of in-effect STC orders for symbol from the OrderBook if it
+    knows the symbol, else queries recent orders"""
+    if orders is not None and orders.is_known(symbol):
+        return orders.stc_orders(symbol)
+    return await get_existing_stc_orders(client, symbol)
+
+
+async def query_orders(client, from_entered_datetime):
+    """Returns list of orders entered since from_entered_datetime"""
+    response = await client.get_orders_by_query(
+        from_entered_datetime=from_entered_datetime, statuses=None
+    )
+    return response.json()
+
+
+async def get_existing_stc_orders(client, symbol: str, hours=32):
+    """Returns a list of existing single-leg STC orders for the given symbol"""
+    query_start = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    return am_ord.find_stc_orders(await query_orders(client, query_start), symbol)
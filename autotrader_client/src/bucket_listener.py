@@ -2,41 +2,262 @@
 and downloads updates to local storage"""
 
 import os
+import json
+import logging
 import datetime
 import asyncio
+import concurrent.futures
+import requests
+import google.auth.transport.requests
+from google.oauth2 import service_account
 from google.cloud import storage
+import src.checkpoint as cp
+import src.storage_backend as sb
+import src.client_utils as utils
+from src.client_settings import SIGNAL_PREFIX, ACK_PREFIX, DOWNLOAD_ATTEMPTS
 
 
 class BucketListener:
     """Class object listens to a GCP bucket and downloads updates"""
 
-    def __init__(self, gcp_bucket_name, gcp_creds_path, local_directory, sleep_time=1):
+    def __init__(
+        self,
+        gcp_bucket_name,
+        gcp_creds_path,
+        local_directory,
+        sleep_time=1,
+        max_downloads=4,
+        signal_queue=None,
+        scheduler=None,
+        checkpoint=None,
+        backend=None,
+        signal_prefix=SIGNAL_PREFIX,
+        ack_prefix=ACK_PREFIX,
+        download_attempts=DOWNLOAD_ATTEMPTS,
+    ):
+        # GCS calls are blocking, so they run on a dedicated thread
+        # to keep the event loop free for the other workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="bucket_listener"
+        )
+        # bursts of signals are downloaded concurrently by a bounded pool
+        self._max_downloads = max_downloads
+        self._download_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_downloads, thread_name_prefix="blob_download"
+        )
         self._gcp_creds_path = gcp_creds_path
-        self._client = self._authenticate_client()
+        # if not provided, the bucket is read from GCS with the given credentials
+        if backend is None:
+            backend = sb.GCSBackend(self._authenticate_client())
+        self._backend = backend
+        self._signal_prefix = signal_prefix
+        self._ack_prefix = ack_prefix
         self._bucket_name = gcp_bucket_name
-        self._updated = datetime.datetime.now(datetime.timezone.utc)
+        # blobs already handed off that could still be listed as new
+        self._delivered = {}
+        # failed downloads of each blob; a blob is given up on after
+        # download_attempts so it stops holding back the listening position
+        self._download_attempts = download_attempts
+        self._failures = {}
+        # if provided, listening resumes from where the last run stopped
+        self._checkpoint = checkpoint
+        self._updated = self._resume_position()
         self._local_directory = local_directory
         self._sleep_time = sleep_time
+        # if provided, parsed signals are handed straight to the order monitor
+        # and the local files are only kept as an audit copy
+        self._signal_queue = signal_queue
+        # if provided, poll frequency follows market hours instead of sleep_time
+        self._scheduler = scheduler
         self._init_local_directory()
 
     def _authenticate_client(self):
-        return storage.Client.from_service_account_json(self._gcp_creds_path)
+        credentials = service_account.Credentials.from_service_account_file(
+            self._gcp_creds_path, scopes=storage.Client.SCOPE
+        )
+        # all download threads share one authorized session, so its
+        # connection pool is sized to the number of concurrent downloads
+        session = google.auth.transport.requests.AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self._max_downloads)
+        session.mount("https://", adapter)
+        return storage.Client(
+            project=credentials.project_id, credentials=credentials, _http=session
+        )
 
     def _init_local_directory(self):
         os.makedirs(self._local_directory, exist_ok=True)
 
+    def _resume_position(self):
+        """Returns the time to resume listening from. Signals that were handed off
+        but never processed by the order monitor are delivered again"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if self._checkpoint is None:
+            return now
+        position = self._checkpoint.position(cp.LISTENER) or now
+        processed = self._checkpoint.recent(cp.MONITOR)
+        for name, created in self._checkpoint.recent(cp.LISTENER).items():
+            if name in processed:
+                self._delivered[name] = created
+            else:
+                position = min(position, created)
+        return position
+
+    def _is_new_blob(self, blob):
+        """Return True if blob has not been handed off before, else False"""
+        if blob.name in self._delivered:
+            return False
+        if self._checkpoint is None:
+            # without a checkpoint, local files are the only record of past runs
+            partitions = {
+                utils.signal_partition(self._local_directory, blob.time_created),
+                utils.signal_partition(self._local_directory),
+            }
+            files = [os.path.join(p, blob.name) for p in partitions]
+            return not any(os.path.isfile(f) for f in files)
+        return True
+
     def _get_newest(self):
-        blob_iter = self._client.list_blobs(self._bucket_name)
+        """Download blobs created since the last update. Returns list of
+        (blob name, contents) tuples in signal order"""
+        blob_iter = self._backend.list_blobs(
+            self._bucket_name, prefix=self._signal_prefix
+        )
         recent = self._updated - datetime.timedelta(seconds=5)
+        # blobs older than the listing window can never be listed as new again
+        self._delivered = {n: c for n, c in self._delivered.items() if c > recent}
+        new_blobs = []
         for blob in blob_iter:
-            if blob.time_created > recent:
-                file_name = os.path.join(self._local_directory, blob.name)
-                if not os.path.isfile(file_name):
-                    blob.download_to_filename(file_name)
-        self._updated = datetime.datetime.now(datetime.timezone.utc)
+            # signals are known by their name within the signal prefix
+            blob = sb.BlobInfo(blob.name[len(self._signal_prefix) :], blob.time_created)
+            if blob.time_created > recent and self._is_new_blob(blob):
+                new_blobs.append(blob)
+        new_blobs.sort(key=self._signal_id)
+        for blob in new_blobs:
+            self._delivered[blob.name] = blob.time_created
+
+        # map returns results in submission order, so the burst is
+        # handed off in signal order however the downloads complete
+        contents = self._download_pool.map(self._download, new_blobs)
+        signals = []
+        updated = datetime.datetime.now(datetime.timezone.utc)
+        for blob, data in zip(new_blobs, contents):
+            if data is None:
+                failures = self._failures.get(blob.name, 0) + 1
+                if failures >= self._download_attempts:
+                    # stays delivered, so it is not listed as new again
+                    del self._failures[blob.name]
+                    logging.error(
+                        f"Giving up on {blob.name} after {failures} failed downloads"
+                    )
+                    continue
+                # failed blobs are listed again on the next poll
+                self._failures[blob.name] = failures
+                del self._delivered[blob.name]
+                updated = min(updated, blob.time_created)
+            else:
+                self._failures.pop(blob.name, None)
+                signals.append((blob.name, data))
+        self._updated = updated
+        return signals
+
+    def _download(self, blob):
+        """Returns blob contents as bytes or None if the download failed"""
+        try:
+            blob_name = self._signal_prefix + blob.name
+            return self._backend.download_bytes(self._bucket_name, blob_name)
+        except Exception as err:
+            logging.warning(f"Failed to download {blob.name}: {err}")
+            return None
+
+    def _write_signals(self, signals):
+        """Write signals to today's partition of the local directory. Each signal
+        is written to a partial file first so a file is never seen half-written.
+        Returns file names"""
+        partition = utils.signal_partition(self._local_directory)
+        os.makedirs(partition, exist_ok=True)
+        file_names = []
+        for name, data in signals:
+            file_name = os.path.join(partition, name)
+            with open(file_name + ".part", "wb") as fp:
+                fp.write(data)
+            os.replace(file_name + ".part", file_name)
+            file_names.append(file_name)
+        return file_names
+
+    def _commit_checkpoint(self, names):
+        """Record listening position and the signals that were handed off"""
+        delivered = {name: self._delivered[name] for name in names}
+        self._checkpoint.commit(cp.LISTENER, self._updated, delivered)
+
+    def _enqueue_signals(self, signals):
+        """Parse signals and put them on the signal queue in signal order.
+        Returns names of the signals put on the queue"""
+        enqueued = []
+        for name, data in signals:
+            try:
+                order_params = json.loads(data)
+            except ValueError:
+                logging.warning(f"{name} is not a valid signal file")
+            else:
+                created = self._delivered[name]
+                self._signal_queue.put_nowait((name, created, order_params))
+                enqueued.append(name)
+        return enqueued
+
+    def acknowledge(self, name):
+        """Write an acknowledgment marker for a processed signal so the bucket
+        compaction job can archive it"""
+        ack = self._download_pool.submit(
+            self._backend.upload_bytes,
+            self._bucket_name,
+            self._ack_prefix + name,
+            b"",
+        )
+        ack.add_done_callback(self._log_ack_failure)
+
+    @staticmethod
+    def _log_ack_failure(future):
+        """Log an acknowledgment marker that could not be written"""
+        if future.exception() is not None:
+            logging.warning(f"Failed to acknowledge signal: {future.exception()}")
+
+    @staticmethod
+    def _log_audit_failure(future):
+        """Log an audit copy that could not be written"""
+        if future.exception() is not None:
+            logging.error(f"Failed to write signal audit copy: {future.exception()}")
+
+    @staticmethod
+    def _signal_id(blob):
+        """Returns sort key that orders blobs by upload time then name"""
+        return blob.time_created, blob.name
 
     async def run(self):
+        loop = asyncio.get_running_loop()
         while True:
-            self._get_newest()
+            signals = await loop.run_in_executor(self._executor, self._get_newest)
+            if signals and self._scheduler is not None:
+                self._scheduler.notify_activity()
+            if self._signal_queue is not None:
+                # unparseable signals never reach the monitor, so they are left
+                # out of the checkpoint rather than redelivered on every restart
+                handed_off = self._enqueue_signals(signals)
+                # audit copy is written off the critical path; the executor
+                # finishes it before the next listing checks for local files
+                audit = self._executor.submit(self._write_signals, signals)
+                audit.add_done_callback(self._log_audit_failure)
+            else:
+                await loop.run_in_executor(
+                    self._executor, self._write_signals, signals
+                )
+                handed_off = [name for name, data in signals]
+            if self._checkpoint is not None:
+                self._executor.submit(self._commit_checkpoint, handed_off)
             print("listening")
+            await self._sleep()
+
+    async def _sleep(self):
+        if self._scheduler is not None:
+            await self._scheduler.sleep()
+        else:
             await asyncio.sleep(self._sleep_time)
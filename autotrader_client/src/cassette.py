@@ -0,0 +1,231 @@
+"""Record and replay of the HTTP exchanges a tda client makes, so order code can
+be benchmarked against production-shaped responses without network access"""
+
+import gzip
+import json
+import time
+import asyncio
+import threading
+import collections
+import httpx
+import tda
+
+# query parameters derived from the current time, ignored when matching requests.
+# The option chain's fromDate and toDate select expirations, so they are matched
+VOLATILE_PARAMS = ("fromEnteredTime", "toEnteredTime")
+# query parameter holding the API key, never written to a cassette
+API_KEY_PARAM = "apikey"
+# response headers kept, tda.utils reads placed order ids from Location
+KEPT_HEADERS = ("content-type", "location")
+# OAuth token values are never written to a cassette
+SECRET_KEYS = ("access_token", "refresh_token")
+REDACTED = "REDACTED"
+
+
+class CassetteMiss(LookupError):
+    """A replayed request has no unused recorded exchange"""
+
+
+def open_cassette(path, mode="r"):
+    """Returns cassette file opened in text mode, gzip compressed if path ends
+    with .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def load_cassette(path):
+    """Returns list of recorded exchanges in the order they were sent"""
+    with open_cassette(path) as fp:
+        exchanges = [json.loads(line) for line in fp if line.strip()]
+    return sorted(exchanges, key=lambda exchange: exchange["offset"])
+
+
+def redact(text):
+    """Returns text, or REDACTED if it holds an OAuth token"""
+    if any(key in text for key in SECRET_KEYS):
+        return REDACTED
+    return text
+
+
+def request_key(method, url, body):
+    """Returns key matching a replayed request to recorded exchanges: method,
+    path, query parameters other than VOLATILE_PARAMS and the API key and
+    redacted body"""
+    url = httpx.URL(url)
+    params = sorted(
+        (name, value)
+        for name, value in url.params.multi_items()
+        if name not in VOLATILE_PARAMS and name != API_KEY_PARAM
+    )
+    return (method, url.path, tuple(params), redact(body))
+
+
+def _body(request):
+    return request.content.decode("utf-8", errors="replace")
+
+
+class CassetteRecorder:
+    """Writes exchanges to a new cassette file, one compact JSON line each, as
+    they complete. Offsets are seconds from the recorder's creation. A recorder
+    may be shared by the transports of a synchronous and an asyncio client"""
+
+    def __init__(self, path):
+        self._file = open_cassette(path, "w")
+        self._start = time.monotonic()
+        # requests are sent from several execution threads
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, request, response, sent):
+        """Write exchange of request sent at monotonic time sent"""
+        headers = {
+            name: response.headers[name]
+            for name in KEPT_HEADERS
+            if name in response.headers
+        }
+        exchange = {
+            "offset": round(sent - self._start, 6),
+            "elapsed": round(time.monotonic() - sent, 6),
+            "method": request.method,
+            "url": str(request.url.copy_remove_param(API_KEY_PARAM)),
+            "body": redact(_body(request)),
+            "status": response.status_code,
+            "headers": headers,
+            "content": redact(response.text),
+        }
+        line = json.dumps(exchange, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            # exchanges survive a crash of the recording session
+            self._file.flush()
+            self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """Sends requests with transport and records each exchange"""
+
+    def __init__(self, transport, recorder):
+        self._transport = transport
+        self._recorder = recorder
+
+    def handle_request(self, request):
+        sent = time.monotonic()
+        response = self._transport.handle_request(request)
+        response.read()
+        self._recorder.record(request, response, sent)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    """RecordingTransport for asyncio clients"""
+
+    def __init__(self, transport, recorder):
+        self._transport = transport
+        self._recorder = recorder
+
+    async def handle_async_request(self, request):
+        sent = time.monotonic()
+        response = await self._transport.handle_async_request(request)
+        await response.aread()
+        self._recorder.record(request, response, sent)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class CassetteReplayer:
+    """Answers requests from recorded exchanges. Each request gets the first
+    unused exchange with its request_key, so replays are deterministic however
+    concurrent requests interleave. If speed is None responses are answered at
+    once, else each is held until the time it arrived at in the recording,
+    counted from the first replayed request and divided by speed"""
+
+    def __init__(self, exchanges, speed=None):
+        self._unused = collections.defaultdict(collections.deque)
+        for exchange in exchanges:
+            key = request_key(exchange["method"], exchange["url"], exchange["body"])
+            self._unused[key].append(exchange)
+        self._first = min((exchange["offset"] for exchange in exchanges), default=0)
+        self._speed = speed
+        self._start = None
+        self._lock = threading.Lock()
+        self.replayed = 0
+
+    def take(self, request):
+        """Returns recorded response to request and seconds to wait before
+        answering. Raises CassetteMiss if no unused exchange matches"""
+        key = request_key(request.method, str(request.url), _body(request))
+        with self._lock:
+            if self._start is None:
+                self._start = time.monotonic()
+            if not self._unused[key]:
+                raise CassetteMiss(
+                    f"No recorded response to {request.method} {request.url}"
+                )
+            exchange = self._unused[key].popleft()
+            self.replayed += 1
+        response = httpx.Response(
+            exchange["status"],
+            headers=exchange["headers"],
+            content=exchange["content"].encode("utf-8"),
+            request=request,
+        )
+        if self._speed is None:
+            return response, 0
+        arrived = exchange["offset"] + exchange["elapsed"] - self._first
+        due = self._start + arrived / self._speed
+        return response, max(0, due - time.monotonic())
+
+
+class ReplayTransport(httpx.BaseTransport):
+    def __init__(self, replayer):
+        self._replayer = replayer
+
+    def handle_request(self, request):
+        response, wait = self._replayer.take(request)
+        if wait:
+            time.sleep(wait)
+        return response
+
+
+class AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, replayer):
+        self._replayer = replayer
+
+    async def handle_async_request(self, request):
+        response, wait = self._replayer.take(request)
+        if wait:
+            await asyncio.sleep(wait)
+        return response
+
+
+def record(client, recorder):
+    """Record the exchanges of a synchronous or asyncio tda client with
+    recorder. Returns client. Recording stops if the client replaces its session
+    to renew its refresh token"""
+    session = client.session
+    if isinstance(session, httpx.AsyncClient):
+        session._transport = AsyncRecordingTransport(session._transport, recorder)
+    else:
+        session._transport = RecordingTransport(session._transport, recorder)
+    return client
+
+
+def replay_client(path, speed=None, use_async=False):
+    """Returns tda client, asyncio if use_async is True, answered from the
+    cassette at path without network access or authentication"""
+    replayer = CassetteReplayer(load_cassette(path), speed)
+    if use_async:
+        session = httpx.AsyncClient(transport=AsyncReplayTransport(replayer))
+        return tda.client.AsyncClient("replay", session)
+    session = httpx.Client(transport=ReplayTransport(replayer))
+    return tda.client.Client("replay", session)
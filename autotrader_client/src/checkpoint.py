@@ -0,0 +1,93 @@
+"""SQLite-backed checkpoint that lets the client workers resume where they stopped"""
+
+import os
+import sqlite3
+import datetime
+import threading
+
+# worker names used as checkpoint keys
+LISTENER = "listener"
+MONITOR = "monitor"
+
+
+class SignalCheckpoint:
+    """Stores a position (high-water mark) for each worker and a bounded set of the
+    most recent signal ids it handled. Each signal id is stored with a position so
+    workers can tell where an unfinished signal sits in the signal sequence"""
+
+    def __init__(self, path, max_recent=1000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._max_recent = max_recent
+        # workers commit from both the event loop and executor threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS position "
+                "(worker TEXT PRIMARY KEY, position REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS recent "
+                "(worker TEXT NOT NULL, signal_id TEXT NOT NULL, "
+                "position REAL NOT NULL, PRIMARY KEY (worker, signal_id))"
+            )
+
+    def position(self, worker):
+        """Returns worker's last committed position as timezone-aware datetime or
+        None if the worker has never committed"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT position FROM position WHERE worker = ?", (worker,)
+            ).fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.fromtimestamp(row[0], tz=datetime.timezone.utc)
+
+    def recent(self, worker):
+        """Returns dictionary of worker's recent signal ids and their positions"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT signal_id, position FROM recent WHERE worker = ?", (worker,)
+            ).fetchall()
+        return {
+            signal_id: datetime.datetime.fromtimestamp(pos, tz=datetime.timezone.utc)
+            for signal_id, pos in rows
+        }
+
+    def is_recent(self, worker, signal_id):
+        """Returns True if signal_id is among worker's recent signal ids"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM recent WHERE worker = ? AND signal_id = ?",
+                (worker, signal_id),
+            ).fetchone()
+        return row is not None
+
+    def commit(self, worker, position, signal_ids=None):
+        """Record worker's position and the signal ids (dictionary of id to position
+        datetime) it has handled, keeping only the max_recent newest ids"""
+        signal_ids = signal_ids or {}
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO position VALUES (?, ?)",
+                (worker, position.timestamp()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO recent VALUES (?, ?, ?)",
+                [(worker, sid, pos.timestamp()) for sid, pos in signal_ids.items()],
+            )
+            if signal_ids:
+                self._conn.execute(
+                    "DELETE FROM recent WHERE worker = ? AND signal_id NOT IN "
+                    "(SELECT signal_id FROM recent WHERE worker = ? "
+                    "ORDER BY position DESC LIMIT ?)",
+                    (worker, worker, self._max_recent),
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -2,13 +2,31 @@
 ROOT_LOG = "at_client.log"
 LOG_DIR = "logs"
 
+# Event loop stall monitoring (seconds)
+LOOP_STALL_INTERVAL = 0.05
+LOOP_STALL_WARN = 0.25
+
+# Worker polling intervals (seconds)
+ACTIVE_POLL_INTERVAL = 0.15  # market open or recent activity
+CLOSED_POLL_INTERVAL = 120  # market closed
+ACTIVITY_WINDOW = 300  # time to keep polling quickly after activity
+
 # Google Cloud Platform
 GCP_CREDS_PATH = "config/google_service_account.json"
 BUCKET_NAMES_PATH = "config/storage_bucket.json"
 BUCKET_DICT_KEY = "storage_bucket"  # key to access bucket located at BUCKET_INFO_LOC
+SIGNAL_PREFIX = "signals/"  # live signals waiting to be processed
+ACK_PREFIX = "acks/"  # acknowledgment markers for processed signals
+DOWNLOAD_ATTEMPTS = 20  # failed downloads of a signal before it is given up on
 
 # Local directory configuration
 DEFAULT_ORDER_DIR = "signals"
+CHECKPOINT_PATH = "state/checkpoint.db"
+CHECKPOINT_MAX_RECENT = 1000  # number of recent signal ids kept per worker
+SEEN_WINDOW = 3600  # seconds a processed signal file name is remembered
+EXECUTION_WORKERS = 4  # maximum number of orders placed at once
+PREFETCH_WORKERS = 4  # signals whose lookups can run before validation, 0 disables
+ASYNC_EXECUTION = False  # place orders with the tda asyncio client on the event loop
 
 # Order settings
 ORD_SETTINGS_PATH = "config/order_guidelines.json"
@@ -23,6 +41,24 @@ TD_AUTH_PARAMS_PATH = "config/tda_auth_params.json"
 TD_DICT_KEY_API = "tda_api_key"
 TD_DICT_KEY_URI = "tda_auth_uri"
 TD_DICT_KEY_ACCT = "tda_acct"
+TDA_REQUEST_WORKERS = 8  # TDA requests one order may have in flight at once
+CANCEL_WORKERS = 4  # cancels sent at once when clearing existing STC orders
+CANCEL_DEADLINE = 2  # seconds to wait for a cancel before giving up on it
+# TDA allows 120 requests per minute. Rate plus burst stays within it
+TDA_RATE_LIMIT = 100  # sustained TDA requests per minute
+TDA_RATE_BURST = 20  # TDA requests that can be sent at once after a quiet spell
+TD_REFRESH_MARGIN = 300  # seconds before access token expiry to refresh it
+TD_KEEPALIVE_INTERVAL = 4  # under the HTTP client's 5 second idle connection expiry
+POSITION_RECONCILE_INTERVAL = 60  # seconds between position book reconciliations
+ORDER_BOOK_REFRESH_INTERVAL = 30  # seconds between order book refreshes
+CHAIN_CACHE_TTL = 900  # seconds a cached option chain is trusted
+CHAIN_CACHE_SIZE = 1000  # (ticker, expiration) chains kept in the cache
+CHAIN_WARM_TICKERS = ["SPY", "QQQ", "IWM", "AAPL", "TSLA"]  # chains cached early
+CHAIN_WARM_INTERVAL = 600  # seconds between warmings, under CHAIN_CACHE_TTL
+CHAIN_WARM_DAYS = 45  # days of expirations warmed
+QUOTE_MAX_AGE = 30  # seconds a streamed quote is used after its last update
+QUOTE_SUBSCRIBE_INTERVAL = 1  # seconds between quote subscription updates
+TDA_CASSETTE_PATH = None  # if set, TDA HTTP exchanges are recorded to this file
 
 # Selenium Drivers
 GECKODRIVER_PATH = "bins/geckodriver.exe"
@@ -15,3 +15,15 @@ def init_root_logger(log_filename, log_directory="logs", log_level=20):
         format="%(levelname)s: %(message)s: %(asctime)s%(msecs)d",
         datefmt="%m/%d/%Y %H:%M:%S",
     )
+
+
+def signal_partition(directory, dt=None):
+    """Returns path of the date partition of directory that holds signals written
+    at timezone-aware datetime dt. Defaults to the current time"""
+    import datetime
+    import os
+
+    if dt is None:
+        dt = datetime.datetime.now(datetime.timezone.utc)
+    day = dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d")
+    return os.path.join(directory, day)
@@ -0,0 +1,108 @@
+"""Long-lived TDA session and order settings shared by every order the client
+places"""
+
+import os
+import logging
+import threading
+import tda
+import src.ameritrade_orders as am_ord
+import src.position_book as pb
+import src.order_book as ob
+import src.option_chains as oc
+import src.quote_cache as qc
+import src.cassette as cas
+from src.client_settings import (
+    TD_TOKEN_PATH,
+    TD_AUTH_PARAMS_PATH,
+    ORD_SETTINGS_PATH,
+    CHAIN_CACHE_TTL,
+    CHAIN_CACHE_SIZE,
+    QUOTE_MAX_AGE,
+    TDA_CASSETTE_PATH,
+)
+
+
+class ExecutionContext:
+    """Holds the authenticated TDA client, the account number, the validated
+    order settings, the position and order books and the option chain and quote
+    caches. The client is created once since more than one client causes
+    authentication issues. If use_async is True an asyncio client sharing the
+    token file is also created for placing orders on the event loop. If a
+    paper-trading broker is provided orders go to it instead of TDA, no TDA
+    account is needed and use_async is ignored. If cassette_path is set the TDA
+    clients' HTTP exchanges are recorded to it for replay. Order settings are
+    reloaded when their file changes"""
+
+    def __init__(
+        self,
+        token_path=TD_TOKEN_PATH,
+        auth_params_path=TD_AUTH_PARAMS_PATH,
+        settings_path=ORD_SETTINGS_PATH,
+        use_async=False,
+        broker=None,
+        cassette_path=TDA_CASSETTE_PATH,
+    ):
+        self.broker = broker
+        self.recorder = None
+        if broker is None:
+            td_acct = am_ord.load_tda_account(auth_params_path)
+            self.acct_num = td_acct["acct_num"]
+            client = am_ord.authenticate_tda_account(
+                token_path, td_acct["api_key"], td_acct["uri"]
+            )
+            if cassette_path is not None:
+                self.recorder = cas.CassetteRecorder(cassette_path)
+                cas.record(client, self.recorder)
+        else:
+            self.acct_num = broker.acct_num
+            client = broker
+        # requests from orders and background upkeep share one rate limit
+        self.client = am_ord.limit_client(client)
+        self.async_client = None
+        if use_async and broker is None:
+            # the token file exists once the synchronous client has authenticated
+            async_client = tda.auth.client_from_token_file(
+                token_path, td_acct["api_key"], asyncio=True
+            )
+            if self.recorder is not None:
+                cas.record(async_client, self.recorder)
+            self.async_client = am_ord.limit_client(async_client, use_async=True)
+        # seeded by a PositionReconciler and an OrderBookRefresher
+        self.positions = pb.PositionBook()
+        self.orders = ob.OrderBook()
+        self.chains = oc.OptionChainCache(CHAIN_CACHE_TTL, CHAIN_CACHE_SIZE)
+        # fed by a QuoteStreamer
+        self.quotes = qc.QuoteCache(QUOTE_MAX_AGE)
+        self._settings_path = settings_path
+        # orders read settings from several execution threads
+        self._lock = threading.Lock()
+        self._settings_mtime = os.stat(settings_path).st_mtime_ns
+        # invalid settings at startup raise
+        self._usr_set = am_ord.load_user_settings(settings_path)
+
+    @property
+    def usr_set(self):
+        """Returns validated order settings, reloading them if the settings file
+        has changed"""
+        with self._lock:
+            try:
+                mtime = os.stat(self._settings_path).st_mtime_ns
+            except OSError as err:
+                logging.error(f"Unable to check order settings, keeping last: {err}")
+                return self._usr_set
+            if mtime != self._settings_mtime:
+                self._reload_settings(mtime)
+            return self._usr_set
+
+    def _reload_settings(self, mtime):
+        """Replace settings with the file's. Invalid settings are logged and the
+        last valid settings are kept"""
+        try:
+            usr_set = am_ord.load_user_settings(self._settings_path)
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logging.error(f"Invalid order settings, keeping last: {err}")
+        else:
+            self._usr_set = usr_set
+            logging.info(f"Reloaded order settings: {usr_set}")
+        # a broken file is not re-read until it changes again
+        self._settings_mtime = mtime
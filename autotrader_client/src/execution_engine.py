@@ -0,0 +1,148 @@
+"""Worker pool that places orders concurrently while keeping orders for the same
+option symbol in the order they were submitted"""
+
+import asyncio
+import logging
+import itertools
+import collections
+import concurrent.futures
+
+# priority classes, lower runs first. Exits are latency critical and run
+# before new entries
+EXIT = 0
+ENTRY = 1
+PRIORITY_NAMES = {EXIT: "exit", ENTRY: "entry"}
+
+WorkItem = collections.namedtuple(
+    "WorkItem", ["key", "func", "args", "on_done", "submitted"]
+)
+
+
+class WaitStats:
+    """Queue wait statistics for one priority class"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, wait):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+
+class ExecutionEngine:
+    """Runs submitted work in a thread pool, or on the event loop for coroutine
+    functions, with at most max_workers items running at once. Ready work runs by
+    priority class and then in submission order. Items with the same key run one
+    at a time in submission order whatever their priority, so a STC never
+    overtakes the BTO it closes. run() must be running
+    for submitted work to execute"""
+
+    def __init__(self, max_workers=4):
+        self._max_workers = max_workers
+        # holds (priority, sequence, item) for the oldest pending item of each key
+        self._ready = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._pending = {}  # key: deque of (priority, sequence, item) not yet run
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="execution"
+        )
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.waits = {priority: WaitStats() for priority in PRIORITY_NAMES}
+
+    @property
+    def queued(self):
+        """Returns number of submitted items that have not started"""
+        return self._unfinished - self.in_flight
+
+    @property
+    def mean_wait(self):
+        """Returns mean seconds items of all classes waited before running"""
+        count = sum(stats.count for stats in self.waits.values())
+        if count == 0:
+            return 0.0
+        return sum(stats.total for stats in self.waits.values()) / count
+
+    @property
+    def max_wait(self):
+        return max(stats.max for stats in self.waits.values())
+
+    def submit(self, key, func, *args, priority=ENTRY, on_done=None):
+        """Queue func(*args) to run in the thread pool, or to be awaited if func is
+        a coroutine function. on_done, if provided, is called on the event loop
+        once func returns or raises"""
+        loop = asyncio.get_running_loop()
+        item = WorkItem(key, func, args, on_done, loop.time())
+        entry = (priority, next(self._sequence), item)
+        self._unfinished += 1
+        self._finished.clear()
+        if key in self._pending:
+            # runs after the earlier work for its key
+            self._pending[key].append(entry)
+        else:
+            self._pending[key] = collections.deque()
+            self._ready.put_nowait(entry)
+
+    def is_busy(self, key):
+        """Returns True if work for key is queued or running"""
+        return key in self._pending
+
+    async def join(self):
+        """Wait until all submitted work has finished"""
+        await self._finished.wait()
+
+    async def run(self):
+        workers = [self._worker() for _ in range(self._max_workers)]
+        await asyncio.gather(*workers)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, item = await self._ready.get()
+            wait = loop.time() - item.submitted
+            self.waits[priority].record(wait)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                if asyncio.iscoroutinefunction(item.func):
+                    await item.func(*item.args)
+                else:
+                    await loop.run_in_executor(self._executor, item.func, *item.args)
+            except Exception:
+                self.failed += 1
+                logging.exception(f"Order for {item.key} failed")
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+                self._release(item.key)
+            logging.info(
+                f"Executed {PRIORITY_NAMES[priority]} order for {item.key} after "
+                f"waiting {wait:.3f} seconds, {self.in_flight} in flight, "
+                f"{self.queued} queued"
+            )
+            if item.on_done is not None:
+                item.on_done()
+
+    def _release(self, key):
+        """Make the next item for key ready, or forget key if it has none"""
+        if self._pending[key]:
+            self._ready.put_nowait(self._pending[key].popleft())
+        else:
+            del self._pending[key]
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._finished.set()
@@ -0,0 +1,40 @@
+""" Worker class that measures how long the asyncio event loop is stalled by
+blocking work running on the loop"""
+
+import asyncio
+import logging
+
+
+class LoopStallMonitor:
+    """Repeatedly sleeps for a short interval and records how late the loop
+    wakes up. Any lateness is time the loop spent unable to run other workers"""
+
+    def __init__(self, interval=0.05, warn_threshold=0.25):
+        self._interval = interval
+        self._warn_threshold = warn_threshold
+        self.samples = 0
+        self.max_stall = 0.0
+        self.total_stall = 0.0
+
+    def _record(self, stall):
+        """Update stall statistics and log stalls above the warning threshold"""
+        self.samples += 1
+        self.total_stall += stall
+        if stall > self.max_stall:
+            self.max_stall = stall
+        if stall >= self._warn_threshold:
+            logging.warning(f"Event loop stalled for {stall:.3f} seconds")
+
+    @property
+    def mean_stall(self):
+        """Returns mean stall in seconds over all samples"""
+        if self.samples == 0:
+            return 0.0
+        return self.total_stall / self.samples
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self._interval)
+            self._record(max(loop.time() - start - self._interval, 0.0))
@@ -0,0 +1,161 @@
+"""Cache of listed option strikes so orders for contracts that do not exist are
+rejected, or corrected, before they reach TDA"""
+
+import copy
+import time
+import asyncio
+import logging
+import datetime
+import threading
+import collections
+import concurrent.futures
+import src.ameritrade_orders as am_ord
+import src.poll_scheduler as ps
+
+CONTRACT_TYPES = {"C": "callExpDateMap", "P": "putExpDateMap"}
+
+
+def parse_chain(chain):
+    """Returns {expiration date: {"C": strikes, "P": strikes}} from a TDA option
+    chain. Strikes are frozensets of floats"""
+    expirations = {}
+    for contract_type, map_key in CONTRACT_TYPES.items():
+        for exp_key, strikes in chain.get(map_key, {}).items():
+            # keys look like "2021-03-03:5", the date and days to expiration
+            date = datetime.date.fromisoformat(exp_key.split(":")[0])
+            listed = expirations.setdefault(date, {"C": frozenset(), "P": frozenset()})
+            listed[contract_type] = frozenset(float(strike) for strike in strikes)
+    return expirations
+
+
+class OptionChainCache:
+    """Listed strikes keyed by (ticker, expiration date). Entries expire ttl
+    seconds after they were fetched and the least recently used entry is evicted
+    beyond max_size entries. A contract the cache does not list is fetched again
+    before it is rejected, so a newly listed strike is never rejected from a stale
+    entry"""
+
+    def __init__(self, ttl=900, max_size=1000):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()  # key: (fetched_at, strikes)
+        self._lock = threading.Lock()  # orders run on several execution threads
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, ticker, date):
+        """Returns cached strikes by contract type or None if missing or expired"""
+        key = (ticker, date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self._ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, ticker, date, strikes):
+        with self._lock:
+            self._entries[(ticker, date)] = (time.monotonic(), strikes)
+            self._entries.move_to_end((ticker, date))
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def fetch(self, client, ticker, date):
+        """Fetch and cache strikes expiring on date. Returns strikes by contract
+        type, empty if nothing expires on date"""
+        chain = am_ord.get_option_chain(client, ticker, date, date)
+        strikes = parse_chain(chain).get(date, {"C": frozenset(), "P": frozenset()})
+        self.put(ticker, date, strikes)
+        return strikes
+
+    def warm(self, client, ticker, from_date, to_date):
+        """Fetch and cache every expiration of ticker between the dates with one
+        request. Returns number of expirations cached"""
+        chain = am_ord.get_option_chain(client, ticker, from_date, to_date)
+        expirations = parse_chain(chain)
+        for date, strikes in expirations.items():
+            self.put(ticker, date, strikes)
+        return len(expirations)
+
+    def needs_fetch(self, ord_params):
+        """Returns True if checking ord_params' contract needs a TDA request"""
+        return self.get(ord_params["ticker"], ord_params["expiration"].date()) is None
+
+    def check_contract(self, client, ord_params):
+        """Returns ord_params if its contract is listed, a copy expiring on
+        Thursday if the contract expires on a market holiday Friday and is listed
+        on the Thursday, or None if it is not listed. ord_params are returned
+        unchanged if the chain cannot be fetched"""
+        try:
+            return self._check_contract(client, ord_params)
+        except Exception as err:
+            logging.warning(f"Unable to check option chain, placing anyway: {err!r}")
+            return ord_params
+
+    def _check_contract(self, client, ord_params):
+        ticker = ord_params["ticker"]
+        expiration = ord_params["expiration"].date()
+        if self._is_listed(client, ticker, expiration, ord_params):
+            return ord_params
+        if expiration.weekday() == 4 and not ps.is_trading_day(expiration):
+            # options expiring on a holiday Friday expire on the Thursday
+            thursday = expiration - datetime.timedelta(days=1)
+            if self._is_listed(client, ticker, thursday, ord_params):
+                corrected = copy.deepcopy(ord_params)
+                corrected["expiration"] = datetime.datetime.combine(
+                    thursday, datetime.time()
+                )
+                logging.info(f"{ord_params} expiration moved to {thursday}")
+                return corrected
+        logging.warning(f"{ord_params} is not a listed contract, order rejected")
+        return None
+
+    def _is_listed(self, client, ticker, date, ord_params):
+        contract_type = ord_params["contract_type"]
+        strike = float(ord_params["strike_price"])
+        cached = self.get(ticker, date)
+        if cached is not None and strike in cached[contract_type]:
+            return True
+        # a cached chain may predate the listing
+        return strike in self.fetch(client, ticker, date)[contract_type]
+
+
+class ChainWarmer:
+    """Caches the option chains of frequently traded tickers in an
+    ExecutionContext's chain cache before the open, and keeps them cached while
+    the market is open by refreshing them every interval seconds"""
+
+    def __init__(self, context, tickers, interval=600, days=45):
+        self._context = context
+        self._tickers = tickers
+        self._interval = interval
+        self._days = datetime.timedelta(days=days)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="chain_warmer"
+        )
+        self.last_warm = None
+
+    def _warm(self):
+        """Cache chains expiring within days of today"""
+        today = datetime.date.today()
+        for ticker in self._tickers:
+            try:
+                self._context.chains.warm(
+                    self._context.client, ticker, today, today + self._days
+                )
+            except Exception:
+                logging.exception(f"Unable to warm option chain for {ticker}")
+        self.last_warm = time.time()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # the extended session starts hours before the open
+            if ps.market_session() != "closed":
+                await loop.run_in_executor(self._executor, self._warm)
+            await asyncio.sleep(self._interval)
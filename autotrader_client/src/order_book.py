@@ -0,0 +1,182 @@
+"""In-memory index of the account's live orders so STC orders can find working
+stop orders without querying every recent order"""
+
+import time
+import asyncio
+import logging
+import datetime
+import threading
+import concurrent.futures
+import src.ameritrade_orders as am_ord
+
+# statuses of orders that can still execute
+LIVE_STATUSES = {
+    "AWAITING_PARENT_ORDER",
+    "AWAITING_CONDITION",
+    "AWAITING_MANUAL_REVIEW",
+    "ACCEPTED",
+    "AWAITING_UR_OUT",
+    "PENDING_ACTIVATION",
+    "QUEUED",
+    "WORKING",
+}
+# statuses an existing STC order is cancelled in before a new STC is placed
+STC_STATUSES = ("WORKING", "QUEUED", "ACCEPTED")
+# TDA only returns orders entered within the last 60 days
+MAX_LOOKBACK = datetime.timedelta(days=59)
+
+
+def parse_entered_time(order):
+    """Returns order's entered time as timezone-aware datetime or None"""
+    entered = order.get("enteredTime")
+    if entered is None:
+        return None
+    return datetime.datetime.strptime(entered, "%Y-%m-%dT%H:%M:%S%z")
+
+
+class OrderBook:
+    """Index of live single-leg orders keyed by (symbol, status). Kept current
+    from the client's own placements and cancels and from refreshes of the
+    account's orders. A symbol is unknown until the book has been refreshed and
+    while it has an order whose id the client could not see, such as the stop
+    of a BTO order"""
+
+    def __init__(self):
+        self._index = {}  # (symbol, status): {order id: instruction}
+        self._orders = {}  # order id: (symbol, status, entered datetime)
+        self._pending = set()  # symbols with orders not yet indexed
+        self._touched = {}  # order id or symbol: time of last local update
+        self._lock = threading.Lock()  # orders run on several execution threads
+        self.seeded = False
+        self.last_refresh = None
+
+    def is_known(self, symbol):
+        """Returns True if the book can answer for symbol without a query"""
+        with self._lock:
+            return self.seeded and symbol not in self._pending
+
+    def stc_orders(self, symbol):
+        """Returns ids of symbol's in-effect STC orders"""
+        order_ids = []
+        with self._lock:
+            for status in STC_STATUSES:
+                orders = self._index.get((symbol, status), {})
+                for order_id, instruction in orders.items():
+                    if instruction == "SELL_TO_CLOSE":
+                        order_ids.append(order_id)
+        return order_ids
+
+    def oldest_entered(self):
+        """Returns entered time of the oldest live order or None"""
+        with self._lock:
+            entered = [e for _, _, e in self._orders.values() if e is not None]
+        return min(entered, default=None)
+
+    def record_placement(self, order_id, symbol, instruction):
+        """Index an order the client placed. Without an order id the symbol is
+        unknown until the next refresh"""
+        with self._lock:
+            now = time.time()
+            self._touched[symbol] = now
+            if order_id is None:
+                self._pending.add(symbol)
+                return
+            order_id = str(order_id)
+            entered = datetime.datetime.now(datetime.timezone.utc)
+            self._store(order_id, symbol, "ACCEPTED", instruction, entered)
+            self._touched[order_id] = now
+
+    def record_cancel(self, order_id):
+        """Remove an order the client cancelled"""
+        with self._lock:
+            order_id = str(order_id)
+            self._remove(order_id)
+            self._touched[order_id] = time.time()
+
+    def expect_orders(self, symbol):
+        """Mark symbol unknown until the next refresh"""
+        with self._lock:
+            self._pending.add(symbol)
+            self._touched[symbol] = time.time()
+
+    def update(self, orders, fetched_at):
+        """Index orders and their child orders from an order query. Orders and
+        symbols updated locally after fetched_at, when the query started, are
+        left alone"""
+        with self._lock:
+            for order in orders:
+                self._update_order(order, parse_entered_time(order), fetched_at)
+            self._pending = {
+                s for s in self._pending if self._touched.get(s, 0) > fetched_at
+            }
+            self._touched = {k: t for k, t in self._touched.items() if t > fetched_at}
+            self.seeded = True
+            self.last_refresh = fetched_at
+
+    def _update_order(self, order, parent_entered, fetched_at):
+        entered = parse_entered_time(order) or parent_entered
+        legs = order.get("orderLegCollection", [])
+        order_id = str(order["orderId"])
+        # multi-leg orders are not handled by this library
+        if len(legs) == 1 and self._touched.get(order_id, 0) <= fetched_at:
+            self._remove(order_id)
+            if order["status"] in LIVE_STATUSES:
+                symbol = legs[0]["instrument"]["symbol"]
+                instruction = legs[0]["instruction"]
+                self._store(order_id, symbol, order["status"], instruction, entered)
+        for child in order.get("childOrderStrategies", []):
+            self._update_order(child, entered, fetched_at)
+
+    def _store(self, order_id, symbol, status, instruction, entered):
+        self._index.setdefault((symbol, status), {})[order_id] = instruction
+        self._orders[order_id] = (symbol, status, entered)
+
+    def _remove(self, order_id):
+        if order_id not in self._orders:
+            return
+        symbol, status, _ = self._orders.pop(order_id)
+        key = (symbol, status)
+        del self._index[key][order_id]
+        if not self._index[key]:
+            del self._index[key]
+
+
+class OrderBookRefresher:
+    """Seeds an ExecutionContext's order book with all the orders TDA returns
+    and then refreshes it every interval seconds. Refreshes only query orders
+    entered since the oldest live order or the last refresh"""
+
+    def __init__(self, context, interval=30, overlap=60):
+        self._context = context
+        self._interval = interval
+        self._overlap = datetime.timedelta(seconds=overlap)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="order_book_refresher"
+        )
+
+    def _query_start(self, now):
+        """Returns earliest entered time the next refresh needs to query"""
+        book = self._context.orders
+        start = now - MAX_LOOKBACK
+        if book.last_refresh is not None:
+            last = datetime.datetime.fromtimestamp(
+                book.last_refresh, tz=datetime.timezone.utc
+            )
+            oldest = book.oldest_entered()
+            start = max(start, min(last, oldest or last) - self._overlap)
+        return start
+
+    def _refresh(self):
+        fetched_at = time.time()
+        now = datetime.datetime.fromtimestamp(fetched_at, tz=datetime.timezone.utc)
+        orders = am_ord.query_orders(self._context.client, self._query_start(now))
+        self._context.orders.update(orders, fetched_at)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(self._executor, self._refresh)
+            except Exception:
+                logging.exception("Order book refresh failed")
+            await asyncio.sleep(self._interval)
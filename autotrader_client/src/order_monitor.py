@@ -4,50 +4,304 @@ are validated and if valid, generate order"""
 
 import os
 import json
+import time
 import asyncio
+import logging
 import datetime
+import concurrent.futures
+import src.client_utils as utils
 import src.validate_params as vp
 import src.ameritrade_orders as am_ord
+import src.async_orders as async_ord
+import src.checkpoint as cp
+import src.seen_cache as sc
+import src.dir_watcher as dw
+import src.execution_engine as ee
+import src.prefetch as pf
 
 
 class OrderMonitor:
     """Monitors local directory for updates
     and generates an order when an update is received"""
 
-    def __init__(self, order_directory, sleep_time=1, order_ext=".json"):
+    def __init__(
+        self,
+        order_directory,
+        sleep_time=1,
+        order_ext=".json",
+        signal_queue=None,
+        scheduler=None,
+        checkpoint=None,
+        on_processed=None,
+        watch=True,
+        seen_window=3600,
+        max_workers=4,
+        context=None,
+        prefetch_workers=4,
+    ):
         self._order_dir = order_directory
         self._sleep_time = sleep_time
         self._order_ext = order_ext
-        self._directory_content = set()
+        # files seen within seen_window seconds of the last check; older files
+        # are rejected by the last check time, so they need not be remembered
+        self._directory_content = sc.TimeWindowSet(seen_window)
+        self._seen_window = seen_window
         self._last_check = datetime.datetime.now(datetime.timezone.utc)
+        # signal files are read off the event loop
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="order_monitor"
+        )
+        # orders make blocking TDA calls, so they are placed by the engine's pool
+        self.engine = ee.ExecutionEngine(max_workers)
+        # if provided, orders share its TDA client and settings
+        self._context = context
+        # lookups start before validation when a context is provided
+        self._prefetcher = None
+        if context is not None and prefetch_workers > 0:
+            self._prefetcher = pf.Prefetcher(context, prefetch_workers)
+        # if provided, signals are consumed from the queue instead of polling
+        self._signal_queue = signal_queue
+        # if provided, poll frequency follows market hours instead of sleep_time
+        self._scheduler = scheduler
+        # without a queue, inotify is used where available instead of polling
+        self._watch = watch
+        # if provided, called with each file name once its order is processed
+        self._on_processed = on_processed
+        # if provided, monitoring resumes from where the last run stopped
+        self._checkpoint = checkpoint
+        if checkpoint is not None:
+            self._resume()
+
+    def _resume(self):
+        """Restore last check time and seen files from the checkpoint"""
+        position = self._checkpoint.position(cp.MONITOR)
+        if position is not None:
+            self._last_check = position
+        self._directory_content.update(self._checkpoint.recent(cp.MONITOR))
+
+    def _commit_checkpoint(self, position, filenames):
+        """Record position and files as processed. Committed before orders are
+        placed so a restart never places the same order twice"""
+        if self._checkpoint is not None:
+            processed = {f: position for f in filenames}
+            self._checkpoint.commit(cp.MONITOR, position, processed)
+
+    def _partitions(self, now):
+        """Returns date partitions that can hold files written since the last
+        check: today's and, after the date changes, the last check's"""
+        partitions = [utils.signal_partition(self._order_dir, self._last_check)]
+        today = utils.signal_partition(self._order_dir, now)
+        if today not in partitions:
+            partitions.append(today)
+        return partitions
 
     def _check_new_files(self):
-        """Check order directory for new files"""
+        """Check order directory partitions for new files. Returns paths relative
+        to the order directory, oldest first"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        last_check = self._last_check.timestamp()
         new_orders = []
-        files = [f for f in os.listdir(self._order_dir)]
-        for f in files:
-            if self._get_creation_time(self._order_dir, f) >= self._last_check:
-                if self._is_new_order_file(f):
-                    new_orders.append(f)
-                self._directory_content.add(f)
-        self._last_check = datetime.datetime.now(datetime.timezone.utc)
-        return new_orders
+        for partition in self._partitions(now):
+            try:
+                entries = os.scandir(partition)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    # seen files and other extensions are skipped without a stat
+                    if entry.name in self._directory_content:
+                        continue
+                    if os.path.splitext(entry.name)[-1] != self._order_ext:
+                        continue
+                    if not entry.is_file():
+                        continue
+                    timestamp = self._get_entry_time(entry)
+                    if timestamp >= last_check:
+                        path = os.path.join(os.path.basename(partition), entry.name)
+                        new_orders.append((timestamp, path))
+                        self._directory_content.add(entry.name, timestamp)
+        self._last_check = now
+        self._directory_content.prune(last_check)
+        return [path for timestamp, path in sorted(new_orders)]
 
     def _is_new_order_file(self, filename):
-        """Return True if file is a new file with valid file extension, else False"""
+        """Return True if file is a new file with valid file extension, else False.
+        Files modified before the seen window were processed when written, so a
+        later event on one whose name has aged out does not place it again"""
         new_file = False
         if os.path.isfile(os.path.join(self._order_dir, filename)):
-            if filename not in self._directory_content:
+            if not self._is_processed(os.path.basename(filename)):
                 if os.path.splitext(filename)[-1] == self._order_ext:
-                    new_file = True
+                    modified = self._get_creation_time(self._order_dir, filename)
+                    window_start = time.time() - self._seen_window
+                    new_file = modified.timestamp() >= window_start
         return new_file
 
+    def _is_processed(self, filename):
+        """Returns True if file was seen within the seen window or, if a checkpoint
+        is provided, is among its recently processed files"""
+        if filename in self._directory_content:
+            return True
+        return self._checkpoint is not None and self._checkpoint.is_recent(
+            cp.MONITOR, filename
+        )
+
     async def run(self):
+        if self._signal_queue is not None:
+            source = self._consume_queue()
+        elif self._watch and dw.inotify_available():
+            source = self._watch_directory()
+        else:
+            source = self._poll_directory()
+        await asyncio.gather(self.engine.run(), source)
+
+    async def _consume_queue(self):
+        """Submit signals as they are put on the signal queue. A signal is marked
+        done on the queue once its order has been placed"""
+        while True:
+            filename, created, order_params = await self._signal_queue.get()
+            self._directory_content.prune()
+            if self._is_processed(filename):
+                self._signal_queue.task_done()
+                continue
+            self._directory_content.add(filename)
+            self._commit_checkpoint(created, [filename])
+
+            def on_done(filename=filename):
+                self._processed(filename)
+                self._signal_queue.task_done()
+
+            self._submit_order(order_params, on_done)
+
+    async def _poll_directory(self):
+        """Process signal files as they appear in the order directory"""
         while True:
             print("monitoring")
-            new_files = self._check_new_files()
-            for f in new_files:
-                self._process_order(self._order_dir, f)
+            await self._process_new_files(self._check_new_files())
+            await self._sleep()
+
+    async def _watch_directory(self):
+        """Process signal files as soon as inotify reports them written or moved
+        into today's partition of the order directory. Falls back to polling if
+        the partition cannot be watched"""
+        while True:
+            partition = utils.signal_partition(self._order_dir)
+            os.makedirs(partition, exist_ok=True)
+            try:
+                watcher = dw.InotifyWatcher(partition)
+            except OSError as err:
+                logging.warning(f"Unable to watch {partition}, polling: {err}")
+                await self._poll_directory()
+                return
+            try:
+                await self._watch_partition(watcher, partition)
+            finally:
+                watcher.close()
+
+    async def _watch_partition(self, watcher, partition):
+        """Process files reported by watcher until the partition date changes"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(watcher.fileno(), ready.set)
+        try:
+            # files written before the watch started are found by one scan
+            await self._process_new_files(self._check_new_files())
+            while utils.signal_partition(self._order_dir) == partition:
+                try:
+                    await asyncio.wait_for(ready.wait(), self._until_midnight())
+                except asyncio.TimeoutError:
+                    continue
+                ready.clear()
+                names = watcher.read_events()
+                self._last_check = datetime.datetime.now(datetime.timezone.utc)
+                new_files = []
+                for f in dict.fromkeys(names):
+                    path = os.path.join(os.path.basename(partition), f)
+                    if self._is_new_order_file(path):
+                        new_files.append(path)
+                        self._directory_content.add(f)
+                self._directory_content.prune()
+                await self._process_new_files(new_files)
+        finally:
+            loop.remove_reader(watcher.fileno())
+
+    @staticmethod
+    def _until_midnight():
+        """Returns seconds until the next UTC date partition starts"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        midnight = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1),
+            datetime.time(),
+            tzinfo=datetime.timezone.utc,
+        )
+        return (midnight - now).total_seconds() + 0.001
+
+    async def _process_new_files(self, new_files):
+        """Commit new order files and submit their orders. Files are read before
+        any is submitted so the engine can order the batch by priority"""
+        if not new_files:
+            return
+        if self._scheduler is not None:
+            self._scheduler.notify_activity()
+        names = [os.path.basename(f) for f in new_files]
+        self._commit_checkpoint(self._last_check, names)
+        loop = asyncio.get_running_loop()
+        batch = []
+        for f in new_files:
+            order_params = await loop.run_in_executor(
+                self._executor, self._read_order, self._order_dir, f
+            )
+            batch.append(order_params)
+        for order_params, name in zip(batch, names):
+            self._submit_order(order_params, lambda name=name: self._processed(name))
+
+    def _submit_order(self, order_params, on_done):
+        """Submit a valid order to the execution engine keyed by its option symbol.
+        Exits run before entries. on_done is called once the order is placed, or at
+        once if it is invalid"""
+        prefetch = None
+        if self._prefetcher is not None:
+            prefetch = self._prefetcher.start(order_params)
+        valid_params = self._prepare_order(order_params)
+        if valid_params is None:
+            if prefetch is not None:
+                self._prefetcher.discard(prefetch)
+            on_done()
+            return
+        key = am_ord.build_option_symbol(valid_params)
+        if prefetch is not None and self.engine.is_busy(key):
+            # an earlier order for the contract may change what was fetched
+            self._prefetcher.discard(prefetch)
+            prefetch = None
+        place_order = self._place_order
+        if self._context is not None and self._context.async_client is not None:
+            place_order = self._place_order_async
+        self.engine.submit(
+            key,
+            place_order,
+            valid_params,
+            self._context,
+            prefetch,
+            priority=self._order_priority(valid_params),
+            on_done=on_done,
+        )
+
+    @staticmethod
+    def _order_priority(order_params):
+        """Returns execution priority class. Anything that is not a new entry
+        reduces or protects a position and is an exit"""
+        if order_params.get("instruction") == "BTO":
+            return ee.ENTRY
+        return ee.EXIT
+
+    def _processed(self, filename):
+        if self._on_processed is not None:
+            self._on_processed(filename)
+
+    async def _sleep(self):
+        if self._scheduler is not None:
+            await self._scheduler.sleep()
+        else:
             await asyncio.sleep(self._sleep_time)
 
     @staticmethod
@@ -67,11 +321,41 @@ class OrderMonitor:
             raise OSError("OS does not appear to be Windows or UNIX-like")
 
     @staticmethod
-    def _process_order(directory, filename):
-        """Validate and attempt to place order"""
-        with open(os.path.join(directory, filename)) as f:
-            order_params = json.load(f)
-        is_valid = vp.validate_params(order_params)
-        if is_valid:
-            valid_params = vp.reformat_params(order_params)
-            am_ord.initialize_order(valid_params)
+    def _get_entry_time(entry):
+        """Returns timestamp of os.DirEntry using the same times as
+        _get_creation_time. The entry caches its stat result"""
+        if os.name == "posix":
+            return entry.stat().st_mtime
+        elif os.name == "nt":
+            return entry.stat().st_ctime
+        else:
+            raise OSError("OS does not appear to be Windows or UNIX-like")
+
+    @staticmethod
+    def _read_order(directory, filename):
+        """Returns order parameters from signal file or None if it is not valid JSON"""
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning(f"{filename} is not valid JSON")
+            return None
+
+    @staticmethod
+    def _prepare_order(order_params):
+        """Returns reformatted order parameters or None if they fail validation"""
+        if order_params is None or not vp.validate_params(order_params):
+            return None
+        return vp.reformat_params(order_params)
+
+    @staticmethod
+    def _place_order(valid_params, context=None, prefetch=None):
+        """Attempt to place order. Runs on an execution engine thread"""
+        am_ord.initialize_order(valid_params, context, pf.result(prefetch))
+
+    @staticmethod
+    async def _place_order_async(valid_params, context, prefetch=None):
+        """Attempt to place order with the context's asyncio client. Runs on the
+        event loop"""
+        prefetched = await pf.result_async(prefetch)
+        await async_ord.initialize_order(valid_params, context, prefetched)
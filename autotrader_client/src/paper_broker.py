@@ -0,0 +1,465 @@
+"""Paper-trading stand-in for a TDA client. Orders are filled against a local
+price feed instead of a brokerage account, so the client can be load tested and
+soak tested offline"""
+
+import re
+import enum
+import json
+import time
+import random
+import logging
+import datetime
+import itertools
+import threading
+import httpx
+import src.quote_cache as qc
+
+ORDER_URL = "https://api.tdameritrade.com/v1/accounts/{}/orders/{}"
+# statuses of orders the broker may still fill or cancel
+OPEN_STATUSES = ("WORKING", "AWAITING_PARENT_ORDER")
+ORDER_TYPES = ("LIMIT", "MARKET", "STOP")
+INSTRUCTIONS = ("BUY_TO_OPEN", "SELL_TO_CLOSE")
+# option symbols look like SPY_030321P380, ticker_MMDDYY, contract type, strike
+OPTION_SYMBOL = re.compile(r"^(\w+?)_(\d{6})([CP])([\d.]+)$")
+CONTRACT_MAPS = {"C": "callExpDateMap", "P": "putExpDateMap"}
+
+
+def _values(items):
+    """Returns set of the string values of an enum, a string or an iterable of
+    either"""
+    if items is None:
+        return set()
+    if isinstance(items, (str, enum.Enum)):
+        items = [items]
+    return {getattr(item, "value", item) for item in items}
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _timestamp(dt):
+    """Returns dt formatted like TDA order times"""
+    return dt.strftime("%Y-%m-%dT%H:%M:%S%z")
+
+
+class SimulatedResponse:
+    """Answers a request with the attributes of the httpx responses a tda client
+    returns"""
+
+    def __init__(self, status_code, data=None, location=None):
+        self.status_code = status_code
+        self.is_error = status_code >= 400
+        self.headers = {} if location is None else {"Location": location}
+        self.content = b"" if data is None else json.dumps(data).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.is_error:
+            raise httpx.HTTPStatusError(
+                f"Simulated response {self.status_code}: {self.content!r}",
+                request=None,
+                response=self,
+            )
+
+    def __repr__(self):
+        return f"<Response [{self.status_code}]>"
+
+
+class SimulatedSession:
+    """OAuth session whose access token is renewed without a request"""
+
+    def __init__(self, lifetime=1800):
+        self._lifetime = lifetime
+        self.token = {}
+        self.refresh_token()
+
+    def refresh_token(self, url=None, refresh_token=None):
+        now = time.time()
+        self.token = {
+            "access_token": "paper",
+            "refresh_token": "paper",
+            "expires_in": self._lifetime,
+            "expires_at": now + self._lifetime,
+        }
+        return self.token
+
+
+class SimulatedBroker:
+    """Paper-trading account behind the methods of tda.client.Client the client
+    uses. Single-leg option orders and first-triggers-second (OTA) orders are
+    accepted. Prices come from set_price(): buy orders fill at the ask, sell
+    orders at the bid, limit orders once the quote reaches their limit and stop
+    orders once the bid falls to their stop price. Market and stop fills are
+    slippage worse than the quote. A fill-or-kill order that cannot fill when it
+    is placed is cancelled, and an OTA order's child starts working when its
+    parent fills. Each request first sleeps a random number of seconds between
+    the bounds of latency. Sells of more than the position not already being
+    sold and buys costing more than the cash balance are rejected like TDA
+    rejects them"""
+
+    def __init__(
+        self,
+        acct_num="123456789",
+        cash=100000.0,
+        latency=(0, 0),
+        slippage=0.0,
+        seed=None,
+    ):
+        self.acct_num = acct_num
+        self.cash = cash
+        self.session = SimulatedSession()
+        self._latency = latency
+        self._slippage = slippage
+        self._rng = random.Random(seed)
+        self._ids = itertools.count(1001)
+        self._quotes = {}  # symbol: Quote
+        self._positions = {}  # symbol: [quantity, average price]
+        self._orders = {}  # order id: order, child orders included
+        # (entered datetime, order) of placed orders, children nested in parents
+        self._placed = []
+        # quote stream of the last stream_factory call, None before the first
+        self._stream = None
+        # orders are placed from several execution threads
+        self._lock = threading.RLock()
+        self.requests = 0
+        self.fills = 0
+        self.rejections = 0
+
+    # price feed
+
+    def set_price(self, symbol, bid=None, ask=None, last=None):
+        """Update symbol's quote, fill the working orders it reaches and push it to
+        the quote stream. The stream is fed from the calling thread, which must run
+        its event loop"""
+        with self._lock:
+            self._quotes[symbol] = qc.Quote(bid, ask, last, time.monotonic())
+            for order in list(self._orders.values()):
+                if order["status"] == "WORKING" and _symbol(order) == symbol:
+                    self._execute(order)
+            stream = self._stream
+        if stream is None:
+            return
+        fields = {"BID_PRICE": bid, "ASK_PRICE": ask, "LAST_PRICE": last}
+        fields = {name: value for name, value in fields.items() if value is not None}
+        stream.push(symbol, **fields)
+
+    def quote_stream(self):
+        """Returns a stream of the quotes set from now on, for a QuoteStreamer's
+        stream_factory. The streamer calls it again to reconnect, so the new stream
+        replaces the previous one, which is no longer read"""
+        stream = qc.FakeQuoteStream()
+        with self._lock:
+            self._stream = stream
+        return stream
+
+    def position(self, symbol):
+        """Returns quantity of symbol held"""
+        with self._lock:
+            return self._positions.get(symbol, [0.0])[0]
+
+    # tda.client.Client methods
+
+    def place_order(self, account_id, order_spec):
+        spec = order_spec.build() if hasattr(order_spec, "build") else order_spec
+        # the account's copy is not changed by the caller's later edits
+        spec = json.loads(json.dumps(spec))
+        self._delay()
+        with self._lock:
+            error = self._check_account(account_id) or self._check_order(spec)
+            if error is not None:
+                self.rejections += 1
+                logging.info(f"Paper order rejected: {error}")
+                return SimulatedResponse(400, {"error": error})
+            entered = _now()
+            order = self._enter(spec, "WORKING", _timestamp(entered))
+            self._placed.append((entered, order))
+            self._execute(order)
+            if order["status"] == "WORKING" and order["duration"] == "FILL_OR_KILL":
+                self._cancel(order)
+            url = ORDER_URL.format(self.acct_num, order["orderId"])
+            return SimulatedResponse(201, location=url)
+
+    def cancel_order(self, order_id, account_id):
+        self._delay()
+        with self._lock:
+            error = self._check_account(account_id)
+            order = self._orders.get(str(order_id))
+            closed = order is None or order["status"] not in OPEN_STATUSES
+            if error is None and closed:
+                error = f"Order {order_id} cannot be canceled"
+            if error is not None:
+                return SimulatedResponse(400, {"error": error})
+            self._cancel(order)
+            return SimulatedResponse(200)
+
+    def get_order(self, order_id, account_id):
+        self._delay()
+        with self._lock:
+            order = self._orders.get(str(order_id))
+            if self._check_account(account_id) is not None or order is None:
+                return SimulatedResponse(404, {"error": f"Order {order_id} not found"})
+            return SimulatedResponse(200, order)
+
+    def get_account(self, account_id, *, fields=None):
+        self._delay()
+        with self._lock:
+            error = self._check_account(account_id)
+            if error is not None:
+                return SimulatedResponse(400, {"error": error})
+            account = {
+                "type": "MARGIN",
+                "accountId": self.acct_num,
+                "currentBalances": {"cashBalance": round(self.cash, 2)},
+            }
+            requested = _values(fields)
+            # TDA omits the positions of an account without positions
+            if "positions" in requested and self._positions:
+                account["positions"] = [
+                    {
+                        "instrument": {"assetType": "OPTION", "symbol": symbol},
+                        "longQuantity": quantity,
+                        "shortQuantity": 0.0,
+                        "averagePrice": round(price, 4),
+                    }
+                    for symbol, (quantity, price) in self._positions.items()
+                ]
+            if "orders" in requested:
+                account["orderStrategies"] = [order for _, order in self._placed]
+            return SimulatedResponse(200, {"securitiesAccount": account})
+
+    def get_orders_by_query(
+        self,
+        *,
+        max_results=None,
+        from_entered_datetime=None,
+        to_entered_datetime=None,
+        status=None,
+        statuses=None,
+    ):
+        self._delay()
+        start = _as_utc(from_entered_datetime)
+        end = _as_utc(to_entered_datetime)
+        wanted = _values(statuses) | _values(status)
+        with self._lock:
+            orders = []
+            # TDA lists the most recently entered orders first
+            for entered, order in reversed(self._placed):
+                if start is not None and entered < start:
+                    continue
+                if end is not None and entered > end:
+                    continue
+                if wanted and order["status"] not in wanted:
+                    continue
+                orders.append(order)
+            return SimulatedResponse(200, orders[:max_results])
+
+    def get_quote(self, symbol):
+        self._delay()
+        with self._lock:
+            quote = self._quotes.get(symbol)
+            if quote is None:
+                # TDA answers symbols it does not quote with an empty object
+                return SimulatedResponse(200, {})
+            data = {
+                "symbol": symbol,
+                "bidPrice": quote.bid,
+                "askPrice": quote.ask,
+                "lastPrice": quote.last,
+            }
+            return SimulatedResponse(200, {symbol: data})
+
+    def get_option_chain(self, symbol, *, from_date=None, to_date=None, **kwargs):
+        """Returns chain of the priced contracts of symbol expiring between the
+        dates. Other filters are ignored"""
+        self._delay()
+        chain = {"symbol": symbol, "status": "SUCCESS"}
+        chain.update({map_key: {} for map_key in CONTRACT_MAPS.values()})
+        with self._lock:
+            for option_symbol, quote in self._quotes.items():
+                match = OPTION_SYMBOL.match(option_symbol)
+                if match is None or match.group(1) != symbol:
+                    continue
+                expiration = datetime.datetime.strptime(match.group(2), "%m%d%y")
+                expiration = expiration.date()
+                if from_date is not None and expiration < _as_date(from_date):
+                    continue
+                if to_date is not None and expiration > _as_date(to_date):
+                    continue
+                contract = {"symbol": option_symbol, "bid": quote.bid, "ask": quote.ask}
+                exp_key = f"{expiration.isoformat()}:0"
+                strikes = chain[CONTRACT_MAPS[match.group(3)]].setdefault(exp_key, {})
+                strikes[str(float(match.group(4)))] = [contract]
+        return SimulatedResponse(200, chain)
+
+    def ensure_updated_refresh_token(self, update_interval_seconds=None):
+        return False
+
+    # order matching
+
+    def _delay(self):
+        with self._lock:
+            self.requests += 1
+        seconds = self._rng.uniform(*self._latency)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _check_account(self, account_id):
+        if str(account_id) != str(self.acct_num):
+            return f"Unknown account {account_id}"
+        return None
+
+    def _check_order(self, spec):
+        """Returns reason spec is rejected or None if it is accepted"""
+        strategy = spec.get("orderStrategyType")
+        children = spec.get("childOrderStrategies", [])
+        if strategy not in ("SINGLE", "TRIGGER"):
+            return f"Unsupported order strategy {strategy}"
+        if (strategy == "TRIGGER") != bool(children):
+            return "Only TRIGGER orders have child orders"
+        for order in [spec] + children:
+            legs = order.get("orderLegCollection", [])
+            if len(legs) != 1 or legs[0]["instruction"] not in INSTRUCTIONS:
+                return "Only single-leg BTO and STC orders are simulated"
+            if order.get("orderType") not in ORDER_TYPES:
+                return f"Unsupported order type {order.get('orderType')}"
+            if legs[0]["quantity"] <= 0:
+                return "Order quantity must be positive"
+        leg = spec["orderLegCollection"][0]
+        symbol = leg["instrument"]["symbol"]
+        if leg["instruction"] == "SELL_TO_CLOSE":
+            available = self.position(symbol) - self._selling(symbol)
+            if leg["quantity"] > available:
+                return f"Sell of {leg['quantity']} {symbol} exceeds {available} held"
+        elif spec["orderType"] == "LIMIT":
+            cost = float(spec["price"]) * leg["quantity"] * 100
+            if cost > self.cash:
+                return f"Order cost {cost:.2f} exceeds cash {self.cash:.2f}"
+        return None
+
+    def _selling(self, symbol):
+        """Returns quantity of symbol working sell orders are selling"""
+        return sum(
+            order["remainingQuantity"]
+            for order in self._orders.values()
+            if order["status"] == "WORKING"
+            and _symbol(order) == symbol
+            and order["orderLegCollection"][0]["instruction"] == "SELL_TO_CLOSE"
+        )
+
+    def _enter(self, spec, status, entered):
+        order_id = next(self._ids)
+        quantity = float(spec["orderLegCollection"][0]["quantity"])
+        order = dict(
+            spec,
+            orderId=order_id,
+            accountId=self.acct_num,
+            status=status,
+            enteredTime=entered,
+            quantity=quantity,
+            filledQuantity=0.0,
+            remainingQuantity=quantity,
+        )
+        order.setdefault("duration", "DAY")
+        order["childOrderStrategies"] = [
+            self._enter(child, "AWAITING_PARENT_ORDER", entered)
+            for child in spec.get("childOrderStrategies", [])
+        ]
+        if not order["childOrderStrategies"]:
+            del order["childOrderStrategies"]
+        self._orders[str(order_id)] = order
+        return order
+
+    def _fill_price(self, order, quote):
+        """Returns price order fills at against quote or None if it does not"""
+        if quote is None:
+            return None
+        order_type = order["orderType"]
+        if order["orderLegCollection"][0]["instruction"] == "BUY_TO_OPEN":
+            if quote.ask is None:
+                return None
+            if order_type == "LIMIT":
+                return quote.ask if quote.ask <= float(order["price"]) else None
+            return quote.ask * (1 + self._slippage)
+        if quote.bid is None:
+            return None
+        if order_type == "LIMIT":
+            return quote.bid if quote.bid >= float(order["price"]) else None
+        if order_type == "STOP" and quote.bid > float(order["stopPrice"]):
+            return None
+        return quote.bid * (1 - self._slippage)
+
+    def _execute(self, order):
+        """Fill working order if the current quote reaches it"""
+        price = self._fill_price(order, self._quotes.get(_symbol(order)))
+        if price is not None:
+            self._fill(order, price)
+
+    def _fill(self, order, price):
+        symbol = _symbol(order)
+        quantity = order["remainingQuantity"]
+        held, average = self._positions.get(symbol, [0.0, 0.0])
+        if order["orderLegCollection"][0]["instruction"] == "BUY_TO_OPEN":
+            self.cash -= price * quantity * 100
+            self._positions[symbol] = [
+                held + quantity,
+                (held * average + quantity * price) / (held + quantity),
+            ]
+        elif quantity > held:
+            # the position was sold by another order first
+            self._close(order, "REJECTED")
+            return
+        else:
+            self.cash += price * quantity * 100
+            if quantity == held:
+                del self._positions[symbol]
+            else:
+                self._positions[symbol] = [held - quantity, average]
+        filled = _timestamp(_now())
+        execution = {"price": round(price, 2), "quantity": quantity, "time": filled}
+        order.update(
+            status="FILLED",
+            filledQuantity=quantity,
+            remainingQuantity=0.0,
+            closeTime=filled,
+            orderActivityCollection=[
+                {
+                    "activityType": "EXECUTION",
+                    "executionType": "FILL",
+                    "quantity": quantity,
+                    "executionLegs": [execution],
+                }
+            ],
+        )
+        self.fills += 1
+        for child in order.get("childOrderStrategies", []):
+            child["status"] = "WORKING"
+            self._execute(child)
+
+    def _cancel(self, order):
+        self._close(order, "CANCELED")
+
+    def _close(self, order, status):
+        """Close order and the children it would have triggered"""
+        order["status"] = status
+        order["closeTime"] = _timestamp(_now())
+        for child in order.get("childOrderStrategies", []):
+            if child["status"] in OPEN_STATUSES:
+                self._close(child, "CANCELED")
+
+
+def _symbol(order):
+    return order["orderLegCollection"][0]["instrument"]["symbol"]
+
+
+def _as_utc(dt):
+    """Returns dt as timezone-aware datetime. Naive datetimes are UTC"""
+    if dt is None or dt.tzinfo is not None:
+        return dt
+    return dt.replace(tzinfo=datetime.timezone.utc)
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
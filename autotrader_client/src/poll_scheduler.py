@@ -0,0 +1,112 @@
+"""Exchange calendar and polling scheduler shared by the client workers. Workers poll
+quickly while the market is open and back off while it is closed"""
+
+import time
+import asyncio
+import datetime
+from dateutil import easter, tz
+from dateutil.relativedelta import relativedelta, MO, TH
+
+EXCHANGE_TZ = tz.gettz("America/New_York")
+PRE_MARKET_OPEN = datetime.time(4, 0)
+REGULAR_OPEN = datetime.time(9, 30)
+REGULAR_CLOSE = datetime.time(16, 0)
+AFTER_HOURS_CLOSE = datetime.time(20, 0)
+
+
+def observed(date):
+    """Returns the weekday a holiday falling on a weekend is observed on"""
+    if date.weekday() == 5:
+        return date - datetime.timedelta(days=1)
+    elif date.weekday() == 6:
+        return date + datetime.timedelta(days=1)
+    return date
+
+
+def nyse_holidays(year):
+    """Returns set of datetime.date objects the NYSE is closed for in year"""
+    holidays = {
+        datetime.date(year, 1, 1) + relativedelta(weekday=MO(+3)),
+        datetime.date(year, 2, 1) + relativedelta(weekday=MO(+3)),
+        easter.easter(year) - datetime.timedelta(days=2),  # Good Friday
+        datetime.date(year, 5, 31) + relativedelta(weekday=MO(-1)),
+        observed(datetime.date(year, 7, 4)),
+        datetime.date(year, 9, 1) + relativedelta(weekday=MO(+1)),
+        datetime.date(year, 11, 1) + relativedelta(weekday=TH(+4)),
+        observed(datetime.date(year, 12, 25)),
+    }
+    # NYSE does not observe New Year's Day on the prior Friday
+    new_years = observed(datetime.date(year, 1, 1))
+    if new_years.year == year:
+        holidays.add(new_years)
+    if year >= 2022:
+        holidays.add(observed(datetime.date(year, 6, 19)))
+    return holidays
+
+
+def is_trading_day(date):
+    """Returns True if the exchange is open on datetime.date, else False"""
+    return date.weekday() < 5 and date not in nyse_holidays(date.year)
+
+
+def market_session(dt=None):
+    """Returns "regular", "extended" or "closed" for timezone-aware datetime.
+    Defaults to the current time"""
+    if dt is None:
+        dt = datetime.datetime.now(datetime.timezone.utc)
+    local = dt.astimezone(EXCHANGE_TZ)
+    if not is_trading_day(local.date()):
+        return "closed"
+    if REGULAR_OPEN <= local.time() < REGULAR_CLOSE:
+        return "regular"
+    elif PRE_MARKET_OPEN <= local.time() < AFTER_HOURS_CLOSE:
+        return "extended"
+    return "closed"
+
+
+def next_session_open(dt=None):
+    """Returns timezone-aware datetime of the next extended-hours session open
+    after datetime dt. Defaults to the current time"""
+    if dt is None:
+        dt = datetime.datetime.now(datetime.timezone.utc)
+    local = dt.astimezone(EXCHANGE_TZ)
+    date = local.date()
+    if local.time() >= PRE_MARKET_OPEN:
+        date += datetime.timedelta(days=1)
+    while not is_trading_day(date):
+        date += datetime.timedelta(days=1)
+    naive_open = datetime.datetime.combine(date, PRE_MARKET_OPEN)
+    return naive_open.replace(tzinfo=EXCHANGE_TZ)
+
+
+class PollScheduler:
+    """Decides how long workers sleep between polls. Polls at active_interval
+    while the market is open or shortly after activity, otherwise at
+    closed_interval, but never sleeps past the next session open"""
+
+    def __init__(self, active_interval=0.15, closed_interval=120, activity_window=300):
+        self._active_interval = active_interval
+        self._closed_interval = closed_interval
+        self._activity_window = activity_window
+        self._last_activity = None
+
+    def notify_activity(self):
+        """Record that a worker saw activity so polling switches to fast"""
+        self._last_activity = time.monotonic()
+
+    def _recently_active(self):
+        if self._last_activity is None:
+            return False
+        return time.monotonic() - self._last_activity < self._activity_window
+
+    def interval(self, now=None):
+        """Returns number of seconds to sleep before the next poll"""
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        if self._recently_active() or market_session(now) != "closed":
+            return self._active_interval
+        until_open = (next_session_open(now) - now).total_seconds()
+        return max(min(self._closed_interval, until_open), self._active_interval)
+
+    async def sleep(self):
+        await asyncio.sleep(self.interval())
@@ -0,0 +1,114 @@
+"""In-memory book of account positions so STC orders do not need to download the
+whole account"""
+
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+import src.ameritrade_orders as am_ord
+
+
+class PositionBook:
+    """Long quantity of each position keyed by symbol. The book is seeded and
+    corrected by reconcile() and kept current between reconciliations by the
+    client's own fills. A symbol is unknown until the book is seeded and while a
+    fill the client cannot observe, such as a BTO limit order, is pending"""
+
+    def __init__(self):
+        self._positions = {}
+        self._pending = set()  # symbols with fills not yet reflected
+        self._touched = {}  # symbol: time of last local update
+        self._lock = threading.Lock()  # orders run on several execution threads
+        self.seeded = False
+        self.last_reconcile = None
+
+    def is_known(self, symbol):
+        """Returns True if the book can answer for symbol without a fetch"""
+        with self._lock:
+            return self.seeded and symbol not in self._pending
+
+    def quantity(self, symbol):
+        """Returns long quantity held for symbol or None if none is held"""
+        with self._lock:
+            return self._positions.get(symbol)
+
+    def symbols(self):
+        """Returns list of symbols held"""
+        with self._lock:
+            return list(self._positions)
+
+    def set_quantity(self, symbol, quantity):
+        """Record quantity fetched for symbol. None or 0 means none is held"""
+        with self._lock:
+            self._set(symbol, quantity)
+            self._pending.discard(symbol)
+
+    def expect_fill(self, symbol):
+        """Mark symbol unknown until its quantity is fetched or reconciled"""
+        with self._lock:
+            self._pending.add(symbol)
+            self._touched[symbol] = time.time()
+
+    def apply_fill(self, symbol, quantity):
+        """Add quantity (negative for sales) to the position held for symbol"""
+        with self._lock:
+            self._set(symbol, (self._positions.get(symbol) or 0) + quantity)
+
+    def _set(self, symbol, quantity):
+        self._store(symbol, quantity)
+        self._touched[symbol] = time.time()
+
+    def _store(self, symbol, quantity):
+        if quantity:
+            self._positions[symbol] = quantity
+        else:
+            self._positions.pop(symbol, None)
+
+    def reconcile(self, positions, fetched_at):
+        """Replace the book with positions from the account. Symbols updated
+        locally after fetched_at, when the fetch started, are left alone"""
+        fetched = {
+            position["instrument"]["symbol"]: float(position["longQuantity"])
+            for position in positions
+        }
+        with self._lock:
+            for symbol in set(self._positions) | set(fetched):
+                if self._touched.get(symbol, 0) > fetched_at:
+                    continue
+                if self.seeded and self._positions.get(symbol) != fetched.get(symbol):
+                    logging.info(
+                        f"Position {symbol} corrected from "
+                        f"{self._positions.get(symbol)} to {fetched.get(symbol)}"
+                    )
+                self._store(symbol, fetched.get(symbol))
+            self._pending = {s for s in self._pending if self._touched[s] > fetched_at}
+            self._touched = {s: t for s, t in self._touched.items() if t > fetched_at}
+            self.seeded = True
+            self.last_reconcile = fetched_at
+
+
+class PositionReconciler:
+    """Seeds an ExecutionContext's position book from the account and then
+    reconciles it every interval seconds"""
+
+    def __init__(self, context, interval=60):
+        self._context = context
+        self._interval = interval
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="position_reconciler"
+        )
+
+    def _reconcile(self):
+        fetched_at = time.time()
+        positions = am_ord.get_positions(self._context.client, self._context.acct_num)
+        self._context.positions.reconcile(positions, fetched_at)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(self._executor, self._reconcile)
+            except Exception:
+                logging.exception("Position reconciliation failed")
+            await asyncio.sleep(self._interval)
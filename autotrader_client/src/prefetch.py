@@ -0,0 +1,79 @@
+"""Speculative TDA lookups started as soon as a signal is read, so an order's
+network round trips overlap with validation and time spent queued"""
+
+import asyncio
+import logging
+import concurrent.futures
+import src.validate_params as vp
+import src.ameritrade_orders as am_ord
+
+
+class Prefetcher:
+    """Starts the lookups an order will need from an ExecutionContext's client
+    before the signal is validated. STC signals fetch the position quantity and
+    existing STC orders and BTO signals fetch the contract's quote. Lookups for
+    signals that turn out to be invalid are discarded"""
+
+    def __init__(self, context, max_workers=4):
+        self._context = context
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+        self.started = 0
+        self.discarded = 0
+
+    def start(self, order_params):
+        """Returns future of the lookups for order_params, or None if the signal
+        has no known instruction"""
+        try:
+            instruction = order_params["instruction"]
+        except (KeyError, TypeError):
+            return None
+        if instruction not in ("BTO", "STC"):
+            return None
+        self.started += 1
+        return self._executor.submit(self._fetch, instruction, order_params)
+
+    def discard(self, prefetch):
+        """Give up on a prefetch whose result will not be used"""
+        if prefetch is not None:
+            prefetch.cancel()
+            self.discarded += 1
+
+    def _fetch(self, instruction, order_params):
+        # signals failing to reformat fail validation too
+        symbol = am_ord.build_option_symbol(vp.reformat_params(order_params))
+        context = self._context
+        if instruction == "STC":
+            return am_ord.get_stc_state(
+                context.client,
+                context.acct_num,
+                symbol,
+                context.positions,
+                context.orders,
+            )
+        return am_ord.get_quote(context.client, symbol)
+
+
+def result(prefetch):
+    """Returns result of a prefetch, waiting for it if needed, or None if there is
+    none or it failed"""
+    if prefetch is None or prefetch.cancelled():
+        return None
+    try:
+        return prefetch.result()
+    except Exception as err:
+        logging.info(f"Prefetch failed, looking up at order time: {err!r}")
+        return None
+
+
+async def result_async(prefetch):
+    """Returns result of a prefetch like result() without blocking the event
+    loop"""
+    if prefetch is None or prefetch.cancelled():
+        return None
+    try:
+        return await asyncio.wrap_future(prefetch)
+    except Exception as err:
+        logging.info(f"Prefetch failed, looking up at order time: {err!r}")
+        return None
@@ -0,0 +1,176 @@
+"""Option quotes kept current by the TDA streaming API, so orders can be priced
+from the live bid and ask without a REST quote request"""
+
+import time
+import asyncio
+import logging
+import threading
+import collections
+import tda
+import src.seen_cache as sc
+
+Quote = collections.namedtuple("Quote", ["bid", "ask", "last", "received"])
+# streamed level one option fields and the Quote fields they update
+STREAM_FIELDS = {"BID_PRICE": "bid", "ASK_PRICE": "ask", "LAST_PRICE": "last"}
+
+
+def quote_from_rest(quote):
+    """Returns Quote from a TDA REST quote dict or None if it has no prices"""
+    if not quote:
+        return None
+    return Quote(
+        quote.get("bidPrice"), quote.get("askPrice"), quote.get("lastPrice"), None
+    )
+
+
+class QuoteCache:
+    """Latest streamed quote of each watched symbol. Symbols are watched from
+    when they are signaled until watch_window seconds later, and while they are
+    held. A quote is fresh while the stream is connected and for max_age seconds
+    after its last update"""
+
+    def __init__(self, max_age=30, watch_window=8 * 3600):
+        self._max_age = max_age
+        self._quotes = {}
+        self._watched = sc.TimeWindowSet(watch_window)
+        self._lock = threading.Lock()  # orders run on several execution threads
+        self.connected = False
+
+    def watch(self, symbol):
+        """Stream quotes for a signaled symbol"""
+        with self._lock:
+            self._watched.add(symbol)
+
+    def watched(self, held=()):
+        """Returns set of symbols to stream, the signaled symbols and held"""
+        with self._lock:
+            self._watched.prune()
+            return set(self._watched) | set(held)
+
+    def update(self, symbol, fields):
+        """Merge streamed fields into symbol's quote. The stream only sends
+        fields that changed"""
+        with self._lock:
+            quote = self._quotes.get(symbol, Quote(None, None, None, None))
+            changes = {
+                STREAM_FIELDS[name]: value
+                for name, value in fields.items()
+                if name in STREAM_FIELDS
+            }
+            self._quotes[symbol] = quote._replace(received=time.monotonic(), **changes)
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        """Forget quotes, which go stale while the stream is down"""
+        with self._lock:
+            self.connected = False
+            self._quotes.clear()
+
+    def fresh(self, symbol):
+        """Returns symbol's quote if it is fresh, else None"""
+        with self._lock:
+            quote = self._quotes.get(symbol)
+            if not self.connected or quote is None:
+                return None
+            if time.monotonic() - quote.received > self._max_age:
+                return None
+            return quote
+
+
+class QuoteStreamer:
+    """Streams level one option quotes for the symbols an ExecutionContext's
+    quote cache watches and the positions it holds into the cache. The
+    subscription is updated every interval seconds and the stream reconnects
+    after errors. stream_factory, if provided, returns the stream client to use
+    instead of a tda StreamClient"""
+
+    def __init__(self, context, interval=1, reconnect_delay=5, stream_factory=None):
+        self._context = context
+        self._interval = interval
+        self._reconnect_delay = reconnect_delay
+        self._stream_factory = stream_factory or self._tda_stream
+        self.subscribed = set()
+        self.messages = 0
+
+    def _tda_stream(self):
+        client = self._context.async_client or self._context.client
+        return tda.streaming.StreamClient(
+            client, account_id=int(self._context.acct_num)
+        )
+
+    def _on_quotes(self, msg):
+        for content in msg.get("content", []):
+            self._context.quotes.update(content["key"], content)
+        self.messages += 1
+
+    async def _subscribe(self, stream):
+        fields = tda.streaming.StreamClient.LevelOneOptionFields
+        while True:
+            wanted = self._context.quotes.watched(self._context.positions.symbols())
+            if wanted and wanted != self.subscribed:
+                # a subscription replaces the previous one
+                await stream.level_one_option_subs(
+                    sorted(wanted),
+                    fields=[
+                        fields.SYMBOL,
+                        fields.BID_PRICE,
+                        fields.ASK_PRICE,
+                        fields.LAST_PRICE,
+                    ],
+                )
+                self.subscribed = wanted
+            await asyncio.sleep(self._interval)
+
+    async def _receive(self, stream):
+        while True:
+            await stream.handle_message()
+
+    async def _stream(self):
+        stream = self._stream_factory()
+        await stream.login()
+        stream.add_level_one_option_handler(self._on_quotes)
+        self.subscribed = set()
+        self._context.quotes.connect()
+        await asyncio.gather(self._subscribe(stream), self._receive(stream))
+
+    async def run(self):
+        while True:
+            try:
+                await self._stream()
+            except Exception:
+                logging.exception("Quote stream failed, reconnecting")
+            finally:
+                self._context.quotes.disconnect()
+            await asyncio.sleep(self._reconnect_delay)
+
+
+class FakeQuoteStream:
+    """Stands in for a tda StreamClient without a network connection. Quotes
+    pushed with push() are delivered to the handlers of subscribed symbols"""
+
+    def __init__(self):
+        self.logged_in = False
+        self.subscriptions = []
+        self._handlers = []
+        self._messages = asyncio.Queue()
+
+    async def login(self):
+        self.logged_in = True
+
+    def add_level_one_option_handler(self, handler):
+        self._handlers.append(handler)
+
+    async def level_one_option_subs(self, symbols, *, fields=None):
+        self.subscriptions.append(list(symbols))
+
+    def push(self, symbol, **fields):
+        """Queue a quote update, such as push(symbol, BID_PRICE=1.95)"""
+        self._messages.put_nowait(dict(fields, key=symbol))
+
+    async def handle_message(self):
+        content = await self._messages.get()
+        if self.subscriptions and content["key"] in self.subscriptions[-1]:
+            for handler in self._handlers:
+                handler({"service": "OPTION", "content": [content]})
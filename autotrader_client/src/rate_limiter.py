@@ -0,0 +1,184 @@
+"""Client-side limit on the rate of TDA API requests, so a burst of signals is
+slowed down instead of failing on TDA's per-minute limit"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import concurrent.futures
+
+# priority lanes, lower is served first
+ORDER = 0
+QUERY = 1
+# client methods that change orders and that query. Other methods, such as token
+# upkeep, are not API requests and are not limited
+ORDER_METHODS = ("place_order", "replace_order", "cancel_order")
+QUERY_PREFIXES = ("get_", "search_")
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second up to capacity tokens. Each
+    request takes a token. Waiting requests are served by priority and then in
+    arrival order. Threads and coroutines can share one bucket"""
+
+    def __init__(self, rate, capacity):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._waiting = []  # heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self.acquired = 0
+        self.throttled = 0  # requests that had to wait for a token
+
+    def acquire(self, priority=QUERY):
+        """Block until a token is taken"""
+        ticket = self._enqueue(priority)
+        try:
+            with self._cond:
+                wait = self._take(ticket)
+                if wait:
+                    self.throttled += 1
+                while wait:
+                    self._cond.wait(wait)
+                    wait = self._take(ticket)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    async def acquire_async(self, priority=QUERY):
+        """Wait on the event loop until a token is taken"""
+        ticket = self._enqueue(priority)
+        try:
+            with self._cond:
+                wait = self._take(ticket)
+                if wait:
+                    self.throttled += 1
+            while wait:
+                await asyncio.sleep(wait)
+                with self._cond:
+                    wait = self._take(ticket)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    def _enqueue(self, priority):
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            return ticket
+
+    def _cancel(self, ticket):
+        with self._cond:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def _take(self, ticket):
+        """Take a token for ticket if it is next in line and one is available.
+        Returns 0 if taken, else seconds until the next token. Caller holds the
+        lock"""
+        now = time.monotonic()
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+        if self._waiting[0] == ticket and self._tokens >= 1:
+            heapq.heappop(self._waiting)
+            self._tokens -= 1
+            self.acquired += 1
+            # the next ticket in line may be able to go
+            self._cond.notify_all()
+            return 0
+        return max((1 - self._tokens) / self._rate, 0.001)
+
+
+class RateLimitedClient:
+    """Wraps a tda client so every API request takes a token from bucket first.
+    use_async must be True for a tda asyncio client. Order requests use the ORDER
+    lane and queries the QUERY lane. An identical query already in flight is
+    shared instead of being sent again. last_request is the time.time() the last
+    request was sent. Other attributes pass through to the client"""
+
+    def __init__(self, client, bucket, use_async=False):
+        self._client = client
+        self._bucket = bucket
+        self._use_async = use_async
+        self._lock = threading.Lock()
+        self._in_flight = {}  # query key: future of its response
+        self.coalesced = 0
+        self.last_request = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in ORDER_METHODS:
+            priority = ORDER
+        elif name.startswith(QUERY_PREFIXES):
+            priority = QUERY
+        else:
+            return attr
+        if self._use_async:
+            return self._async_request(name, attr, priority)
+        return self._request(name, attr, priority)
+
+    @staticmethod
+    def _key(name, args, kwargs):
+        return name, repr(args), repr(sorted(kwargs.items()))
+
+    def _request(self, name, method, priority):
+        def request(*args, **kwargs):
+            if priority != QUERY:
+                self._bucket.acquire(priority)
+                self.last_request = time.time()
+                return method(*args, **kwargs)
+            key = self._key(name, args, kwargs)
+            with self._lock:
+                future = self._in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = concurrent.futures.Future()
+                    self._in_flight[key] = future
+                else:
+                    self.coalesced += 1
+            if not leader:
+                return future.result()
+            try:
+                self._bucket.acquire(priority)
+                self.last_request = time.time()
+                response = method(*args, **kwargs)
+            except BaseException as err:
+                future.set_exception(err)
+                raise
+            else:
+                future.set_result(response)
+                return response
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+
+        return request
+
+    def _async_request(self, name, method, priority):
+        async def send(args, kwargs):
+            await self._bucket.acquire_async(priority)
+            self.last_request = time.time()
+            return await method(*args, **kwargs)
+
+        async def request(*args, **kwargs):
+            if priority != QUERY:
+                return await send(args, kwargs)
+            key = self._key(name, args, kwargs)
+            task = self._in_flight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(send(args, kwargs))
+                self._in_flight[key] = task
+                task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            else:
+                self.coalesced += 1
+            # one caller giving up does not cancel the request for the others
+            return await asyncio.shield(task)
+
+        return request
@@ -0,0 +1,60 @@
+"""Bounded set used by OrderMonitor to remember which signal files it has seen"""
+
+import time
+import collections
+
+
+class TimeWindowSet:
+    """Set of names with the timestamp each was seen at. Names older than window
+    seconds before a high-water mark are evicted by prune(), and the oldest names
+    are evicted once the set holds max_size names, so memory stays flat however
+    long the client runs"""
+
+    def __init__(self, window=3600, max_size=10000):
+        self._window = window
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def add(self, name, timestamp=None):
+        """Add name seen at timestamp (seconds since epoch). Defaults to now"""
+        if timestamp is None:
+            timestamp = time.time()
+        self._entries[name] = timestamp
+        self._entries.move_to_end(name)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def update(self, names):
+        """Add names from an iterable, or from a mapping of name to datetime"""
+        if isinstance(names, dict):
+            for name, dt in sorted(names.items(), key=lambda item: item[1]):
+                self.add(name, dt.timestamp())
+        else:
+            for name in names:
+                self.add(name)
+
+    def prune(self, high_water=None):
+        """Evict names seen more than window seconds before high_water (seconds
+        since epoch, defaults to now). Names are added in roughly time order, so
+        eviction stops at the first name still inside the window. Returns number
+        of names evicted"""
+        if high_water is None:
+            high_water = time.time()
+        cutoff = high_water - self._window
+        evicted = 0
+        while self._entries:
+            name, ts = next(iter(self._entries.items()))
+            if ts >= cutoff:
+                break
+            del self._entries[name]
+            evicted += 1
+        return evicted
@@ -0,0 +1,125 @@
+"""Storage backends for the signal bucket. GCSBackend talks to Google Cloud Storage
+and MemoryBackend is an in-process stand-in for tests and benchmarks"""
+
+import abc
+import time
+import datetime
+import threading
+import collections
+
+BlobInfo = collections.namedtuple("BlobInfo", ["name", "time_created"])
+
+
+class StorageBackend(abc.ABC):
+    """Interface to the object storage the signal bucket lives in. Backends
+    missing any method cannot be instantiated"""
+
+    @abc.abstractmethod
+    def list_blobs(self, bucket_name, prefix=None):
+        """Returns iterable of BlobInfo for blobs in bucket whose name starts
+        with prefix"""
+
+    @abc.abstractmethod
+    def download_bytes(self, bucket_name, blob_name):
+        """Returns blob contents as bytes. Raises FileNotFoundError if the blob
+        does not exist"""
+
+    @abc.abstractmethod
+    def upload_bytes(self, bucket_name, blob_name, data, content_type=None):
+        """Uploads bytes as a blob, replacing any blob with the same name"""
+
+    @abc.abstractmethod
+    def delete_blob(self, bucket_name, blob_name):
+        """Deletes a blob. Raises FileNotFoundError if the blob does not exist"""
+
+
+class GCSBackend(StorageBackend):
+    """Storage backend for a google.cloud.storage.Client. Missing blobs raise
+    FileNotFoundError like the other backends"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def list_blobs(self, bucket_name, prefix=None):
+        for blob in self._client.list_blobs(bucket_name, prefix=prefix):
+            yield BlobInfo(blob.name, blob.time_created)
+
+    def download_bytes(self, bucket_name, blob_name):
+        from google.api_core.exceptions import NotFound
+
+        blob = self._client.bucket(bucket_name).blob(blob_name)
+        try:
+            return blob.download_as_bytes()
+        except NotFound:
+            raise FileNotFoundError(f"{bucket_name}/{blob_name}") from None
+
+    def upload_bytes(self, bucket_name, blob_name, data, content_type=None):
+        blob = self._client.bucket(bucket_name).blob(blob_name)
+        blob.upload_from_string(data, content_type=content_type)
+
+    def delete_blob(self, bucket_name, blob_name):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self._client.bucket(bucket_name).blob(blob_name).delete()
+        except NotFound:
+            raise FileNotFoundError(f"{bucket_name}/{blob_name}") from None
+
+
+class MemoryBackend(StorageBackend):
+    """In-memory storage backend. latency is added to every request in seconds
+    and list_cost is added for every blob a listing returns"""
+
+    def __init__(self, latency=0.0, list_cost=0.0):
+        self.latency = latency
+        self.list_cost = list_cost
+        self.requests = collections.Counter()  # request counts by method
+        self._buckets = collections.defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def _request(self, method):
+        with self._lock:
+            self.requests[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def list_blobs(self, bucket_name, prefix=None):
+        self._request("list_blobs")
+        with self._lock:
+            blobs = [
+                BlobInfo(name, created)
+                for name, (data, created) in sorted(self._buckets[bucket_name].items())
+                if prefix is None or name.startswith(prefix)
+            ]
+        if self.list_cost:
+            time.sleep(self.list_cost * len(blobs))
+        return blobs
+
+    def download_bytes(self, bucket_name, blob_name):
+        self._request("download_bytes")
+        with self._lock:
+            try:
+                return self._buckets[bucket_name][blob_name][0]
+            except KeyError:
+                raise FileNotFoundError(f"{bucket_name}/{blob_name}") from None
+
+    def upload_bytes(self, bucket_name, blob_name, data, content_type=None):
+        self._request("upload_bytes")
+        self.put(bucket_name, blob_name, data)
+
+    def delete_blob(self, bucket_name, blob_name):
+        self._request("delete_blob")
+        with self._lock:
+            try:
+                del self._buckets[bucket_name][blob_name]
+            except KeyError:
+                raise FileNotFoundError(f"{bucket_name}/{blob_name}") from None
+
+    def put(self, bucket_name, blob_name, data, time_created=None):
+        """Store a blob directly without latency. Useful to seed tests"""
+        if isinstance(data, str):
+            data = data.encode()
+        if time_created is None:
+            time_created = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            self._buckets[bucket_name][blob_name] = (data, time_created)
@@ -0,0 +1,118 @@
+""" Worker class that refreshes the TDA access token ahead of expiry and keeps the
+TDA HTTP session warm so orders never wait on OAuth or a new connection"""
+
+import time
+import asyncio
+import logging
+import datetime
+import concurrent.futures
+import tda
+import src.poll_scheduler as ps
+
+
+class TokenRefresher:
+    """Refreshes the access token of an ExecutionContext's client once it is within
+    refresh_margin seconds of expiring. The context's asyncio client, if any, is
+    given each new token. During regular market hours the session orders are
+    placed on, the asyncio client's if there is one, is kept warm with a cheap
+    account request once it has sent no request for keepalive_interval seconds,
+    so busy sessions are not pinged and only one session is"""
+
+    def __init__(self, context, refresh_margin=300, keepalive_interval=4):
+        self._context = context
+        self._refresh_margin = refresh_margin
+        self._keepalive_interval = keepalive_interval
+        # token and account requests block, so they run off the event loop
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="token_refresher"
+        )
+        self.last_refresh = self._issued_at()
+        self.last_keepalive = 0.0
+        self.refreshes = 0
+        self.keepalives = 0
+        self.failures = 0
+
+    @property
+    def seconds_since_refresh(self):
+        """Returns seconds since the access token was last refreshed"""
+        return time.time() - self.last_refresh
+
+    def _issued_at(self):
+        """Returns time current access token was issued, or now if unknown"""
+        token = self._context.client.session.token
+        try:
+            return token["expires_at"] - token["expires_in"]
+        except (KeyError, TypeError):
+            return time.time()
+
+    def _refresh_due(self, now):
+        token = self._context.client.session.token
+        expires_at = token.get("expires_at")
+        return expires_at is None or expires_at - now <= self._refresh_margin
+
+    def _order_client(self):
+        """Returns the client orders are placed with"""
+        if self._context.async_client is not None:
+            return self._context.async_client
+        return self._context.client
+
+    def _keepalive_due(self, now):
+        # the client's own requests keep the session warm
+        last_request = max(self.last_keepalive, self._order_client().last_request)
+        if now - last_request < self._keepalive_interval:
+            return False
+        dt = datetime.datetime.fromtimestamp(now, tz=datetime.timezone.utc)
+        return ps.market_session(dt) == "regular"
+
+    def _refresh(self):
+        """Fetch a new access token. The session writes it to the token file"""
+        client = self._context.client
+        client.session.refresh_token(
+            tda.auth.TOKEN_ENDPOINT,
+            refresh_token=client.session.token["refresh_token"],
+        )
+        # the refresh token itself is replaced when it nears its 90 day expiry
+        client.ensure_updated_refresh_token()
+        self.refreshes += 1
+        logging.info(
+            f"Refreshed TDA access token {self.seconds_since_refresh:.0f} seconds "
+            "after the last refresh"
+        )
+        self.last_refresh = time.time()
+        async_client = self._context.async_client
+        if async_client is not None:
+            # saves the asyncio session a token request of its own
+            async_client.session.token = client.session.token
+
+    def _keep_alive(self):
+        self._context.client.get_account(self._context.acct_num)
+        self.keepalives += 1
+
+    async def _keep_alive_async(self):
+        await self._context.async_client.get_account(self._context.acct_num)
+        self.keepalives += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = time.time()
+            if self._refresh_due(now):
+                work = self._refresh
+            elif self._keepalive_due(now):
+                if self._context.async_client is not None:
+                    work = self._keep_alive_async
+                else:
+                    work = self._keep_alive
+                self.last_keepalive = now
+            else:
+                work = None
+            if work is not None:
+                try:
+                    if work == self._keep_alive_async:
+                        await work()
+                    else:
+                        await loop.run_in_executor(self._executor, work)
+                except Exception:
+                    self.failures += 1
+                    logging.exception("TDA session upkeep failed")
+            await asyncio.sleep(self._keepalive_interval)
@@ -0,0 +1,66 @@
+import json
+import datetime
+import src.compaction as compaction
+import src.storage_backend as sb
+from src.server_settings import SIGNAL_PREFIX, ACK_PREFIX, ARCHIVE_PREFIX
+
+NOW = datetime.datetime(2021, 3, 3, 15, 0, tzinfo=datetime.timezone.utc)
+OLD = NOW - datetime.timedelta(hours=30)
+
+
+def make_bucket():
+    backend = sb.MemoryBackend()
+    signals = [("acked.json", OLD, True), ("pending.json", OLD, False)]
+    signals.append(("recent.json", NOW - datetime.timedelta(hours=1), True))
+    for name, created, acked in signals:
+        backend.put("bucket", SIGNAL_PREFIX + name, json.dumps({"n": name}), created)
+        if acked:
+            backend.put("bucket", ACK_PREFIX + name, b"", created)
+    return backend
+
+
+def names(backend, prefix):
+    return [blob.name for blob in backend.list_blobs("bucket", prefix=prefix)]
+
+
+def test_compact_signals():
+    """Only old acknowledged signals are archived and removed"""
+    backend = make_bucket()
+    assert compaction.compact_signals(backend, "bucket", 24, now=NOW) == 1
+    assert names(backend, SIGNAL_PREFIX) == [
+        SIGNAL_PREFIX + "pending.json",
+        SIGNAL_PREFIX + "recent.json",
+    ]
+    assert names(backend, ACK_PREFIX) == [ACK_PREFIX + "recent.json"]
+    archive = ARCHIVE_PREFIX + "2021-03-02.ndjson"
+    assert names(backend, ARCHIVE_PREFIX) == [archive]
+    lines = backend.download_bytes("bucket", archive).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {
+            "name": "acked.json",
+            "time_created": OLD.isoformat(),
+            "signal": {"n": "acked.json"},
+        }
+    ]
+
+
+def test_compact_signals_appends_without_duplicates():
+    """Existing archives are appended to and never hold a signal twice"""
+    backend = make_bucket()
+    compaction.compact_signals(backend, "bucket", 24, now=NOW)
+    for name in ["acked.json", "second.json"]:
+        backend.put("bucket", SIGNAL_PREFIX + name, b"not json", OLD)
+        backend.put("bucket", ACK_PREFIX + name, b"", OLD)
+    assert compaction.compact_signals(backend, "bucket", 24, now=NOW) == 2
+    archive = backend.download_bytes("bucket", ARCHIVE_PREFIX + "2021-03-02.ndjson")
+    records = [json.loads(line) for line in archive.decode().splitlines()]
+    assert [record["name"] for record in records] == ["acked.json", "second.json"]
+    assert records[1]["signal"] == "not json"
+
+
+def test_compact_signals_removes_orphan_acks():
+    """Old acknowledgment markers without a signal are removed"""
+    backend = sb.MemoryBackend()
+    backend.put("bucket", ACK_PREFIX + "gone.json", b"", OLD)
+    compaction.compact_signals(backend, "bucket", 24, now=NOW)
+    assert names(backend, ACK_PREFIX) == []
@@ -0,0 +1,47 @@
+import os
+import json
+import tempfile
+import pytest
+import src.gcp_utils as gcp_utils
+import src.storage_backend as sb
+
+
+def test_upload_and_get_json_blob():
+    """JSON blobs round trip through the backend"""
+    backend = sb.MemoryBackend()
+    params = {"ticker": "SPY", "instruction": "BTO"}
+    gcp_utils.upload_as_gcp_blob("bucket", params, "SPY.json", backend=backend)
+    data = gcp_utils.get_gcp_blob("bucket", "SPY.json", backend=backend)
+    assert json.loads(data) == params
+
+
+def test_upload_non_json_blob():
+    """Blobs without a .json extension are uploaded as strings"""
+    backend = sb.MemoryBackend()
+    gcp_utils.upload_as_gcp_blob("bucket", {"a": 1}, "a.txt", backend=backend)
+    assert gcp_utils.get_gcp_blob("bucket", "a.txt", backend=backend) == b"{'a': 1}"
+
+
+def test_download_gcp_blob():
+    """Blobs are downloaded to the destination file"""
+    backend = sb.MemoryBackend()
+    backend.put("bucket", "token.json", b'{"token": 1}')
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, "token.json")
+        gcp_utils.download_gcp_blob("bucket", "token.json", dest, backend=backend)
+        with open(dest, "rb") as fp:
+            assert fp.read() == b'{"token": 1}'
+
+
+def test_partial_backend_cannot_be_created():
+    """A backend missing a storage method fails when created, not when called"""
+
+    class ReadOnlyBackend(sb.StorageBackend):
+        def list_blobs(self, bucket_name, prefix=None):
+            return []
+
+        def download_bytes(self, bucket_name, blob_name):
+            raise FileNotFoundError(blob_name)
+
+    with pytest.raises(TypeError):
+        ReadOnlyBackend()
@@ -0,0 +1,85 @@
+"""Compaction job that keeps the live signal prefix small. Signals the client has
+acknowledged are rolled into daily NDJSON archive objects and then deleted"""
+
+import json
+import datetime
+import logging
+from src.server_settings import SIGNAL_PREFIX, ACK_PREFIX, ARCHIVE_PREFIX
+
+
+def archive_name(time_created):
+    """Returns name of the daily archive object for a signal creation time"""
+    day = time_created.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d")
+    return f"{ARCHIVE_PREFIX}{day}.ndjson"
+
+
+def archive_record(name, time_created, data):
+    """Returns NDJSON line for a signal. Unparseable signals are kept verbatim"""
+    try:
+        signal = json.loads(data)
+    except ValueError:
+        signal = data.decode(errors="replace")
+    record = {"name": name, "time_created": time_created.isoformat(), "signal": signal}
+    return json.dumps(record)
+
+
+def append_to_archive(backend, bucket_name, archive, lines):
+    """Append NDJSON lines to an archive object, skipping signals it already holds.
+    Objects cannot be appended to, so the archive is rewritten"""
+    try:
+        existing = backend.download_bytes(bucket_name, archive).decode().splitlines()
+    except FileNotFoundError:
+        existing = []
+    archived = {json.loads(line)["name"] for line in existing}
+    new_lines = [line for line in lines if json.loads(line)["name"] not in archived]
+    if new_lines:
+        data = "\n".join(existing + new_lines) + "\n"
+        backend.upload_bytes(
+            bucket_name, archive, data, content_type="application/x-ndjson"
+        )
+
+
+def compact_signals(backend, bucket_name, max_age_hours, now=None):
+    """Archive and delete acknowledged signals older than max_age_hours along with
+    their acknowledgment markers. Returns number of signals compacted"""
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = now - datetime.timedelta(hours=max_age_hours)
+    acks = {
+        blob.name[len(ACK_PREFIX) :]: blob
+        for blob in backend.list_blobs(bucket_name, prefix=ACK_PREFIX)
+    }
+
+    by_archive = {}
+    live = set()
+    for blob in backend.list_blobs(bucket_name, prefix=SIGNAL_PREFIX):
+        name = blob.name[len(SIGNAL_PREFIX) :]
+        live.add(name)
+        if blob.time_created < cutoff and name in acks:
+            by_archive.setdefault(archive_name(blob.time_created), []).append(blob)
+
+    compacted = 0
+    for archive, blobs in sorted(by_archive.items()):
+        lines = [
+            archive_record(
+                blob.name[len(SIGNAL_PREFIX) :],
+                blob.time_created,
+                backend.download_bytes(bucket_name, blob.name),
+            )
+            for blob in blobs
+        ]
+        # originals are only deleted once the archive holds them
+        append_to_archive(backend, bucket_name, archive, lines)
+        for blob in blobs:
+            name = blob.name[len(SIGNAL_PREFIX) :]
+            backend.delete_blob(bucket_name, blob.name)
+            backend.delete_blob(bucket_name, acks.pop(name).name)
+            compacted += 1
+
+    # markers left behind by an interrupted run are removed once they are old
+    for name, ack in acks.items():
+        if ack.time_created < cutoff and name not in live:
+            backend.delete_blob(bucket_name, ack.name)
+
+    logging.info(f"Compacted {compacted} signals")
+    return compacted
@@ -1,7 +1,15 @@
+import asyncio
 import datetime
+import logging
 from discord.ext import commands
 import src.gcp_utils as utils
+import src.compaction as compaction
 import src.text_to_order_params as ttop
+from src.server_settings import (
+    SIGNAL_PREFIX,
+    COMPACTION_AGE_HOURS,
+    COMPACTION_INTERVAL,
+)
 
 
 class ListenerBot(commands.Bot):
@@ -12,6 +20,27 @@ class ListenerBot(commands.Bot):
         super().__init__(command_prefix)
         self.storage_bucket = storage_bucket
         self.author = author
+        self._compaction_task = None
+
+    async def on_ready(self):
+        # on_ready fires again after reconnects, so only start compaction once
+        if self._compaction_task is None:
+            self._compaction_task = self.loop.create_task(self.compact_periodically())
+
+    async def compact_periodically(self):
+        """Compact the signal bucket every COMPACTION_INTERVAL seconds"""
+        while True:
+            try:
+                await self.loop.run_in_executor(
+                    None,
+                    compaction.compact_signals,
+                    utils.default_backend(),
+                    self.storage_bucket,
+                    COMPACTION_AGE_HOURS,
+                )
+            except Exception as err:
+                logging.warning(f"Signal compaction failed: {err}")
+            await asyncio.sleep(COMPACTION_INTERVAL)
 
     async def on_message(self, message, author=None):
         order_params = ttop.text_to_order_params(message.content)
@@ -19,5 +48,5 @@ class ListenerBot(commands.Bot):
             dt_stamp = datetime.datetime.strftime(
                 datetime.datetime.now(datetime.timezone.utc), "%d-%b-%y_%H_%M_%S"
             )
-            blob_name = order_params["ticker"] + dt_stamp + ".json"
+            blob_name = SIGNAL_PREFIX + order_params["ticker"] + dt_stamp + ".json"
             utils.upload_as_gcp_blob(self.storage_bucket, order_params, blob_name)
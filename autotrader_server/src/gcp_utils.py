@@ -1,41 +1,43 @@
 """Google Cloud Platform (GCP) utility functions for autotrader_server"""
 
 
-def download_gcp_blob(bucket_name: str, source_blob_name: str, dest_file_name: str):
-    """Downloads a blob from the GCP bucket to destination file name"""
+def default_backend():
+    """Returns a storage backend for GCS using the default credentials"""
     from google.cloud import storage
+    import src.storage_backend as sb
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(source_blob_name)
-    blob.download_to_filename(dest_file_name)
+    return sb.GCSBackend(storage.Client())
 
 
-def get_gcp_blob(bucket_name: str, source_blob_name: str):
-    """Gets a blob as bytes object from the GCP bucket"""
-    from google.cloud import storage
+def download_gcp_blob(
+    bucket_name: str, source_blob_name: str, dest_file_name: str, backend=None
+):
+    """Downloads a blob from the GCP bucket to destination file name"""
+    backend = backend or default_backend()
+    with open(dest_file_name, "wb") as fp:
+        fp.write(backend.download_bytes(bucket_name, source_blob_name))
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(source_blob_name)
-    bytes_obj = blob.download_as_bytes()
-    return bytes_obj
+
+def get_gcp_blob(bucket_name: str, source_blob_name: str, backend=None):
+    """Gets a blob as bytes object from the GCP bucket"""
+    backend = backend or default_backend()
+    return backend.download_bytes(bucket_name, source_blob_name)
 
 
-def upload_as_gcp_blob(bucket_name: str, dictionary: dict, dest_blob_name: str):
-    """Uploads a string as a blob to the GCP bucket"""
+def upload_as_gcp_blob(
+    bucket_name: str, dictionary: dict, dest_blob_name: str, backend=None
+):
+    """Uploads a dictionary as a blob to the GCP bucket. Dictionaries are uploaded
+    as JSON if the blob name has a .json extension, else as a string"""
     import os
     import json
-    from google.cloud import storage
-
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(dest_blob_name)
 
+    backend = backend or default_backend()
     name, ext = os.path.splitext(dest_blob_name)
     if ext == ".json":
-        with open(dest_blob_name, "w+") as fp:
-            json.dump(dictionary, fp)
-        blob.upload_from_filename(dest_blob_name, content_type="application/json")
+        data = json.dumps(dictionary)
+        backend.upload_bytes(
+            bucket_name, dest_blob_name, data, content_type="application/json"
+        )
     else:
-        blob.upload_from_string(str(dictionary))
+        backend.upload_bytes(bucket_name, dest_blob_name, str(dictionary))
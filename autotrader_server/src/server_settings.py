@@ -3,3 +3,13 @@ ENV_KEY_BUCKET = "AT_BUCKET"
 DISCORD_TOKEN_LOC = "discord_bot.json"
 DISCORD_TOKEN_KEY = "discord_token"
 AUTHOR = None
+
+
+# Storage bucket layout
+SIGNAL_PREFIX = "signals/"  # live signals waiting to be processed
+ACK_PREFIX = "acks/"  # client acknowledgment markers
+ARCHIVE_PREFIX = "archive/"  # daily NDJSON archives of processed signals
+
+# Compaction
+COMPACTION_AGE_HOURS = 24  # processed signals older than this are archived
+COMPACTION_INTERVAL = 3600  # seconds between compaction runs